@@ -1,11 +1,13 @@
 # For use with Python doit.
 import os
 
-from simuran.main.doit import create_task, create_list_task
+from simuran.main.doit import create_task
 from skm_pyutils.py_config import read_cfg
 from doit.tools import title_with_actions
 from doit.task import clean_targets
 
+from lfp_atn_simuran.Scripts.cell_list_runner import load_batch_params, results_file
+
 here = os.path.dirname(os.path.abspath(__file__))
 cfg = read_cfg(os.path.join(here, "dodo.cfg"), verbose=False)
 num_workers = cfg.getint("DEFAULT", "num_workers")
@@ -13,6 +15,11 @@ dirname = cfg.get("DEFAULT", "dirname")
 main_cfg_path = cfg.get("DEFAULT", "cfg_path")
 overwrite = cfg.getboolean("DEFAULT", "overwrite")
 save = cfg.getboolean("DEFAULT", "save")
+# The decoded data cache is configured through the environment of each task
+os.environ["LFP_ATN_CACHE_DIR"] = cfg.get("DEFAULT", "cache_dir", fallback="")
+os.environ["LFP_ATN_CACHE_SIZE_GB"] = cfg.get(
+    "DEFAULT", "cache_size_gb", fallback="20"
+)
 kwargs = {
     "num_workers": num_workers,
     "dirname": dirname,
@@ -22,6 +29,32 @@ kwargs = {
 }
 
 
+def create_cell_list_task(batch_file, dependencies, reason):
+    """Run a multi_runs batch file over its cell list, one recording at a time."""
+    scripts = os.path.join(here, "lfp_atn_simuran", "Scripts")
+    runner = os.path.join(scripts, "cell_list_runner.py")
+    file_dep = [batch_file, runner] + [os.path.join(scripts, d) for d in dependencies]
+
+    action = (
+        f'python "{runner}" "{batch_file}" -cfg "{main_cfg_path}" '
+        f'-d "{dirname}" -n {num_workers}'
+    )
+    if overwrite:
+        action += " --overwrite"
+    if save:
+        action += " --save"
+
+    return {
+        "file_dep": file_dep,
+        "targets": [results_file(load_batch_params(batch_file, dirname))],
+        "actions": [action],
+        "clean": [clean_targets],
+        "title": title_with_actions,
+        "verbosity": 0,
+        "doc": reason,
+    }
+
+
 def task_list_openfield():
     return create_task(
         os.path.join(here, "lfp_atn_simuran", "multi_runs", "run_openfield.py"),
@@ -77,20 +110,18 @@ def task_lfp_speed():
 
 
 def task_speed_ibi():
-    return create_list_task(
+    return create_cell_list_task(
         os.path.join(here, "lfp_atn_simuran", "multi_runs", "run_speed_ibi.py"),
-        ["speed_ibi.py"],
+        ["speed_ibi.py", "decoded_cache.py"],
         reason="Speed to IBI and firing rate relationship.",
-        **kwargs,
     )
 
 
 def task_spike_lfp():
-    return create_list_task(
+    return create_cell_list_task(
         os.path.join(here, "lfp_atn_simuran", "multi_runs", "run_spike_lfp.py"),
-        ["spike_lfp.py", "lfp_clean.py"],
+        ["spike_lfp.py", "spike_shuffle.py", "lfp_clean.py", "decoded_cache.py"],
         reason="Spike to LFP relationship.",
-        **kwargs,
     )
 
 
@@ -119,13 +150,12 @@ def task_tmaze():
 
 
 def task_muscimol_sta():
-    return create_list_task(
+    return create_cell_list_task(
         os.path.join(
             here, "lfp_atn_simuran", "multi_runs", "run_spike_lfp_muscimol.py"
         ),
-        ["spike_lfp.py", "lfp_clean.py"],
+        ["spike_lfp.py", "spike_shuffle.py", "lfp_clean.py", "decoded_cache.py"],
         reason="Spike to LFP relationship in muscimol data.",
-        **kwargs,
     )
 
 
@@ -0,0 +1,307 @@
+"""Run a per recording analysis over a cell list, one recording at a time."""
+
+import os
+import argparse
+import hashlib
+import pickle
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import simuran
+from skm_pyutils.py_table import df_from_file, df_to_file
+from skm_pyutils.py_config import parse_args
+
+here = os.path.dirname(os.path.abspath(__file__))
+mapping_dir = os.path.abspath(os.path.join(here, "..", "recording_mappings"))
+
+
+def load_batch_params(batch_file, dirname=""):
+    """
+    Read the params of a multi_runs batch file.
+
+    The magic strings __dirname__ and __thisdirname__ are replaced
+    by dirname and the directory of the batch file.
+
+    """
+    with open(batch_file, "r") as f:
+        text = f.read()
+    text = text.replace('"__dirname__"', repr(dirname))
+    text = text.replace(
+        '"__thisdirname__"', repr(os.path.dirname(os.path.abspath(batch_file)))
+    )
+    namespace = {"__file__": batch_file}
+    exec(compile(text, batch_file, "exec"), namespace)
+    return namespace["params"]
+
+
+def load_config(cfg_path):
+    """Read the params dictionary of a configuration file in configs."""
+    if not os.path.exists(cfg_path):
+        cfg_path = os.path.join(here, "..", "configs", cfg_path)
+    namespace = {"__file__": cfg_path}
+    with open(cfg_path, "r") as f:
+        exec(compile(f.read(), cfg_path, "exec"), namespace)
+    return namespace["params"]
+
+
+def group_cell_list(df):
+    """
+    Group the cells in a cell list by the recording they are in.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The cell list, with Directory, Filename, Group and Unit columns
+        and optionally the Mapping of the recording.
+
+    Returns
+    -------
+    OrderedDict
+        (directory, filename, mapping) to an OrderedDict of
+        group to the list of units, in cell list order.
+
+    """
+    recordings = OrderedDict()
+    has_mapping = "Mapping" in df.columns
+    for row in df.itertuples():
+        mapping = row.Mapping if has_mapping else None
+        key = (row.Directory, row.Filename, mapping)
+        units = recordings.setdefault(key, OrderedDict())
+        units.setdefault(str(row.Group), []).append(int(row.Unit))
+    return recordings
+
+
+def run_recording(key, units, function_to_run, fn_args, fn_kwargs):
+    """
+    Load one recording and run the analysis on the cells in it.
+
+    Recordings whose data can't be read (OSError or ValueError) are
+    reported with a traceback and give no results.
+    Any other error is raised, as it is a problem with the analysis.
+
+    """
+    directory, filename, mapping = key
+    param_file = None if mapping is None else os.path.join(mapping_dir, mapping)
+    try:
+        recording = simuran.Recording(
+            param_file=param_file,
+            base_file=os.path.join(directory, filename),
+            load=False,
+        )
+        for unit in recording.units:
+            unit.units_to_use = units.get(str(unit.group), [])
+        return function_to_run(recording, *fn_args, **fn_kwargs)
+    except (OSError, ValueError) as e:
+        print(
+            "WARNING: Failed to analyse {} with error {}\n{}".format(
+                os.path.join(directory, filename), e, traceback.format_exc()
+            )
+        )
+        return {}
+
+
+def merge_results(df, outputs, headers):
+    """
+    Add the results of each cell to the cell list, in cell list order.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The cell list.
+    outputs : dict
+        (directory, filename, mapping) to the output of the analysis,
+        a dictionary of "group_unit" to a list of results.
+    headers : list of str
+        The name of each result.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The cell list with a column for each result.
+
+    """
+    has_mapping = "Mapping" in df.columns
+    rows = []
+    for row in df.itertuples():
+        mapping = row.Mapping if has_mapping else None
+        output = outputs.get((row.Directory, row.Filename, mapping), {})
+        result = output.get("{}_{}".format(row.Group, row.Unit), None)
+        if result is None:
+            result = [np.nan] * len(headers)
+        rows.append(list(result))
+    info = df.copy()
+    for i, header in enumerate(headers):
+        info[header] = [r[i] for r in rows]
+    return info
+
+
+def results_file(params):
+    """The csv in out_dir that run_cell_list saves the results of params to."""
+    base = os.path.splitext(os.path.basename(params["cell_list_path"]))[0]
+    return os.path.join(params["out_dir"], base + "_results.csv")
+
+
+def _recording_file(results_dir, key, units, function_to_run, fn_args, fn_kwargs):
+    """
+    The file the output of analysing a recording is saved to in results_dir.
+
+    The name covers the recording, the units analysed in it, the
+    analysis function and its arguments, so a change in any of them
+    is analysed again.
+
+    """
+    identity = (
+        key,
+        [(group, list(cells)) for group, cells in units.items()],
+        function_to_run.__module__,
+        function_to_run.__name__,
+        list(fn_args),
+        sorted(fn_kwargs.items()),
+    )
+    digest = hashlib.blake2b(repr(identity).encode("utf-8"), digest_size=16)
+    return os.path.join(results_dir, digest.hexdigest() + ".pkl")
+
+
+def run_cell_list(params, config, num_workers=1, overwrite=True, save=False):
+    """
+    Run an analysis over a cell list and combine the results.
+
+    Each recording in the cell list is loaded once and analysed for
+    all of its cells, with recordings spread over num_workers processes.
+    The results are saved in cell list order to results_file(params),
+    and passed to the after_fn of the batch params.
+
+    Parameters
+    ----------
+    params : dict
+        The params of a multi_runs batch file.
+    config : dict
+        The configuration, passed as keyword arguments to the analysis.
+    num_workers : int, optional
+        The number of processes to analyse recordings in, defaults to 1.
+    overwrite : bool, optional
+        Whether to analyse recordings with saved results again,
+        defaults to True. Only used if save is True.
+    save : bool, optional
+        Whether to save the results of each recording, and reuse saved
+        results without overwrite, defaults to False.
+        They are saved in the <cell list>_recordings folder of out_dir,
+        keyed by the units, analysis function and its arguments.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The cell list with a column for each result.
+
+    """
+    cell_list_path = params["cell_list_path"]
+    df = df_from_file(cell_list_path)
+    fn_kwargs = dict(config)
+    fn_kwargs.update(params["fn_kwargs"])
+    function_to_run = params["function_to_run"]
+    fn_args = params["fn_args"]
+    out_dir = params["out_dir"]
+    out_file = results_file(params)
+    base = os.path.splitext(os.path.basename(cell_list_path))[0]
+    results_dir = os.path.join(out_dir, base + "_recordings")
+    if save:
+        os.makedirs(results_dir, exist_ok=True)
+
+    def store(key, output):
+        outputs[key] = output
+        if save:
+            with open(saved_files[key], "wb") as f:
+                pickle.dump(output, f)
+
+    recordings = group_cell_list(df)
+    print("Analysing {} cells in {} recordings".format(len(df), len(recordings)))
+    outputs = {}
+    saved_files = {}
+    pending = {}
+    executor = ProcessPoolExecutor(num_workers) if num_workers > 1 else None
+    try:
+        for key, units in recordings.items():
+            if save:
+                saved_files[key] = _recording_file(
+                    results_dir, key, units, function_to_run, fn_args, fn_kwargs
+                )
+                if not overwrite and os.path.isfile(saved_files[key]):
+                    with open(saved_files[key], "rb") as f:
+                        outputs[key] = pickle.load(f)
+                    continue
+            job = (key, units, function_to_run, fn_args, fn_kwargs)
+            if executor is None:
+                store(key, run_recording(*job))
+                continue
+            # Limit how many recordings are waiting to be analysed
+            if len(pending) >= 2 * num_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(pending.pop(future), future.result())
+            pending[executor.submit(run_recording, *job)] = key
+        for future, key in pending.items():
+            store(key, future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    info = merge_results(df, outputs, params["headers"])
+    os.makedirs(out_dir, exist_ok=True)
+    df_to_file(info, out_file, index=False)
+
+    if params.get("after_fn", None) is not None:
+        extra = (out_dir, os.path.basename(cell_list_path))
+        params["after_fn"](info, extra, **fn_kwargs)
+    return info
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cell list arguments")
+    parser.add_argument(
+        "batch_file", type=str, help="path to the multi_runs batch params file."
+    )
+    parser.add_argument(
+        "--config",
+        "-cfg",
+        type=str,
+        default="default.py",
+        help="path to the configuration file, default.py by default.",
+    )
+    parser.add_argument(
+        "--main_dir",
+        "-d",
+        type=str,
+        default="",
+        help="The name of the base directory for the data.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        "-n",
+        type=int,
+        default=1,
+        help="The number of processes to analyse recordings in.",
+    )
+    parser.add_argument(
+        "--overwrite",
+        "-o",
+        action="store_true",
+        help="Analyse recordings with saved results again.",
+    )
+    parser.add_argument(
+        "--save",
+        "-s",
+        action="store_true",
+        help="Save the results of each recording to reuse them later.",
+    )
+    parsed = parse_args(parser, verbose=False)
+
+    main_params = load_batch_params(parsed.batch_file, parsed.main_dir)
+    run_cell_list(
+        main_params,
+        load_config(parsed.config),
+        parsed.num_workers,
+        overwrite=parsed.overwrite,
+        save=parsed.save,
+    )
@@ -0,0 +1,456 @@
+"""On disk cache of decoded recordings (LFP signals, positions and spike times)."""
+
+import atexit
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Bump when the layout of a cache entry changes to invalidate old entries
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".skm_python", "decoded_cache"
+)
+DEFAULT_MAX_SIZE_GB = 20.0
+
+_default_cache = None
+
+
+def _to_builtin(value):
+    """Convert numpy scalars in recording info to json friendly values."""
+    if isinstance(value, dict):
+        return {str(k): _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def hash_file(file_name, chunk_size=1 << 20):
+    """Hash the contents of file_name with blake2b."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_json(file_name, value):
+    """Write value to file_name as json, replacing it in one step."""
+    tmp_file = "{}.{}.tmp".format(file_name, os.getpid())
+    with open(tmp_file, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_file, file_name)
+
+
+class DecodedCache(object):
+    """
+    Uncompressed npy store of decoded arrays, keyed by the source files.
+
+    Each entry is keyed by the path, size, modification time and content
+    hash of every file it was decoded from. The content hash of a file
+    is only recomputed when its size or modification time changes, so a
+    warm lookup just needs a stat of each source file.
+    Each entry is a folder of .npy files and a meta.json, and the cached
+    arrays are memory mapped read only instead of being read in full.
+    Once the cache is larger than max_size_gb the least recently used
+    entries are removed.
+
+    There is no shared index, so processes can use the cache at once.
+    An entry's meta.json mtime is its last use, and the content hash
+    of each source file is kept in its own file in the files folder.
+    Entries and hashes are written to a temporary name and renamed.
+
+    Attributes
+    ----------
+    cache_dir : str
+        The directory holding the entries and the file hashes.
+    max_size : int
+        The maximum size of the cache in bytes.
+    hits : int
+        The number of lookups found in the cache.
+    misses : int
+        The number of lookups that had to be decoded from the raw files.
+
+    """
+
+    def __init__(self, cache_dir=None, max_size_gb=DEFAULT_MAX_SIZE_GB):
+        if cache_dir is None:
+            cache_dir = DEFAULT_CACHE_DIR
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_gb * (1024**3))
+        self.files_dir = os.path.join(cache_dir, "files")
+        self.hits = 0
+        self.misses = 0
+        self._files = {}
+        os.makedirs(self.files_dir, exist_ok=True)
+
+    def _hash_file_name(self, path):
+        digest = hashlib.blake2b(path.encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.files_dir, digest + ".json")
+
+    def file_identity(self, file_name):
+        """Return (path, size, mtime, content hash) of file_name."""
+        path = os.path.abspath(file_name)
+        stat = os.stat(path)
+        known = self._files.get(path)
+        if known is None:
+            try:
+                with open(self._hash_file_name(path), "r") as f:
+                    known = json.load(f)
+            except (OSError, ValueError):
+                known = None
+        if (
+            known is not None
+            and known["size"] == stat.st_size
+            and known["mtime"] == stat.st_mtime_ns
+        ):
+            content_hash = known["hash"]
+        else:
+            content_hash = hash_file(path)
+            known = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "hash": content_hash,
+            }
+            _write_json(self._hash_file_name(path), known)
+        self._files[path] = known
+        return path, stat.st_size, stat.st_mtime_ns, content_hash
+
+    def make_key(self, kind, file_names, extra=""):
+        """
+        Build the key of an entry decoded from file_names.
+
+        Parameters
+        ----------
+        kind : str
+            What is stored, e.g. "signal", "spatial" or "units".
+        file_names : list of str
+            The files the entry is decoded from.
+        extra : str, optional
+            Anything else which changes the decoded result.
+
+        Returns
+        -------
+        str
+
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update("{}:{}:{}".format(CACHE_VERSION, kind, extra).encode("utf-8"))
+        for fname in sorted(file_names):
+            h.update(repr(self.file_identity(fname)).encode("utf-8"))
+        return kind + "_" + h.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """
+        Load the arrays stored under key.
+
+        Returns
+        -------
+        dict or None
+            The read only memory mapped arrays and a "meta" dict,
+            or None if key is not cached.
+
+        """
+        entry_dir = self._entry_dir(key)
+        meta_file = os.path.join(entry_dir, "meta.json")
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            arrays = {
+                name: np.load(
+                    os.path.join(entry_dir, name + ".npy"),
+                    mmap_mode="r",
+                    allow_pickle=False,
+                )
+                for name in meta["arrays"]
+            }
+            os.utime(meta_file)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        arrays["meta"] = meta["meta"]
+        self.hits += 1
+        return arrays
+
+    def put(self, key, arrays, meta=None):
+        """Store a dict of arrays and a json serialisable meta dict under key."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = "{}.{}.tmp".format(entry_dir, os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), array, allow_pickle=False)
+        meta = {
+            "arrays": list(arrays.keys()),
+            "meta": _to_builtin(meta if meta is not None else {}),
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """
+        The cached entries.
+
+        Returns
+        -------
+        dict
+            The key of each entry to its size in bytes and last use time.
+
+        """
+        entries = {}
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name == "files" or ".tmp" in entry.name:
+                continue
+            try:
+                last_used = os.stat(os.path.join(entry.path, "meta.json")).st_mtime
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            except OSError:
+                continue
+            entries[entry.name] = {"size": size, "last_used": last_used}
+        return entries
+
+    def size(self):
+        """The total size in bytes of the cached entries."""
+        return sum(e["size"] for e in self.entries().values())
+
+    def evict(self):
+        """Remove the least recently used entries until under max_size."""
+        entries = self.entries()
+        total = sum(e["size"] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_size:
+                break
+            total -= entries[key]["size"]
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def report(self):
+        """Return a one line summary of the cache use."""
+        total = self.hits + self.misses
+        return (
+            "Decoded cache: {} hits, {} misses ({:.0f}% hit rate), "
+            "{:.2f} GB in {}".format(
+                self.hits,
+                self.misses,
+                100 * self.hits / total if total else 0,
+                self.size() / (1024**3),
+                self.cache_dir,
+            )
+        )
+
+
+def _report_at_exit():
+    if _default_cache is not None:
+        total = _default_cache.hits + _default_cache.misses
+        if total:
+            print(_default_cache.report())
+
+
+def get_cache():
+    """
+    Return the cache shared by this process.
+
+    The location and size are set by the environment variables
+    LFP_ATN_CACHE_DIR and LFP_ATN_CACHE_SIZE_GB, which dodo.py sets from
+    dodo.cfg. A size of 0 disables the cache and None is returned.
+    The hits and misses are printed when the process exits.
+
+    """
+    global _default_cache
+    max_size_gb = float(os.environ.get("LFP_ATN_CACHE_SIZE_GB", DEFAULT_MAX_SIZE_GB))
+    if max_size_gb <= 0:
+        return None
+    if _default_cache is None:
+        cache_dir = os.environ.get("LFP_ATN_CACHE_DIR") or None
+        _default_cache = DecodedCache(cache_dir, max_size_gb)
+        atexit.register(_report_at_exit)
+    return _default_cache
+
+
+def _source_files(source_file, *extensions):
+    """The source file and any sibling files with the given extensions."""
+    files = [source_file]
+    stem = os.path.splitext(source_file)[0]
+    for ext in extensions:
+        fname = stem + ext
+        if fname != source_file and os.path.isfile(fname):
+            files.append(fname)
+    return files
+
+
+def load_signal(signal, cache=None):
+    """
+    Load an LFP signal through the cache.
+
+    The samples, their unit and the sampling rate are cached.
+    The .set file next to the signal is part of the key as it holds the gains.
+
+    """
+    if getattr(signal, "samples", None) is not None:
+        return signal
+    cache = get_cache() if cache is None else cache
+    source_file = getattr(signal, "source_file", None)
+    if cache is None or source_file is None or not os.path.isfile(source_file):
+        signal.load()
+        return signal
+
+    import astropy.units as u
+
+    key = cache.make_key("signal", _source_files(source_file, ".set"))
+    cached = cache.get(key)
+    if cached is not None:
+        meta = cached["meta"]
+        samples = cached["samples"]
+        if meta["unit"] is not None:
+            samples = samples * u.Unit(meta["unit"])
+        signal.from_numpy(samples, sampling_rate=meta["sampling_rate"])
+        return signal
+
+    signal.load()
+    samples = signal.samples
+    unit = getattr(samples, "unit", None)
+    cache.put(
+        key,
+        {"samples": np.asarray(getattr(samples, "value", samples))},
+        {
+            "unit": None if unit is None else unit.to_string(),
+            "sampling_rate": float(signal.sampling_rate),
+        },
+    )
+    return signal
+
+
+def load_signals(data, cache=None):
+    """Load every signal in a recording, or in a list of signals, through the cache."""
+    signals = getattr(data, "signals", data)
+    for i in range(len(signals)):
+        load_signal(signals[i], cache)
+    return signals
+
+
+_SPATIAL_ARRAYS = ("time", "pos_x", "pos_y", "direction", "speed", "ang_vel")
+
+
+def load_spatial(recording, cache=None):
+    """
+    Load the spatial information of a recording through the cache.
+
+    The NeuroChaT NSpatial in recording.spatial.underlying is rebuilt from
+    the cached time, position, head direction, speed and angular velocity.
+
+    """
+    spatial = recording.spatial
+    if spatial.underlying is not None:
+        return spatial
+    cache = get_cache() if cache is None else cache
+    source_file = getattr(spatial, "source_file", None)
+    if cache is None or source_file is None or not os.path.isfile(source_file):
+        spatial.load()
+        return spatial
+
+    from neurochat.nc_spatial import NSpatial
+
+    key = cache.make_key("spatial", _source_files(source_file, ".pos", ".set"))
+    cached = cache.get(key)
+    if cached is not None:
+        meta = cached["meta"]
+        nc_spatial = NSpatial()
+        nc_spatial.set_filename(meta["filename"])
+        nc_spatial.set_system(meta["system"])
+        nc_spatial.set_record_info(meta["record_info"])
+        nc_spatial.set_pixel_size(meta["pixel_size"])
+        nc_spatial._set_time(cached["time"])
+        nc_spatial._set_pos_x(cached["pos_x"])
+        nc_spatial._set_pos_y(cached["pos_y"])
+        nc_spatial._set_direction(cached["direction"])
+        nc_spatial._set_speed(cached["speed"])
+        nc_spatial.set_ang_vel(cached["ang_vel"])
+        nc_spatial.set_border(nc_spatial.calc_border())
+        spatial.underlying = nc_spatial
+        return spatial
+
+    spatial.load()
+    nc_spatial = spatial.underlying
+    if nc_spatial is None:
+        return spatial
+    cache.put(
+        key,
+        {
+            name: np.asarray(getattr(nc_spatial, "get_" + name)())
+            for name in _SPATIAL_ARRAYS
+        },
+        {
+            "filename": nc_spatial.get_filename(),
+            "system": nc_spatial.get_system(),
+            "record_info": nc_spatial.get_record_info(),
+            "pixel_size": nc_spatial.get_pixel_size(),
+        },
+    )
+    return spatial
+
+
+def load_unit(unit, cache=None):
+    """
+    Load the spike times and unit tags of a tetrode through the cache.
+
+    Waveforms are not cached, so analyses of waveforms should call
+    unit.load() directly.
+
+    """
+    if unit.underlying is not None:
+        return unit
+    cache = get_cache() if cache is None else cache
+    source_file = getattr(unit, "source_file", None)
+    if cache is None or source_file is None or not os.path.isfile(source_file):
+        unit.load()
+        return unit
+
+    from neurochat.nc_spike import NSpike
+
+    tetrode = os.path.splitext(source_file)[1][1:]
+    files = _source_files(
+        source_file, ".set", "_{}.cut".format(tetrode), ".clu.{}".format(tetrode)
+    )
+    key = cache.make_key("units", files)
+    cached = cache.get(key)
+    if cached is not None:
+        meta = cached["meta"]
+        nc_spike = NSpike()
+        nc_spike.set_filename(meta["filename"])
+        nc_spike.set_system(meta["system"])
+        nc_spike.set_record_info(meta["record_info"])
+        nc_spike._set_timestamp(cached["timestamp"])
+        nc_spike.set_unit_tags(cached["unit_tags"])
+        unit.underlying = nc_spike
+        return unit
+
+    unit.load()
+    nc_spike = unit.underlying
+    if nc_spike is None:
+        return unit
+    cache.put(
+        key,
+        {
+            "timestamp": np.asarray(nc_spike.get_timestamp()),
+            "unit_tags": np.asarray(nc_spike.get_unit_tags()),
+        },
+        {
+            "filename": nc_spike.get_filename(),
+            "system": nc_spike.get_system(),
+            "record_info": nc_spike.get_record_info(),
+        },
+    )
+    return unit
@@ -0,0 +1,214 @@
+"""Welch spectra of many epochs of multi region LFP, computed as one batch."""
+
+import numpy as np
+import scipy.fft
+import scipy.integrate
+import scipy.signal
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def simpson_weights(f, band=None):
+    """
+    Weights w so that psd @ w is the Simpson integral of psd over a band.
+
+    Parameters
+    ----------
+    f : np.ndarray
+        The evenly spaced frequencies of the psd.
+    band : list of float, optional
+        The low and high frequency of the band, defaults to all of f.
+
+    Returns
+    -------
+    np.ndarray
+        The weight of each frequency, zero outside the band.
+
+    """
+    idx_band = np.ones(f.size, dtype=bool)
+    if band is not None:
+        idx_band = np.logical_and(f >= band[0], f <= band[1])
+    weights = np.zeros(f.size)
+    weights[idx_band] = scipy.integrate.simpson(
+        np.eye(np.count_nonzero(idx_band)), dx=f[1] - f[0], axis=-1
+    )
+    return weights
+
+
+class EpochSpectra(object):
+    """
+    Welch PSDs and coherence of every epoch of a session's LFP at once.
+
+    The half overlapping segments of all epochs are gathered from the
+    samples of every region, detrended, tapered and transformed as a single
+    float32 batch. Epochs can have different lengths, as each segment
+    keeps the index of its epoch and averages are taken per epoch.
+    The results match scipy.signal.welch and coherence on each
+    samples[start:stop], to float32 precision.
+
+    Attributes
+    ----------
+    regions : list of str
+        The name of each row of samples.
+    samples : np.ndarray
+        regions * samples float32 LFP, without units.
+    sampling_rate : float
+        The sampling rate of the LFP.
+    starts, stops : np.ndarray
+        The first sample and one past the last sample of each epoch.
+
+    """
+
+    def __init__(self, samples, sampling_rate, starts, stops, regions=None):
+        samples = np.atleast_2d(np.asarray(samples, dtype=np.float32))
+        if regions is None:
+            regions = [str(i) for i in range(samples.shape[0])]
+        self.regions = list(regions)
+        self.samples = samples
+        self.sampling_rate = sampling_rate
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+        if np.any(self.starts < 0) or np.any(self.stops > samples.shape[-1]):
+            raise ValueError("Epochs must be within the samples")
+        self._spectra = {}
+
+    @classmethod
+    def from_signals(cls, signals, starts, stops, unit="mV"):
+        """Epochs of a dictionary of region to simuran signal, in unit."""
+        regions = list(signals.keys())
+        samples = []
+        for signal in signals.values():
+            val = signal.samples
+            if hasattr(val, "unit"):
+                val = val.to(unit).value
+            samples.append(val)
+        sampling_rate = signals[regions[0]].sampling_rate
+        return cls(samples, sampling_rate, starts, stops, regions)
+
+    def segments(self, nperseg):
+        """
+        The first sample of every Welch segment and the epoch it is in.
+
+        Raises
+        ------
+        ValueError
+            If an epoch is shorter than nperseg.
+
+        """
+        lengths = self.stops - self.starts
+        if np.any(lengths < nperseg):
+            raise ValueError(
+                "Epochs of {} samples are shorter than nperseg {}".format(
+                    lengths.min(), nperseg
+                )
+            )
+        step = nperseg - nperseg // 2
+        num_segments = (lengths - nperseg) // step + 1
+        epoch_idx = np.repeat(np.arange(lengths.size), num_segments)
+        first = np.cumsum(num_segments) - num_segments
+        within = np.arange(epoch_idx.size) - first[epoch_idx]
+        return self.starts[epoch_idx] + within * step, epoch_idx
+
+    def spectra(self, nperseg, nfft=None, window="hann"):
+        """
+        The windowed FFT of every segment of every epoch.
+
+        Returns
+        -------
+        f : np.ndarray
+            The frequencies.
+        spectra : np.ndarray
+            regions * segments * frequencies complex64 FFT, scaled so that
+            averaging products of it gives one sided densities.
+        epoch_idx : np.ndarray
+            The epoch of each segment.
+
+        """
+        nperseg = int(nperseg)
+        nfft = nperseg if nfft is None else int(nfft)
+        key = (nperseg, nfft, str(window))
+        if key not in self._spectra:
+            seg_starts, epoch_idx = self.segments(nperseg)
+            segments = sliding_window_view(self.samples, nperseg, axis=-1)
+            segments = segments[:, seg_starts]
+            segments = segments - np.mean(segments, axis=-1, keepdims=True)
+            win = scipy.signal.get_window(window, nperseg).astype(np.float32)
+            spectra = scipy.fft.rfft(segments * win, nfft, axis=-1)
+            density = 1.0 / (self.sampling_rate * np.sum(win**2))
+            scale = np.full(spectra.shape[-1], density)
+            scale[1 : None if nfft % 2 else -1] *= 2
+            spectra *= np.sqrt(scale).astype(np.float32)
+            f = scipy.fft.rfftfreq(nfft, 1 / self.sampling_rate)
+            self._spectra[key] = (f, spectra, epoch_idx)
+        return self._spectra[key]
+
+    def _epoch_mean(self, values, epoch_idx):
+        """Mean over the segments of each epoch, segments on axis -2."""
+        first = np.flatnonzero(np.diff(epoch_idx, prepend=-1))
+        counts = np.diff(np.append(first, epoch_idx.size))
+        sums = np.add.reduceat(values, first, axis=-2)
+        return sums / counts[:, None].astype(values.real.dtype)
+
+    def psd(self, nperseg, nfft=None, window="hann"):
+        """
+        The Welch PSD of each region in each epoch.
+
+        Returns
+        -------
+        f : np.ndarray
+            The frequencies.
+        psd : np.ndarray
+            regions * epochs * frequencies float32 PSD.
+
+        """
+        f, spectra, epoch_idx = self.spectra(nperseg, nfft, window)
+        power = spectra.real**2 + spectra.imag**2
+        return f, self._epoch_mean(power, epoch_idx)
+
+    def coherence(self, region1, region2, nperseg, nfft=None, window="hann"):
+        """
+        The magnitude squared coherence of two regions in each epoch.
+
+        Returns
+        -------
+        f : np.ndarray
+            The frequencies.
+        coherence : np.ndarray
+            epochs * frequencies float32 coherence.
+
+        """
+        f, spectra, epoch_idx = self.spectra(nperseg, nfft, window)
+        x = spectra[self.regions.index(region1)]
+        y = spectra[self.regions.index(region2)]
+        pxy = self._epoch_mean(np.conjugate(x) * y, epoch_idx)
+        pxx = self._epoch_mean(x.real**2 + x.imag**2, epoch_idx)
+        pyy = self._epoch_mean(y.real**2 + y.imag**2, epoch_idx)
+        return f, (pxy.real**2 + pxy.imag**2) / pxx / pyy
+
+    def relative_power(self, bands, nperseg, total_band=(1.5, 90), window="hann"):
+        """
+        Band power over total power of each region in each epoch.
+
+        This is the relative_power of NLfp.bandpower from NeuroChaT
+        with band_total=True.
+
+        Parameters
+        ----------
+        bands : list of list of float
+            The low and high frequency of each band.
+        nperseg : int
+            The Welch segment length.
+        total_band : list of float, optional
+            The band to find the total power in, defaults to (1.5, 90).
+        window : str, optional
+            The window, defaults to "hann".
+
+        Returns
+        -------
+        np.ndarray
+            regions * epochs * bands relative power.
+
+        """
+        f, psd = self.psd(nperseg, window=window)
+        weights = np.stack([simpson_weights(f, band) for band in bands], axis=-1)
+        total = psd @ simpson_weights(f, total_band)
+        return (psd @ weights) / total[..., None]
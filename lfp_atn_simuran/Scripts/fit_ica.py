@@ -0,0 +1,116 @@
+"""
+Fit and store the automatic ICA of many recordings before analysing them.
+
+The recordings are the unique Directory, Filename (and Mapping) rows of a
+table, such as a cell list. The ICA is stored where LFPClean with the "ica"
+method looks for it when a recording is cleaned with the same config,
+as in clean(recording, fmin, fmax, method_kwargs=clean_kwargs),
+so the analysis afterwards only applies the stored ICA.
+
+For example, to fit with configs/ica.py in four processes:
+
+    python fit_ica.py cell_list.csv -cfg ica.py -n 4
+
+"""
+
+import os
+import argparse
+
+import simuran
+from skm_pyutils.py_table import df_from_file
+from skm_pyutils.py_config import parse_args
+
+from lfp_atn_simuran.Scripts.cell_list_runner import load_config, mapping_dir
+from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+
+
+def table_recordings(df):
+    """Yield the recordings in the rows of df, without loading them."""
+    has_mapping = "Mapping" in df.columns
+    seen = set()
+    for row in df.itertuples():
+        mapping = row.Mapping if has_mapping else None
+        key = (row.Directory, row.Filename, mapping)
+        if key in seen:
+            continue
+        seen.add(key)
+        param_file = None if mapping is None else os.path.join(mapping_dir, mapping)
+        yield simuran.Recording(
+            param_file=param_file,
+            base_file=os.path.join(row.Directory, row.Filename),
+            load=False,
+        )
+
+
+def fit_table_ica(table_path, config, num_workers=1, fmin=None, fmax=None):
+    """
+    Fit the automatic ICA of each recording in a table.
+
+    Parameters
+    ----------
+    table_path : str
+        The table of recordings, with Directory and Filename columns
+        and optionally the Mapping of each recording.
+    config : dict
+        The configuration, giving fmin, fmax and the clean_kwargs.
+    num_workers : int, optional
+        The number of processes to fit in, defaults to 1.
+    fmin, fmax : float, optional
+        The filter the analysis cleans with, if not the fmin and fmax
+        of the config.
+
+    Returns
+    -------
+    list of str
+        The ICA file of each recording.
+
+    """
+    df = df_from_file(table_path)
+    fmin = config.get("fmin", None) if fmin is None else fmin
+    fmax = config.get("fmax", None) if fmax is None else fmax
+    lc = LFPClean(method="ica", visualise=False)
+    fnames = lc.fit_ica_batch(
+        table_recordings(df),
+        fmin,
+        fmax,
+        method_kwargs=config.get("clean_kwargs", {}),
+        num_workers=num_workers,
+    )
+    print("Stored the ICA of {} recordings".format(len(fnames)))
+    return fnames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit ICA arguments")
+    parser.add_argument(
+        "table", type=str, help="path to the table of recordings, e.g. a cell list."
+    )
+    parser.add_argument(
+        "--config",
+        "-cfg",
+        type=str,
+        default="ica.py",
+        help="path to the configuration file, ica.py by default.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        "-n",
+        type=int,
+        default=1,
+        help="The number of processes to fit ICA in.",
+    )
+    parser.add_argument(
+        "--fmin", type=float, default=None, help="Override the fmin of the config."
+    )
+    parser.add_argument(
+        "--fmax", type=float, default=None, help="Override the fmax of the config."
+    )
+    parsed = parse_args(parser, verbose=False)
+
+    fit_table_ica(
+        parsed.table,
+        load_config(parsed.config),
+        parsed.num_workers,
+        fmin=parsed.fmin,
+        fmax=parsed.fmax,
+    )
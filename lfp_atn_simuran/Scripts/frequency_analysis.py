@@ -1,8 +1,6 @@
 import os
 
 import numpy as np
-from scipy.signal import welch
-from astropy import units as u
 import simuran
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -10,36 +8,34 @@ import pandas as pd
 from skm_pyutils.py_plot import UnicodeGrabber
 
 from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+from lfp_atn_simuran.Scripts.spectral_store import SpectralStore, spectral_store
 
 
 def plot_psd(
-    x, ax, fs=250, group="ATNx", region="SUB", fmin=1, fmax=100, scale="volts"
+    x,
+    ax,
+    fs=250,
+    group="ATNx",
+    region="SUB",
+    fmin=1,
+    fmax=100,
+    scale="volts",
+    store=None,
 ):
-    f, Pxx = welch(
-        x.samples.to(u.uV).value,
-        fs=fs,
-        nperseg=2 * fs,
-        return_onesided=True,
-        scaling="density",
-        average="mean",
-    )
-
-    f = f[np.nonzero((f >= fmin) & (f <= fmax))]
-    Pxx = Pxx[np.nonzero((f >= fmin) & (f <= fmax))]
-
-    Pxx_max = 0
+    # The PSD comes from the store, where x has been added as region
+    if store is None:
+        store = SpectralStore()
+        store.add_signals({region: x})
+    # Decibels are full scale relative dB (so max at 0)
+    f, Pxx, Pxx_max = store.scaled_psd(region, int(2 * fs), fmin, fmax, scale)
+
     ylabel = None
     if scale == "volts":
         micro = UnicodeGrabber.get("micro")
         pow2 = UnicodeGrabber.get("pow2")
         ylabel = f"PSD ({micro}V{pow2} / Hz)"
-    elif scale == "decibels":
-        # Convert to full scale relative dB (so max at 0)
-        Pxx_max = np.max(Pxx)
-        Pxx = 10 * np.log10(Pxx / Pxx_max)
-        ylabel = "PSD (dB)"
     else:
-        raise ValueError("Unsupported scale {}".format(scale))
+        ylabel = "PSD (dB)"
     sns.lineplot(x=f, y=Pxx, ax=ax)
     simuran.despine()
     ax.set_xlabel("Frequency (Hz)")
@@ -162,6 +158,10 @@ def powers(
     window_sec = 2
     simuran.set_plot_style()
 
+    # The Welch spectra of each region are shared by all the powers below
+    store = spectral_store(recording)
+    store.add_signals(signals_grouped_by_region)
+
     for name, signal in signals_grouped_by_region.items():
         results["{} delta".format(name)] = np.nan
         results["{} theta".format(name)] = np.nan
@@ -174,18 +174,19 @@ def powers(
         results["{} low gamma rel".format(name)] = np.nan
         results["{} high gamma rel".format(name)] = np.nan
 
-        sig_in_use = signal.to_neurochat()
-        delta_power = sig_in_use.bandpower(
-            [delta_min, delta_max], window_sec=window_sec, band_total=True
+        nperseg = int(window_sec * signal.sampling_rate)
+        total_band = [1.5, 90]
+        delta_power = store.bandpower(
+            name, [delta_min, delta_max], nperseg, total_band=total_band
         )
-        theta_power = sig_in_use.bandpower(
-            [theta_min, theta_max], window_sec=window_sec, band_total=True
+        theta_power = store.bandpower(
+            name, [theta_min, theta_max], nperseg, total_band=total_band
         )
-        low_gamma_power = sig_in_use.bandpower(
-            [30, 55], window_sec=window_sec, band_total=True
+        low_gamma_power = store.bandpower(
+            name, [30, 55], nperseg, total_band=total_band
         )
-        high_gamma_power = sig_in_use.bandpower(
-            [65, 90], window_sec=window_sec, band_total=True
+        high_gamma_power = store.bandpower(
+            name, [65, 90], nperseg, total_band=total_band
         )
 
         if not (
@@ -214,11 +215,27 @@ def powers(
         group = define_recording_group(base_dir)
         if psd_scale == "volts":
             results["{} welch".format(name)] = plot_psd(
-                signal, ax, sr, group, name, fmin=fmin, fmax=fmax, scale=psd_scale
+                signal,
+                ax,
+                sr,
+                group,
+                name,
+                fmin=fmin,
+                fmax=fmax,
+                scale=psd_scale,
+                store=store,
             )
         else:
             r1, r2 = plot_psd(
-                signal, ax, sr, group, name, fmin=fmin, fmax=fmax, scale=psd_scale
+                signal,
+                ax,
+                sr,
+                group,
+                name,
+                fmin=fmin,
+                fmax=fmax,
+                scale=psd_scale,
+                store=store,
             )
             results["{} welch".format(name)] = r1
             results["{} max f".format(name)] = r2
@@ -1,16 +1,46 @@
 """Clean LFP signals."""
 
+import hashlib
 import os
 from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from copy import deepcopy
 
 import numpy as np
 import simuran
 import astropy.units as u
+from mne.filter import filter_data
 from mne.preprocessing import ICA, read_ica
 
+from lfp_atn_simuran.Scripts.decoded_cache import load_signals, get_cache, hash_file
 
-def detect_outlying_signals(signals, z_threshold=1.1):
+ICA_DIR = os.path.join(os.path.expanduser("~"), ".skm_python", "ICA_files")
+ICA_PARAMS = dict(
+    method="picard",
+    random_state=42,
+    max_iter="auto",
+    fit_params=dict(ortho=True, extended=True),
+    n_components=None,
+)
+
+# Number of clean results kept in memory by LFPClean
+CLEAN_CACHE_SIZE = 8
+_clean_cache = OrderedDict()
+
+
+def _time_chunks(num_samples, chunk_size=None):
+    """Slices over the samples, of chunk_size or all at once if None."""
+    if chunk_size is None:
+        return [slice(0, num_samples)]
+    return [
+        slice(start, min(start + chunk_size, num_samples))
+        for start in range(0, num_samples, chunk_size)
+    ]
+
+
+def detect_outlying_signals(
+    signals, z_threshold=1.1, dtype=np.float32, chunk_size=None
+):
     """
     Detect signals that are outliers from the average.
 
@@ -20,6 +50,12 @@ def detect_outlying_signals(signals, z_threshold=1.1):
         Assumed to be an N_chans * N_samples iterable.
     z_threshold : float
         The threshold for the mean signal z-score to be an outlier.
+    dtype : np.dtype, optional
+        The dtype the z-scores are calculated in, defaults to np.float32.
+    chunk_size : int, optional
+        If passed, the z-scores are calculated over chunk_size samples
+        at a time, so memory use does not grow with the recording length.
+        The full z_scores are then not returned.
 
     Returns
     -------
@@ -31,40 +67,47 @@ def detect_outlying_signals(signals, z_threshold=1.1):
         The indices of the good signals
     outliers_idx : list
         The indices of the bad signals
+    z_scores : np.ndarray or None
+        The z-scores of each signal, None if chunk_size is passed.
 
     """
-    avg_sig = np.mean(signals, axis=0)
-    std_sig = np.std(signals, axis=0)
-    # Use this with axis = 0 for per signal
-    std_sig = np.where(std_sig == 0, 1, std_sig)
-
-    z_scores = np.zeros(shape=(len(signals), len(signals[0])))
-
-    for i, s in enumerate(signals):
-        z_scores[i] = (s - avg_sig) / std_sig
-
-    z_score_abs = np.abs(z_scores)
+    signals_ = np.asarray(signals)
+    num_chans, num_samples = signals_.shape
+    z_score_sums = np.zeros(num_chans, dtype=np.float64)
+    z_score_counts = np.zeros(num_chans, dtype=np.int64)
+    z_scores = None
+    for chunk in _time_chunks(num_samples, chunk_size):
+        data = np.asarray(signals_[:, chunk], dtype=dtype)
+        # Use this with axis = 0 for per signal
+        std_sig = np.std(data, axis=0)
+        std_sig[std_sig == 0] = 1
+        z = data - np.mean(data, axis=0)
+        np.divide(z, std_sig, out=z)
+        if chunk_size is None:
+            z_scores = z
+            z_abs = np.abs(z)
+        else:
+            z_abs = np.abs(z, out=z)
+        z_score_sums += np.nansum(z_abs, axis=1, dtype=np.float64)
+        z_score_counts += np.count_nonzero(~np.isnan(z_abs), axis=1)
 
-    z_score_means = np.nanmean(z_score_abs, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z_score_means = z_score_sums / z_score_counts
     z_threshold = z_threshold * np.median(z_score_means)
 
-    good, bad = [], []
-    for i, val in enumerate(z_score_means):
-        if val > z_threshold:
-            bad.append(i)
-        else:
-            good.append(i)
-
-    good_signals = np.array([signals[i] for i in good])
-    bad_signals = np.array([signals[i] for i in bad])
+    bad_mask = z_score_means > z_threshold
+    good = np.flatnonzero(~bad_mask).tolist()
+    bad = np.flatnonzero(bad_mask).tolist()
 
     if len(good) == 0:
         raise RuntimeError(f"No good signals found, bad were {bad}")
 
-    return good_signals, bad_signals, good, bad, z_scores
+    return signals_[good], signals_[bad], good, bad, z_scores
 
 
-def average_signals(signals, z_threshold=1.1, verbose=False, clean=True):
+def average_signals(
+    signals, z_threshold=1.1, verbose=False, clean=True, chunk_size=None
+):
     """
     Clean and average a set of signals.
 
@@ -72,15 +115,15 @@ def average_signals(signals, z_threshold=1.1, verbose=False, clean=True):
     ----------
     signals : iterable
         Assumed to be an N_chans * N_samples iterable.
-    sampling_rate : int
-        The sampling rate of the signals in samples/s.
-    filter_ : tuple
-        Butter filter parameters.
     z_threshold : float, optional.
         The threshold for the mean signal z-score to be an outlier.
         Defaults to 1.1. This means z > 1.1 * z.median is outlier.
     verbose : bool, optional.
         Whether to print further information, defaults to False.
+    clean : bool, optional.
+        Whether to exclude outlying signals, defaults to True.
+    chunk_size : int, optional.
+        Passed to detect_outlying_signals.
 
     Returns
     -------
@@ -88,15 +131,12 @@ def average_signals(signals, z_threshold=1.1, verbose=False, clean=True):
         The cleaned and averaged signals.
 
     """
-    if type(signals) is not np.ndarray:
-        signals_ = np.array(signals)
-    else:
-        signals_ = signals
+    signals_ = np.asarray(signals)
 
     # 1. Try to identify dead channels
     if clean:
         good_signals, bad_signals, good_idx, bad_idx, _ = detect_outlying_signals(
-            signals_, z_threshold=z_threshold
+            signals_, z_threshold=z_threshold, chunk_size=chunk_size
         )
         if verbose:
             if len(bad_idx) != 0:
@@ -104,7 +144,7 @@ def average_signals(signals, z_threshold=1.1, verbose=False, clean=True):
                     "Excluded {} signals with indices {}".format(len(bad_idx), bad_idx)
                 )
     else:
-        good_signals = signals
+        good_signals = signals_
         bad_idx = []
 
     # 1a. Consider trying to remove noise per channel? Or after avg?
@@ -118,11 +158,44 @@ def average_signals(signals, z_threshold=1.1, verbose=False, clean=True):
         return avg_sig, bad_idx
 
 
-def z_score_signals(signals, z_threshold=1.1, verbose=False, clean=True):
-    if type(signals) is not np.ndarray:
-        signals_ = np.array(signals)
-    else:
-        signals_ = signals
+def z_score_signals(
+    signals,
+    z_threshold=1.1,
+    verbose=False,
+    clean=True,
+    dtype=np.float32,
+    chunk_size=None,
+):
+    """
+    Z-score each good signal and average all the signals.
+
+    Parameters
+    ----------
+    signals : iterable
+        Assumed to be an N_chans * N_samples iterable.
+    z_threshold : float, optional.
+        The threshold for the mean signal z-score to be an outlier.
+    verbose : bool, optional.
+        Whether to print further information, defaults to False.
+    clean : bool, optional.
+        Whether to detect outlying signals, which are not z-scored.
+    dtype : np.dtype, optional.
+        The dtype of the z-scored signals, defaults to np.float32.
+    chunk_size : int, optional.
+        If passed, work over chunk_size samples at a time to bound memory use.
+
+    Returns
+    -------
+    np.ndarray
+        The average of the signals.
+    list
+        The indices of the outlying signals.
+    np.ndarray
+        The z-scored signals.
+
+    """
+    signals_ = np.array(signals, dtype=dtype)
+    num_chans, num_samples = signals_.shape
 
     # Like this will z-score before check
     # for i in range(len(signals_)):
@@ -133,7 +206,7 @@ def z_score_signals(signals, z_threshold=1.1, verbose=False, clean=True):
     # 1. Try to identify dead channels
     if clean:
         good_signals, bad_signals, good_idx, bad_idx, _ = detect_outlying_signals(
-            signals_, z_threshold=z_threshold
+            signals_, z_threshold=z_threshold, dtype=dtype, chunk_size=chunk_size
         )
         if verbose:
             if len(bad_idx) != 0:
@@ -142,13 +215,32 @@ def z_score_signals(signals, z_threshold=1.1, verbose=False, clean=True):
                 )
     else:
         bad_idx = []
+    good = np.ones(num_chans, dtype=bool)
+    good[bad_idx] = False
 
-    for i in range(len(signals_)):
-        if i not in bad_idx:
-            div = np.std(signals_[i])
-            div = np.where(div == 0, 1, div)
-            signals_[i] = (signals_[i] - np.mean(signals_[i])) / div
-    res = np.mean(signals_, axis=0)
+    chunks = _time_chunks(num_samples, chunk_size)
+    if chunk_size is None:
+        mean = np.mean(signals_, axis=1)
+        div = np.std(signals_, axis=1)
+    else:
+        sums = np.zeros(num_chans, dtype=np.float64)
+        sq_sums = np.zeros(num_chans, dtype=np.float64)
+        for chunk in chunks:
+            data = signals_[:, chunk].astype(np.float64)
+            sums += np.sum(data, axis=1)
+            sq_sums += np.sum(np.square(data, out=data), axis=1)
+        mean = sums / num_samples
+        div = np.sqrt(np.maximum(sq_sums / num_samples - np.square(mean), 0))
+    div[div == 0] = 1
+    mean = np.where(good, mean, 0).astype(dtype)[:, np.newaxis]
+    div = np.where(good, div, 1).astype(dtype)[:, np.newaxis]
+
+    res = np.empty(num_samples, dtype=dtype)
+    for chunk in chunks:
+        data = signals_[:, chunk]
+        data -= mean
+        data /= div
+        res[chunk] = np.mean(data, axis=0)
 
     # Technically, the signals are now dimensionless
     # Including unit for compatibability
@@ -158,6 +250,182 @@ def z_score_signals(signals, z_threshold=1.1, verbose=False, clean=True):
         return res, bad_idx, signals_
 
 
+def ica_file_name(signals, mne_array, base_name=None, manual=False, fit_kwargs=None):
+    """
+    The ICA store file for signals, keyed by their source and the ICA setup.
+
+    The key covers the content of the source files, the channels and
+    highpass of mne_array, ICA_PARAMS and how the ICA is fit.
+    base_name is kept at the start of the name for readability.
+
+    Returns
+    -------
+    str
+        The file in ICA_DIR to store the ICA in.
+
+    """
+    bit = "" if manual else "-auto"
+    source_file = getattr(signals[0], "source_file", "<unknown>")
+    if base_name is None:
+        if os.path.basename(source_file) != "<unknown>":
+            base_name = os.path.splitext(os.path.basename(source_file))[0]
+        else:
+            val = np.round(np.mean(signals[0].samples), 3)
+            base_name = str(val).replace(".", "-")
+    elif base_name.endswith("-ica.fif.gz") or base_name.endswith("-ica.fif"):
+        base_name = base_name[: base_name.rindex("-ica.fif")]
+    else:
+        base_name = os.path.splitext(base_name)[0]
+
+    files = _signal_files(signals)
+    cache = get_cache()
+    if files is None:
+        identity = [
+            hashlib.blake2b(np.ascontiguousarray(s.samples).data).hexdigest()
+            for s in signals
+        ]
+    elif cache is not None:
+        identity = [cache.file_identity(f)[3] for f in files]
+    else:
+        identity = [hash_file(f) for f in files]
+    h = hashlib.blake2b(digest_size=8)
+    h.update(
+        repr(
+            (
+                identity,
+                mne_array.info.ch_names,
+                mne_array.info["highpass"],
+                sorted(ICA_PARAMS.items()),
+                sorted((fit_kwargs or {}).items()),
+                manual,
+            )
+        ).encode("utf-8")
+    )
+    fname = os.path.join(ICA_DIR, f"{base_name}--{h.hexdigest()}{bit}-ica.fif.gz")
+    return fname
+
+
+def fit_auto_ica(mne_array, end_time=120.0, fit_kwargs=None):
+    """
+    Fit ICA and automatically detect the artifact components.
+
+    Parameters
+    ----------
+    mne_array : mne.io.Raw
+        The signals to decompose.
+    end_time : float, optional
+        The end of the time range used to find artifacts in seconds.
+    fit_kwargs : dict, optional
+        Passed to ICA.fit, for example decim, or start and stop to
+        fit on part of the data. The ICA still applies to all of it.
+
+    Returns
+    -------
+    mne.preprocessing.ICA
+
+    """
+    ica = ICA(**ICA_PARAMS)
+    ica.fit(mne_array, **(fit_kwargs or {}))
+    return ica.detect_artifacts(mne_array, start_find=20.0, stop_find=end_time)
+
+
+def ica_fit_kwargs(method_kwargs):
+    """The ICA.fit arguments set by ica_decim, ica_start and ica_stop."""
+    fit_kwargs = {}
+    for key in ("decim", "start", "stop"):
+        if method_kwargs.get("ica_" + key, None) is not None:
+            fit_kwargs[key] = method_kwargs["ica_" + key]
+    return fit_kwargs
+
+
+def _fit_and_save_ica(mne_array, fname, end_time, fit_kwargs):
+    ica = fit_auto_ica(mne_array, end_time, fit_kwargs)
+    ica.save(fname)
+    return fname
+
+
+def _signal_files(signals):
+    """The source and .set files of signals, or None if any are not from a file."""
+    files = [getattr(s, "source_file", None) for s in signals]
+    if any(f is None or not os.path.isfile(f) for f in files):
+        return None
+    set_files = [os.path.splitext(f)[0] + ".set" for f in files]
+    return sorted(set(files + [f for f in set_files if os.path.isfile(f)]))
+
+
+def _mapping_identity(recording):
+    """The mapping file of a recording and its mtime, as part of a cache key."""
+    param_file = getattr(recording, "param_file", None)
+    if param_file is None or not os.path.isfile(param_file):
+        return param_file
+    return (os.path.abspath(param_file), os.path.getmtime(param_file))
+
+
+def _clean_cache_get(key, source_files, disk_cache):
+    """Look up a clean result in memory, then on disk."""
+    if key in _clean_cache:
+        _clean_cache.move_to_end(key)
+        return deepcopy(_clean_cache[key])
+    if disk_cache is None:
+        return None
+    cached = disk_cache.get(disk_cache.make_key("clean", source_files, key))
+    if cached is None:
+        return None
+
+    meta = cached["meta"]
+    results = {
+        "signals": OrderedDict(),
+        "fig": None,
+        "cleaned": None,
+        "zscored": None,
+        "bad_channels": meta["bad_channels"],
+    }
+    if meta["zscored"]:
+        results["zscored"] = OrderedDict()
+    for i, region in enumerate(meta["regions"]):
+        samples = cached["signal_{}".format(i)]
+        if meta["units"][i] is not None:
+            samples = samples * u.Unit(meta["units"][i])
+        eeg = simuran.Eeg()
+        eeg.from_numpy(samples, sampling_rate=meta["sampling_rates"][i])
+        eeg.set_region(region)
+        eeg.set_channel("avg")
+        results["signals"][region] = eeg
+        if meta["zscored"]:
+            results["zscored"][region] = cached["zscored_{}".format(i)]
+    _clean_cache_put(key, source_files, results, None)
+    return deepcopy(results)
+
+
+def _clean_cache_put(key, source_files, results, disk_cache):
+    """Store a clean result in memory, and on disk if disk_cache is given."""
+    _clean_cache[key] = deepcopy(results)
+    while len(_clean_cache) > CLEAN_CACHE_SIZE:
+        _clean_cache.popitem(last=False)
+    if disk_cache is None:
+        return
+
+    arrays = {}
+    meta = {
+        "regions": [],
+        "units": [],
+        "sampling_rates": [],
+        "bad_channels": results["bad_channels"],
+        "zscored": results["zscored"] is not None,
+    }
+    for i, (region, eeg) in enumerate(results["signals"].items()):
+        unit = getattr(eeg.samples, "unit", None)
+        arrays["signal_{}".format(i)] = np.asarray(
+            getattr(eeg.samples, "value", eeg.samples)
+        )
+        meta["regions"].append(region)
+        meta["units"].append(None if unit is None else unit.to_string())
+        meta["sampling_rates"].append(float(eeg.sampling_rate))
+        if results["zscored"] is not None:
+            arrays["zscored_{}".format(i)] = np.asarray(results["zscored"][region])
+    disk_cache.put(disk_cache.make_key("clean", source_files, key), arrays, meta)
+
+
 class LFPClean(object):
     """
     Class to clean LFP signals.
@@ -169,6 +437,8 @@ class LFPClean(object):
         Currently supports "avg", "zscore", "avg_raw", "ica", "pick".
     visualise : bool
         Whether to visualise the cleaning.
+    cache : bool
+        Whether to reuse the results of previous calls to clean.
 
     Parameters
     ----------
@@ -179,6 +449,11 @@ class LFPClean(object):
         Whether to visualise the cleaning.
     show_vis : bool
         Whether to visualise on the fly or return figs
+    cache : bool
+        Whether to reuse the results of previous calls to clean.
+        Results are kept in memory for the last CLEAN_CACHE_SIZE calls,
+        and on disk in the decoded cache if that is enabled.
+        Only used if visualise is False and the method is not "ica".
 
     Methods
     -------
@@ -186,10 +461,11 @@ class LFPClean(object):
 
     """
 
-    def __init__(self, method="avg", visualise=False, show_vis=True):
+    def __init__(self, method="avg", visualise=False, show_vis=True, cache=True):
         self.method = method
         self.visualise = visualise
         self.show_vis = show_vis
+        self.cache = cache
 
     def compare_methods(self, methods, data, min_f, max_f, **filter_kwargs):
         results = {}
@@ -229,6 +505,13 @@ class LFPClean(object):
         dict
             keys are "signals", "fig", "cleaned", "zscored"
 
+        Notes
+        -----
+        The signals of data are not all loaded after cleaning.
+        A cached result is returned without loading any of them,
+        and the pick methods only load the picked channels.
+        Call load_signals on them before using their samples.
+
         """
         bad_chans = None
         results = {
@@ -241,19 +524,61 @@ class LFPClean(object):
         if method_kwargs is None:
             method_kwargs = {}
         ica_fname = None
+        mapping = None
         if isinstance(data, simuran.Recording):
             signals = data.signals
             base_dir = method_kwargs.get("base_dir", None)
             ica_fname = data.get_name_for_save(base_dir)
-            for i in range(len(signals)):
-                signals[i].load()
+            mapping = _mapping_identity(data)
         else:
             signals = data
 
+        cache_key, source_files, disk_cache = None, None, None
+        if self.cache and not self.visualise and self.method != "ica":
+            source_files = _signal_files(signals)
+        if source_files is not None:
+            cache_key = repr(
+                (
+                    self.method,
+                    min_f,
+                    max_f,
+                    sorted(method_kwargs.items()),
+                    sorted(filter_kwargs.items()),
+                    [os.path.abspath(f) for f in source_files],
+                    [os.path.getmtime(f) for f in source_files],
+                    mapping,
+                    [(s.region, s.channel, getattr(s, "group", None)) for s in signals],
+                )
+            )
+            disk_cache = get_cache()
+            cached = _clean_cache_get(cache_key, source_files, disk_cache)
+            if cached is not None:
+                return cached
+
+        # The pick methods only use the picked channels, so only load those.
+        # The other channels are still reported in bad_channels.
+        chunk_size = method_kwargs.get("chunk_size", None)
+        picked = None
+        if self.method in ("pick", "pick_zscore"):
+            channels = method_kwargs.get("channels")
+            prop = method_kwargs.get("pick_property", "channel")
+            if channels is None:
+                raise ValueError("You must pass the keyword arg channels for pick")
+            picked = [s for s in signals if getattr(s, prop) in channels]
+        if picked is not None and not self.visualise:
+            load_signals(picked)
+        else:
+            load_signals(signals)
+
         highpass = 0.0
         if min_f is not None:
             filter_kwargs["verbose"] = filter_kwargs.get("verbose", "WARNING")
-            signals = self.filter_sigs(signals, min_f, max_f, **filter_kwargs)
+            if picked is not None and not self.visualise:
+                picked = self.filter_sigs(picked, min_f, max_f, **filter_kwargs)
+            else:
+                signals = self.filter_sigs(signals, min_f, max_f, **filter_kwargs)
+                if picked is not None:
+                    picked = [s for s in signals if getattr(s, prop) in channels]
             highpass = min_f
 
         if self.method == "avg":
@@ -264,6 +589,7 @@ class LFPClean(object):
                 max_f,
                 clean=True,
                 z_threshold=z_threshold,
+                chunk_size=chunk_size,
                 **filter_kwargs,
             )
         elif self.method == "zscore":
@@ -274,6 +600,7 @@ class LFPClean(object):
                 max_f,
                 clean=True,
                 z_threshold=z_threshold,
+                chunk_size=chunk_size,
                 **filter_kwargs,
             )
             results["zscored"] = zscores
@@ -303,31 +630,35 @@ class LFPClean(object):
                 ica_fname=ica_fname,
                 manual=manual_ica,
                 highpass=highpass,
+                fit_kwargs=ica_fit_kwargs(method_kwargs),
             )
             results["cleaned"] = reconst
             results["ica_figs"] = figs
         elif self.method == "pick":
-            channels = method_kwargs.get("channels")
-            prop = method_kwargs.get("pick_property", "channel")
-            if channels is None:
-                raise ValueError("You must pass the keyword arg channels for pick")
-            container = simuran.GenericContainer(signals[0].__class__)
-            container.container = [s for s in signals if getattr(s, prop) in channels]
+            container = simuran.GenericContainer(picked[0].__class__)
+            container.container = list(picked)
             result, extra_bad = self.avg_method(
-                container, min_f, max_f, clean=True, **filter_kwargs
+                container,
+                min_f,
+                max_f,
+                clean=True,
+                chunk_size=chunk_size,
+                **filter_kwargs,
             )
+            # extra_bad holds the channels of the picked outliers
             bad_chans = [s.channel for s in signals if getattr(s, prop) not in channels]
-            bad_chans += [signals[i].channel for i in extra_bad]
+            bad_chans += extra_bad
             results["bad_channels"] = bad_chans
         elif self.method == "pick_zscore":
-            channels = method_kwargs.get("channels")
-            prop = method_kwargs.get("pick_property", "channel")
-            if channels is None:
-                raise ValueError("You must pass the keyword arg channels for pick")
-            container = simuran.GenericContainer(signals[0].__class__)
-            container.container = [s for s in signals if getattr(s, prop) in channels]
+            container = simuran.GenericContainer(picked[0].__class__)
+            container.container = list(picked)
             result, extra_bad, _ = self.z_score_method(
-                container, min_f, max_f, clean=True, **filter_kwargs
+                container,
+                min_f,
+                max_f,
+                clean=True,
+                chunk_size=chunk_size,
+                **filter_kwargs,
             )
             if len(extra_bad) != 0:
                 if isinstance(data, simuran.Recording):
@@ -336,7 +667,7 @@ class LFPClean(object):
                     msg = f"Signals {extra_bad} don't agree"
                 print(msg)
             bad_chans = [s.channel for s in signals if getattr(s, prop) not in channels]
-            bad_chans += [signals[i].channel for i in extra_bad]
+            bad_chans += extra_bad
             results["bad_channels"] = bad_chans
         else:
             raise ValueError(f"{self.method} is not a valid clean method")
@@ -350,6 +681,9 @@ class LFPClean(object):
 
             results["fig"] = fig
 
+        if cache_key is not None:
+            _clean_cache_put(cache_key, source_files, results, disk_cache)
+
         return results
 
     def vis_cleaning(self, result, signals, bad_chans=None, **kwargs):
@@ -381,7 +715,14 @@ class LFPClean(object):
         return fig
 
     def z_score_method(
-        self, signals, min_f, max_f, clean=True, z_threshold=1.1, **filter_kwargs
+        self,
+        signals,
+        min_f,
+        max_f,
+        clean=True,
+        z_threshold=1.1,
+        chunk_size=None,
+        **filter_kwargs,
     ):
         lfp_signals = signals
 
@@ -397,6 +738,7 @@ class LFPClean(object):
                 z_threshold=z_threshold,
                 verbose=True,
                 clean=clean,
+                chunk_size=chunk_size,
             )
             eeg = simuran.Eeg()
             eeg.from_numpy(val, sampling_rate=signals[0].sampling_rate)
@@ -411,7 +753,14 @@ class LFPClean(object):
         return output_dict, bad_chans, z_score_dict
 
     def avg_method(
-        self, signals, min_f, max_f, clean=True, z_threshold=1.1, **filter_kwargs
+        self,
+        signals,
+        min_f,
+        max_f,
+        clean=True,
+        z_threshold=1.1,
+        chunk_size=None,
+        **filter_kwargs,
     ):
         lfp_signals = signals
 
@@ -426,6 +775,7 @@ class LFPClean(object):
                 z_threshold=z_threshold,
                 verbose=True,
                 clean=clean,
+                chunk_size=chunk_size,
             )
             eeg = simuran.Eeg()
             eeg.from_numpy(val, sampling_rate=signals[0].sampling_rate)
@@ -438,6 +788,90 @@ class LFPClean(object):
 
         return output_dict, bad_chans
 
+    def fit_ica_batch(
+        self,
+        recordings,
+        min_f=None,
+        max_f=None,
+        method_kwargs=None,
+        num_workers=1,
+        **filter_kwargs,
+    ):
+        """
+        Fit and store the automatic ICA of many recordings in parallel.
+
+        The ICA is stored where clean with the "ica" method looks for it,
+        so cleaning the recordings afterwards only applies the ICA.
+        Recordings with a stored ICA are skipped.
+        Scripts/fit_ica.py runs this over the recordings in a table.
+
+        Parameters
+        ----------
+        recordings : iterable of simuran.Recording
+            The recordings to fit ICA on.
+        min_f, max_f, method_kwargs, filter_kwargs :
+            As passed to clean.
+            method_kwargs can set ica_decim, ica_start and ica_stop to fit
+            on a decimated or cropped copy of the signals.
+        num_workers : int, optional
+            The number of processes to fit in, defaults to 1.
+
+        Returns
+        -------
+        list of str
+            The ICA file of each recording.
+
+        """
+        if method_kwargs is None:
+            method_kwargs = {}
+        base_dir = method_kwargs.get("base_dir", None)
+        fit_kwargs = ica_fit_kwargs(method_kwargs)
+        os.makedirs(ICA_DIR, exist_ok=True)
+
+        fnames = []
+        pending = set()
+        executor = ProcessPoolExecutor(num_workers) if num_workers > 1 else None
+        try:
+            for recording in recordings:
+                signals = recording.signals
+                load_signals(signals)
+                highpass = 0.0
+                if min_f is not None:
+                    filter_kwargs["verbose"] = filter_kwargs.get("verbose", "WARNING")
+                    signals = self.filter_sigs(signals, min_f, max_f, **filter_kwargs)
+                    highpass = min_f
+                mne_array = signals.convert_signals_to_mne(verbose=False)
+                mne_array.info["highpass"] = highpass
+                fname = ica_file_name(
+                    signals,
+                    mne_array,
+                    recording.get_name_for_save(base_dir),
+                    False,
+                    fit_kwargs,
+                )
+                fnames.append(fname)
+                if os.path.exists(fname):
+                    continue
+
+                end_time = min(120.0, signals[0].get_end().value)
+                job = (mne_array, fname, end_time, fit_kwargs)
+                if executor is None:
+                    _fit_and_save_ica(*job)
+                    continue
+                # Limit how many recordings are held in memory waiting to fit
+                if len(pending) >= 2 * num_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(_fit_and_save_ica, *job))
+            for future in pending:
+                future.result()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return fnames
+
     def ica_method(
         self,
         signals,
@@ -447,6 +881,7 @@ class LFPClean(object):
         ica_fname=None,
         manual=True,
         highpass=0.0,
+        fit_kwargs=None,
     ):
         skip_plots = not self.visualise
         show = self.show_vis
@@ -461,28 +896,8 @@ class LFPClean(object):
 
         loaded = False
         if save:
-            home = os.path.abspath(os.path.expanduser("~"))
-            default_save_location = os.path.join(home, ".skm_python", "ICA_files")
-            os.makedirs(default_save_location, exist_ok=True)
-            bit = "-auto"
-            if manual:
-                bit = ""
-            if ica_fname is None:
-                if os.path.basename(signals[0].source_file) != "<unknown>":
-                    ica_fname = (
-                        os.path.splitext(os.path.basename(signals[0].source_file))[0]
-                        + f"{bit}-ica.fif.gz"
-                    )
-                else:
-                    val = np.round(np.mean(signals[0].samples), 3)
-                    name = str(val).replace(".", "-")
-                    ica_fname = os.path.join(name) + f"{bit}-ica.fif.gz"
-            elif not ica_fname.endswith("-ica.fif.gz"):
-                if not ica_fname.endswith("-ica.fif"):
-                    ica_fname = os.path.splitext(ica_fname)[0] + f"{bit}-ica.fif.gz"
-
-            fname = os.path.join(default_save_location, ica_fname)
-
+            os.makedirs(ICA_DIR, exist_ok=True)
+            fname = ica_file_name(signals, mne_array, ica_fname, manual, fit_kwargs)
             if os.path.exists(fname):
                 print("Loading ICA from {}".format(fname))
                 ica = read_ica(fname, verbose="ERROR")
@@ -490,16 +905,9 @@ class LFPClean(object):
                 print(ica.exclude)
 
         if not loaded:
-            ica = ICA(
-                method="picard",
-                random_state=42,
-                max_iter="auto",
-                fit_params=dict(ortho=True, extended=True),
-                n_components=None,
-            )
-
-            ica.fit(mne_array)
             if manual:
+                ica = ICA(**ICA_PARAMS)
+                ica.fit(mne_array, **(fit_kwargs or {}))
 
                 if exclude is None:
                     # Plot raw ICAs
@@ -529,11 +937,9 @@ class LFPClean(object):
 
             else:
                 end_time = min(120.0, signals[0].get_end().value)
-                ica = ica.detect_artifacts(
-                    mne_array, start_find=20.0, stop_find=end_time
-                )
+                ica = fit_auto_ica(mne_array, end_time, fit_kwargs)
 
-        if save:
+        if save and not os.path.exists(fname):
             ica.save(fname)
 
         # Apply ICA exclusion
@@ -628,9 +1034,57 @@ class LFPClean(object):
 
         return reconst_raw, output_dict, figs
 
-    def filter_sigs(self, signals, min_f, max_f, **filter_kwargs):
+    def filter_sigs(self, signals, min_f, max_f, inplace=False, **filter_kwargs):
+        """
+        Filter signals between min_f and max_f.
+
+        The signals are stacked into one channels x samples array per
+        sampling rate, so the filter is designed once and applied to
+        all the channels together by mne.filter.filter_data.
+
+        Parameters
+        ----------
+        signals : iterable of simuran.BaseSignal
+            The signals to filter.
+        min_f : float
+            The low cutoff frequency.
+        max_f : float
+            The high cutoff frequency.
+        inplace : bool, optional
+            Whether to also replace the samples of signals with the
+            filtered samples, defaults to False.
+        filter_kwargs : keyword arguments
+            Passed to mne.filter.filter_data.
+
+        Returns
+        -------
+        simuran.EegArray
+            The filtered signals.
+
+        """
+        signals = list(signals)
+        by_rate = OrderedDict()
+        for i, signal in enumerate(signals):
+            by_rate.setdefault(float(signal.sampling_rate), []).append(i)
+
+        filtered = [None] * len(signals)
+        for sampling_rate, idxs in by_rate.items():
+            samples = [signals[i].samples for i in idxs]
+            data = np.array(
+                [getattr(val, "value", val) for val in samples], dtype=np.float64
+            )
+            data = filter_data(
+                data, sampling_rate, min_f, max_f, copy=False, **filter_kwargs
+            )
+            for i, val, row in zip(idxs, samples, data):
+                unit = getattr(val, "unit", None)
+                filtered[i] = row if unit is None else u.Quantity(row, unit, copy=False)
+
         eeg_array = simuran.EegArray()
-        for signal in signals:
-            filt_s = signal.filter(min_f, max_f, inplace=False, **filter_kwargs)
-            eeg_array.append(simuran.Eeg(signal=filt_s))
+        for signal, samples in zip(signals, filtered):
+            if inplace:
+                signal.samples = samples
+            eeg = simuran.Eeg(signal=signal)
+            eeg.samples = samples
+            eeg_array.append(eeg)
         return eeg_array
@@ -10,9 +10,10 @@ from neurochat.nc_utils import butter_filter
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcol
-from math import floor, ceil
+from numpy.lib.stride_tricks import sliding_window_view
 
 from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+from lfp_atn_simuran.Scripts.decoded_cache import load_spatial
 import simuran
 
 
@@ -36,27 +37,24 @@ def lfp_rate_recording(recording, base_dir, figures, **kwargs):
     save_name = recording.get_name_for_save(rel_dir=base_dir)
     results = {}
     fig, ax = plt.subplots(2, 2)
-    spatial = recording.spatial.underlying
+    spatial = load_spatial(recording).underlying
 
+    # All the band and region maps share one pass over the position data
+    maps = []
     for j in range(len(low_f)):
-        low = low_f[j]
-        high = high_f[j]
-        band = band_name[j]
-
         for i, (region, signal) in enumerate(region_sigs.items()):
-            data = lfp_rate(
-                spatial,
-                signal,
-                low_f=low,
-                high_f=high,
-                filter_kwargs={"verbose": "WARNING"},
-            )
-            lfp_rate_plot(data, ax=ax[j][i])
-            ax[j][i].set_title(f"{region}: {low}-{high} Hz")
-            nc_results = spatial.get_results()
-            for name, value in nc_results.items():
-                results[f"{region}--{band}--{name}"] = value
-            spatial.reset_results()
+            maps.append((j, i, region, signal))
+    all_data = lfp_rates(
+        spatial,
+        [(signal, low_f[j], high_f[j]) for j, _, _, signal in maps],
+        filter_kwargs={"verbose": "WARNING"},
+    )
+
+    for (j, i, region, _), (data, nc_results) in zip(maps, all_data):
+        lfp_rate_plot(data, ax=ax[j][i])
+        ax[j][i].set_title(f"{region}: {low_f[j]}-{high_f[j]} Hz")
+        for name, value in nc_results.items():
+            results[f"{region}--{band_name[j]}--{name}"] = value
 
     fig.tight_layout()
     out_name = f"{save_name}--lfp_rate"
@@ -67,10 +65,86 @@ def lfp_rate_recording(recording, base_dir, figures, **kwargs):
     return results
 
 
+def lfp_window_amplitudes(lfp_samples, sampling_rate, times, half_width=0.05):
+    """
+    Mean absolute LFP in a window around each time.
+
+    Windows are gathered from a strided view of the absolute LFP,
+    one batch for each window length, so each mean is the same as
+    taking np.mean of the window on its own.
+
+    Parameters
+    ----------
+    lfp_samples : np.ndarray
+        The LFP samples.
+    sampling_rate : float
+        The sampling rate of the LFP.
+    times : np.ndarray
+        The centre of each window in seconds.
+    half_width : float, optional
+        Half the window length in seconds, defaults to 0.05.
+
+    Returns
+    -------
+    amplitudes : np.ndarray
+        The mean absolute LFP in each window,
+        0 where the window ends after the LFP.
+    valid : np.ndarray
+        Whether each window ends before the end of the LFP.
+
+    """
+    times = np.asarray(times, dtype=np.float64)
+    num_samples = len(lfp_samples)
+    low = np.floor((times - half_width) * sampling_rate).astype(np.int64)
+    high = np.ceil((times + half_width) * sampling_rate).astype(np.int64)
+    valid = high < num_samples
+    # Negative starts index from the end, as when slicing
+    start = np.where(low < 0, np.maximum(low + num_samples, 0), low)
+    length = high + 1 - start
+
+    abs_lfp = np.abs(lfp_samples)
+    amplitudes = np.zeros(times.shape, dtype=np.float64)
+    for size in np.unique(length[valid]):
+        which = valid & (length == size)
+        if size <= 0:
+            amplitudes[which] = np.nan
+            continue
+        windows = sliding_window_view(abs_lfp, size)
+        amplitudes[which] = np.mean(windows[start[which]], axis=1)
+    return amplitudes, valid
+
+
 def lfp_rate(self, lfp_signal, low_f=None, high_f=None, filter_kwargs=None, **kwargs):
     """Calculate LFP rate map."""
-    _results = oDict()
-    graph_data = {}
+    update = kwargs.get("update", True)
+    graph_data, _results = lfp_rates(
+        self, [(lfp_signal, low_f, high_f)], filter_kwargs=filter_kwargs, **kwargs
+    )[0]
+    if update:
+        self.update_result(_results)
+    return graph_data
+
+
+def lfp_rates(self, maps, filter_kwargs=None, **kwargs):
+    """
+    Calculate several LFP rate maps from one binning of the position data.
+
+    Parameters
+    ----------
+    maps : list of tuple
+        (lfp_signal, low_f, high_f) for each map,
+        low_f is None to not filter the signal.
+    filter_kwargs : dict, optional
+        Keyword arguments passed to the filter.
+    kwargs :
+        As for lfp_rate.
+
+    Returns
+    -------
+    list of tuple
+        (graph_data, results) of each map.
+
+    """
     update = kwargs.get("update", True)
     pixel = kwargs.get("pixel", 3)
     chop_bound = kwargs.get("chop_bound", 5)
@@ -83,20 +157,6 @@ def lfp_rate(self, lfp_signal, low_f=None, high_f=None, filter_kwargs=None, **kw
     separate_border_data = kwargs.get("separateBorderData", None)
     samples_per_sec = kwargs.get("samplesPerSec", 10)
 
-    if low_f is not None:
-        if filter_kwargs is None:
-            filter_kwargs = {}
-        try:
-            lfp_signal = lfp_signal.filter(low_f, high_f, **filter_kwargs)
-        except BaseException:
-            lfp_signal = deepcopy(lfp_signal)
-            _filt = [10, low_f, high_f, "bandpass"]
-            lfp_signal.set_samples(
-                butter_filter(
-                    lfp_signal.get_samples(), lfp_signal.get_sampling_rate(), _filt
-                )
-            )
-
     if separate_border_data is not None:
         self.set_border(separate_border_data.calc_border(**kwargs))
         times = self._time
@@ -110,15 +170,10 @@ def lfp_rate(self, lfp_signal, low_f=None, high_f=None, filter_kwargs=None, **kw
     xedges = self._xbound
     yedges = self._ybound
 
-    posX = self._pos_x[
-        np.logical_and(self.get_time() >= lim[0], self.get_time() <= lim[1])
-    ]
-    posY = self._pos_y[
-        np.logical_and(self.get_time() >= lim[0], self.get_time() <= lim[1])
-    ]
-    time_to_use = self.get_time()[
-        np.logical_and(self.get_time() >= lim[0], self.get_time() <= lim[1])
-    ]
+    in_range = np.logical_and(self.get_time() >= lim[0], self.get_time() <= lim[1])
+    posX = self._pos_x[in_range]
+    posY = self._pos_y[in_range]
+    time_to_use = self.get_time()[in_range]
     skip_rate = int(self.get_sampling_rate() / samples_per_sec)
     slicer = slice(skip_rate, -skip_rate, skip_rate)
     posX = posX[slicer]
@@ -138,85 +193,106 @@ def lfp_rate(self, lfp_signal, low_f=None, high_f=None, filter_kwargs=None, **kw
     xedges = np.arange(xbin) * pixel
     yedges = np.arange(ybin) * pixel
 
-    binned_lfp = np.zeros_like(tmap)
+    # Index of the bin of each position, -1 wraps around as when indexing
+    x_idx = np.digitize(posX, xedges) - 1
+    y_idx = np.digitize(posY, yedges) - 1
+    x_idx[x_idx < 0] += xbin
+    y_idx[y_idx < 0] += ybin
+    flat_idx = y_idx * xbin + x_idx
+
+    rate_tmap = tmap / samples_per_sec
 
-    lfp_amplitudes = np.zeros_like(time_to_use)
-    lfp_samples = lfp_signal.get_samples()
-    do_once = True
+    output = []
+    for lfp_signal, low_f, high_f in maps:
+        if low_f is not None:
+            if filter_kwargs is None:
+                filter_kwargs = {}
+            try:
+                lfp_signal = lfp_signal.filter(low_f, high_f, **filter_kwargs)
+            except BaseException:
+                lfp_signal = deepcopy(lfp_signal)
+                _filt = [10, low_f, high_f, "bandpass"]
+                lfp_signal.set_samples(
+                    butter_filter(
+                        lfp_signal.get_samples(), lfp_signal.get_sampling_rate(), _filt
+                    )
+                )
 
-    # Want value in mv
-    if hasattr(lfp_samples, "unit"):
-        import astropy.units as u
+        lfp_samples = lfp_signal.get_samples()
 
-        lfp_samples = lfp_samples.to(u.uV).value
-    else:
-        lfp_samples = lfp_samples * 1000
-
-    for i, t in enumerate(time_to_use):
-        low_sample = floor((t - 0.05) * lfp_signal.get_sampling_rate())
-        high_sample = ceil((t + 0.05) * lfp_signal.get_sampling_rate())
-        if high_sample < len(lfp_samples):
-            lfp_amplitudes[i] = np.mean(
-                np.abs(lfp_samples[low_sample : high_sample + 1])
-            )
-        elif do_once:
+        # Want value in mv
+        if hasattr(lfp_samples, "unit"):
+            import astropy.units as u
+
+            lfp_samples = lfp_samples.to(u.uV).value
+        else:
+            lfp_samples = lfp_samples * 1000
+
+        lfp_amplitudes, valid = lfp_window_amplitudes(
+            lfp_samples, lfp_signal.get_sampling_rate(), time_to_use
+        )
+        if not np.all(valid):
             simuran.log.warning(
                 "Position data ({}s) is longer than EEG data ({}s)".format(
                     time_to_use[-1], len(lfp_samples) / lfp_signal.get_sampling_rate()
                 )
             )
-            do_once = False
 
-    x_idx = np.digitize(posX, xedges) - 1
-    y_idx = np.digitize(posY, yedges) - 1
-    for k, (i, j) in enumerate(zip(x_idx, y_idx)):
-        binned_lfp[j, i] += lfp_amplitudes[k]
-
-    fmap = np.divide(binned_lfp, tmap, out=np.zeros_like(binned_lfp), where=tmap != 0)
-    rate_tmap = tmap / samples_per_sec
-    ps_fmap = np.divide(
-        binned_lfp, rate_tmap, out=np.zeros_like(binned_lfp), where=rate_tmap != 0
-    )
-
-    if brAdjust:
-        nfmap = fmap / fmap.max()
-        if (
-            np.sum(np.logical_and(nfmap >= 0.2, tmap != 0))
-            >= 0.8 * nfmap[tmap != 0].flatten().shape[0]
-        ):
-            back_rate = np.mean(fmap[np.logical_and(nfmap >= 0.2, nfmap < 0.4)])
-            fmap -= back_rate
-            fmap[fmap < 0] = 0
-
-    if filttype is not None:
-        smoothMap = smooth_2d(fmap, filttype, filtsize)
-        smoothMap2 = smooth_2d(ps_fmap, filttype, filtsize)
-    else:
-        smoothMap = fmap
-        smoothMap2 = fmap
-
-    if update:
-        _results["Spatial Skaggs"] = self.skaggs_info(np.abs(ps_fmap), rate_tmap)
-        _results["Spatial Sparsity"] = self.spatial_sparsity(np.abs(ps_fmap), rate_tmap)
-        _results["Spatial Coherence"] = np.corrcoef(
-            ps_fmap[rate_tmap != 0].flatten(), smoothMap2[rate_tmap != 0].flatten()
-        )[0, 1]
-        _results["Peak Firing Rate"] = fmap.max()
-        self.update_result(_results)
+        binned_lfp = np.bincount(
+            flat_idx, weights=lfp_amplitudes, minlength=tmap.size
+        ).reshape(tmap.shape)
 
-    smoothMap[tmap == 0] = None
-
-    graph_data["posX"] = posX
-    graph_data["posY"] = posY
-    graph_data["fmap"] = fmap
-    graph_data["smoothMap"] = smoothMap
-    graph_data["firingMap"] = fmap
-    graph_data["tmap"] = tmap
-    graph_data["xedges"] = xedges
-    graph_data["yedges"] = yedges
-    graph_data["lfpMap"] = binned_lfp
+        fmap = np.divide(
+            binned_lfp, tmap, out=np.zeros_like(binned_lfp), where=tmap != 0
+        )
+        ps_fmap = np.divide(
+            binned_lfp, rate_tmap, out=np.zeros_like(binned_lfp), where=rate_tmap != 0
+        )
 
-    return graph_data
+        if brAdjust:
+            nfmap = fmap / fmap.max()
+            if (
+                np.sum(np.logical_and(nfmap >= 0.2, tmap != 0))
+                >= 0.8 * nfmap[tmap != 0].flatten().shape[0]
+            ):
+                back_rate = np.mean(fmap[np.logical_and(nfmap >= 0.2, nfmap < 0.4)])
+                fmap -= back_rate
+                fmap[fmap < 0] = 0
+
+        if filttype is not None:
+            smoothMap = smooth_2d(fmap, filttype, filtsize)
+            smoothMap2 = smooth_2d(ps_fmap, filttype, filtsize)
+        else:
+            smoothMap = fmap
+            smoothMap2 = fmap
+
+        _results = oDict()
+        if update:
+            _results["Spatial Skaggs"] = self.skaggs_info(np.abs(ps_fmap), rate_tmap)
+            _results["Spatial Sparsity"] = self.spatial_sparsity(
+                np.abs(ps_fmap), rate_tmap
+            )
+            _results["Spatial Coherence"] = np.corrcoef(
+                ps_fmap[rate_tmap != 0].flatten(),
+                smoothMap2[rate_tmap != 0].flatten(),
+            )[0, 1]
+            _results["Peak Firing Rate"] = fmap.max()
+
+        smoothMap[tmap == 0] = None
+
+        graph_data = {}
+        graph_data["posX"] = posX
+        graph_data["posY"] = posY
+        graph_data["fmap"] = fmap
+        graph_data["smoothMap"] = smoothMap
+        graph_data["firingMap"] = fmap
+        graph_data["tmap"] = tmap
+        graph_data["xedges"] = xedges
+        graph_data["yedges"] = yedges
+        graph_data["lfpMap"] = binned_lfp
+        output.append((graph_data, _results))
+
+    return output
 
 
 def lfp_rate_plot(place_data, ax=None, smooth=True, **kwargs):
@@ -1,22 +1,32 @@
 import os
+from collections import OrderedDict
 
 import numpy as np
-from scipy.signal import coherence
 import matplotlib.pyplot as plt
 import seaborn as sns
 import simuran
 
+from lfp_atn_simuran.Scripts.decoded_cache import load_signals
 from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+from lfp_atn_simuran.Scripts.spectral_store import SpectralStore, spectral_store
 
 
-def plot_coherence(x, y, ax, fs=250, group="ATNx", fmin=1, fmax=100):
+def plot_coherence(
+    x, y, ax, fs=250, group="ATNx", fmin=1, fmax=100, store=None, names=None
+):
     sns.set_style("ticks")
     sns.set_palette("colorblind")
 
-    f, Cxy = coherence(x.samples, y.samples, fs, nperseg=2 * fs)
+    # The spectra come from the store, where x and y have been added as names
+    if store is None:
+        names = ("x", "y")
+        store = SpectralStore()
+        store.add_signals({names[0]: x, names[1]: y})
+    f, Cxy = store.coherence(names[0], names[1], int(2 * fs))
 
-    f = f[np.nonzero((f >= fmin) & (f <= fmax))]
-    Cxy = Cxy[np.nonzero((f >= fmin) & (f <= fmax))]
+    in_range = np.nonzero((f >= fmin) & (f <= fmax))
+    f = f[in_range]
+    Cxy = Cxy[in_range]
 
     sns.lineplot(x=f, y=Cxy, ax=ax)
     simuran.despine()
@@ -28,6 +38,18 @@ def plot_coherence(x, y, ax, fs=250, group="ATNx", fmin=1, fmax=100):
     return f, Cxy, np.array([f, Cxy, [group] * len(f)])
 
 
+def coherence_summary(f, Cxy, delta, theta):
+    """Mean delta and theta coherence, and peak coherence at 9-10 Hz."""
+    theta_co = Cxy[np.nonzero((f >= theta[0]) & (f <= theta[1]))]
+    delta_co = Cxy[np.nonzero((f >= delta[0]) & (f <= delta[1]))]
+    peak_theta_co = Cxy[np.nonzero((f >= 9.0) & (f <= 10.0))]
+    return {
+        "theta_coherence": np.nanmean(theta_co, axis=0),
+        "Peak 9_p5Hz Theta coherence": np.nanmax(peak_theta_co, axis=0),
+        "delta_coherence": np.nanmean(delta_co, axis=0),
+    }
+
+
 def define_recording_group(base_dir):
     dirs = base_dir.split(os.sep)
     if dirs[-1].startswith("CS") or dirs[-2].startswith("CS"):
@@ -52,6 +74,13 @@ def plot_recording_coherence(
     delta_max = kwargs.get("delta_max", 4)
     theta_min = kwargs.get("theta_min", 6)
     theta_max = kwargs.get("theta_max", 10)
+    # "pair" for the coherence of two regions,
+    # "matrix" for the coherence of every pair of regions
+    coherence_mode = kwargs.get("coherence_mode", "pair")
+    # In matrix mode, the regions to use, or None for all of them
+    coherence_regions = kwargs.get("coherence_regions", None)
+    # In matrix mode, also find the coherence between every pair of channels
+    per_channel = kwargs.get("coherence_per_channel", False)
     group = define_recording_group(base_dir)
     result = {}
 
@@ -63,6 +92,58 @@ def plot_recording_coherence(
     cleaned_signal_dict = clean_res["signals"]
 
     keys = sorted(list(cleaned_signal_dict.keys()))
+    if coherence_mode == "matrix":
+        if coherence_regions:
+            missing = [r for r in coherence_regions if r not in cleaned_signal_dict]
+            if missing:
+                print(
+                    "WARNING: No signals in regions {} of {}".format(
+                        missing, recording.source_file
+                    )
+                )
+            keys = [r for r in coherence_regions if r in cleaned_signal_dict]
+        store = spectral_store(recording)
+        store.add_signals(cleaned_signal_dict)
+        delta, theta = (delta_min, delta_max), (theta_min, theta_max)
+        result.update(coherence_matrix_results(store, keys, fmin, fmax, delta, theta))
+        if len(keys) == 2:
+            # The same summary keys as the pair mode
+            for key in ("theta_coherence", "Peak 9_p5Hz Theta coherence"):
+                result[key] = result[f"{keys[0]}-{keys[1]} {key}"]
+            result["delta_coherence"] = result[f"{keys[0]}-{keys[1]} delta_coherence"]
+        name = name_plot(recording, base_dir, "_coherence_matrix")
+        simuran.set_plot_style()
+        fig, ax = plt.subplots()
+        plot_coherence_pairs(result, ax)
+        figures.append(
+            simuran.SimuranFigure(fig, name, dpi=400, done=True, format=fmt)
+        )
+
+        if per_channel:
+            # A separate store, as the spectra of every channel are large
+            channel_store = SpectralStore()
+            # A cached or pick clean leaves the signals unloaded
+            load_signals(recording.signals)
+            signals = lfp_clean.filter_sigs(
+                [s for s in recording.signals if s.region in keys],
+                fmin,
+                fmax,
+                verbose="WARNING",
+            )
+            channel_store.add_signals(
+                OrderedDict((f"{s.region}_{s.channel}", s) for s in signals)
+            )
+            channel_res = coherence_matrix_results(
+                channel_store,
+                list(channel_store.signals.keys()),
+                fmin,
+                fmax,
+                delta,
+                theta,
+            )
+            for key, value in channel_res.items():
+                result[f"channel {key}"] = value
+        return result
     if len(keys) != 2:
         raise RuntimeError("This method is designed for signals from two brain regions")
 
@@ -73,16 +154,63 @@ def plot_recording_coherence(
     simuran.set_plot_style()
     fig, ax = plt.subplots()
     sr = v1.sampling_rate
-    f, Cxy, g = plot_coherence(v1, v2, ax, sr, group, fmin=fmin, fmax=fmax)
-    theta_co = Cxy[np.nonzero((f >= theta_min) & (f <= theta_max))]
-    delta_co = Cxy[np.nonzero((f >= delta_min) & (f <= delta_max))]
-    peak_theta_co = Cxy[np.nonzero((f >= 9.0) & (f <= 10.0))]
-    result["theta_coherence"] = np.nanmean(theta_co)
-    result["Peak 9_p5Hz Theta coherence"] = np.nanmax(peak_theta_co)
-    result["delta_coherence"] = np.nanmean(delta_co)
+    store = spectral_store(recording)
+    store.add_signals(cleaned_signal_dict)
+    f, Cxy, g = plot_coherence(
+        v1, v2, ax, sr, group, fmin=fmin, fmax=fmax, store=store, names=keys
+    )
+    result.update(
+        coherence_summary(f, Cxy, (delta_min, delta_max), (theta_min, theta_max))
+    )
     result["full_res"] = g
 
     ax.set_ylim(0, 1)
     figures.append(simuran.SimuranFigure(fig, name, dpi=400, done=True, format=fmt))
 
     return result
+
+
+def coherence_matrix_results(store, regions, fmin, fmax, delta, theta):
+    """
+    Coherence of every pair of regions in a store, with summaries of each pair.
+
+    Returns
+    -------
+    dict
+        "coherence_f", "coherence_pairs" and the float32 frequencies * pairs
+        "coherence_matrix" between fmin and fmax, along with the
+        "<region1>-<region2> theta_coherence", "delta_coherence" and
+        "Peak 9_p5Hz Theta coherence" of each pair.
+
+    """
+    sr = store.signals[regions[0]][1]
+    f, pairs, Cxy = store.coherence_matrix(int(2 * sr), regions)
+    in_range = np.nonzero((f >= fmin) & (f <= fmax))[0]
+    f, Cxy = f[in_range], Cxy[in_range]
+
+    result = {
+        "coherence_f": f,
+        "coherence_pairs": ["{}-{}".format(*pair) for pair in pairs],
+        "coherence_matrix": Cxy,
+    }
+    summary = coherence_summary(f, Cxy, delta, theta)
+    for i, pair in enumerate(result["coherence_pairs"]):
+        for key, value in summary.items():
+            result[f"{pair} {key}"] = float(value[i])
+    return result
+
+
+def plot_coherence_pairs(result, ax):
+    """Plot the coherence of every pair in coherence_matrix_results."""
+    for i, pair in enumerate(result["coherence_pairs"]):
+        sns.lineplot(
+            x=result["coherence_f"],
+            y=result["coherence_matrix"][:, i],
+            ax=ax,
+            label=pair,
+        )
+    simuran.despine()
+    ax.set_xlabel("Frequency (Hz)")
+    ax.set_ylabel("Coherence")
+    ax.set_ylim(0, 1)
+    return ax
@@ -0,0 +1,261 @@
+"""Welch spectra of the regions of a recording, computed once and shared."""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import scipy.fft
+import scipy.integrate
+import scipy.signal
+from numpy.lib.stride_tricks import sliding_window_view
+
+# How many recordings to keep spectra for
+STORE_SIZE = 4
+
+_stores = OrderedDict()
+
+
+def _digest(samples):
+    return hashlib.blake2b(
+        np.ascontiguousarray(samples).tobytes(), digest_size=16
+    ).hexdigest()
+
+
+class SpectralStore(object):
+    """
+    Welch PSDs and cross spectra of each region's LFP in one recording.
+
+    The windowed FFT of each region's segments is computed once for each
+    (nperseg, window, sampling rate) and kept. PSDs, cross spectral
+    densities, band powers and coherence are all averaged from these,
+    so they match scipy.signal.welch, csd and coherence with the default
+    half segment overlap and constant detrending.
+
+    Attributes
+    ----------
+    signals : OrderedDict
+        Region to (samples, sampling_rate, digest of the samples).
+
+    """
+
+    def __init__(self):
+        self.signals = OrderedDict()
+        self._spectra = {}
+
+    def add(self, region, samples, sampling_rate):
+        """
+        Set the samples of a region, keeping its spectra if unchanged.
+
+        Parameters
+        ----------
+        region : str
+            The name of the region.
+        samples : np.ndarray
+            The LFP samples, in uV to get PSDs in uV^2 / Hz.
+        sampling_rate : float
+            The sampling rate of the LFP.
+
+        Returns
+        -------
+        None
+
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        digest = _digest(samples)
+        old = self.signals.get(region, None)
+        if old is not None and old[1] == sampling_rate and old[2] == digest:
+            return
+        self.signals[region] = (samples, sampling_rate, digest)
+        for key in [k for k in self._spectra if k[0] == region]:
+            del self._spectra[key]
+
+    def add_signals(self, signals):
+        """Add a dictionary of region to simuran signal, in uV."""
+        import astropy.units as u
+
+        for region, signal in signals.items():
+            samples = signal.samples
+            if hasattr(samples, "unit"):
+                samples = samples.to(u.uV).value
+            else:
+                samples = np.asarray(samples) * 1000
+            self.add(region, samples, signal.sampling_rate)
+
+    def _window(self, window, nperseg):
+        return scipy.signal.get_window(window, nperseg)
+
+    def spectra(self, region, nperseg, window="hann"):
+        """
+        The windowed FFT of each half overlapping segment of a region.
+
+        Returns
+        -------
+        f : np.ndarray
+            The frequencies.
+        spectra : np.ndarray
+            Segments * frequencies FFT, scaled so that averaging
+            products of it gives one sided densities.
+
+        """
+        samples, fs, _ = self.signals[region]
+        key = (region, int(nperseg), str(window), fs)
+        if key not in self._spectra:
+            nperseg = int(nperseg)
+            step = nperseg - nperseg // 2
+            segments = sliding_window_view(samples, nperseg)[::step]
+            segments = segments - np.mean(segments, axis=-1, keepdims=True)
+            win = self._window(window, nperseg)
+            spectra = scipy.fft.rfft(segments * win, axis=-1)
+            # Split the density scale across the two spectra of a product
+            scale = np.full(spectra.shape[-1], 1.0 / (fs * np.sum(win * win)))
+            scale[1 : None if nperseg % 2 else -1] *= 2
+            spectra *= np.sqrt(scale)
+            f = scipy.fft.rfftfreq(nperseg, 1 / fs)
+            self._spectra[key] = (f, spectra)
+        return self._spectra[key]
+
+    def psd(self, region, nperseg, window="hann"):
+        """The Welch PSD of a region, as scipy.signal.welch."""
+        f, spectra = self.spectra(region, nperseg, window)
+        return f, np.mean(spectra.real**2 + spectra.imag**2, axis=0)
+
+    def scaled_psd(
+        self, region, nperseg, fmin=None, fmax=None, scale="volts", window="hann"
+    ):
+        """
+        The PSD of a region between fmin and fmax, in volts or decibels.
+
+        Decibels are relative to the maximum PSD in the range, so the peak is 0.
+
+        Returns
+        -------
+        f : np.ndarray
+            The frequencies.
+        Pxx : np.ndarray
+            The scaled PSD.
+        Pxx_max : float
+            The maximum PSD that decibels are relative to, 0 for volts.
+
+        """
+        f, Pxx = self.psd(region, nperseg, window)
+        keep = np.ones(f.size, dtype=bool)
+        if fmin is not None:
+            keep &= f >= fmin
+        if fmax is not None:
+            keep &= f <= fmax
+        f, Pxx = f[keep], Pxx[keep]
+        Pxx_max = 0
+        if scale == "decibels":
+            Pxx_max = np.max(Pxx)
+            Pxx = 10 * np.log10(Pxx / Pxx_max)
+        elif scale != "volts":
+            raise ValueError("Unsupported scale {}".format(scale))
+        return f, Pxx, Pxx_max
+
+    def csd(self, region1, region2, nperseg, window="hann"):
+        """The cross spectral density of two regions, as scipy.signal.csd."""
+        f, x = self.spectra(region1, nperseg, window)
+        _, y = self.spectra(region2, nperseg, window)
+        return f, np.mean(np.conjugate(x) * y, axis=0)
+
+    def csd_matrix(self, nperseg, regions=None, window="hann"):
+        """
+        The cross spectral density of every pair of regions.
+
+        Returns
+        -------
+        f : np.ndarray
+            The frequencies.
+        csd : np.ndarray
+            regions * regions * frequencies, with the PSDs on the diagonal.
+
+        """
+        if regions is None:
+            regions = list(self.signals.keys())
+        all_spectra = [self.spectra(r, nperseg, window)[1] for r in regions]
+        f = self.spectra(regions[0], nperseg, window)[0]
+        # frequencies * regions * segments, to batch a matrix product
+        stacked = np.stack(all_spectra).transpose(2, 0, 1)
+        csd = np.matmul(np.conjugate(stacked), stacked.transpose(0, 2, 1))
+        return f, csd.transpose(1, 2, 0) / stacked.shape[-1]
+
+    def coherence_matrix(self, nperseg, regions=None, window="hann"):
+        """
+        The coherence of every pair of regions from one batched CSD.
+
+        Returns
+        -------
+        f : np.ndarray
+            The frequencies.
+        pairs : list of tuple
+            The (region1, region2) of each pair, region1 before region2.
+        coherence : np.ndarray
+            frequencies * pairs float32 coherence.
+
+        """
+        if regions is None:
+            regions = list(self.signals.keys())
+        f, csd = self.csd_matrix(nperseg, regions, window)
+        power = np.diagonal(csd).real.T
+        i, j = np.triu_indices(len(regions), k=1)
+        coherence = np.abs(csd[i, j]) ** 2 / power[i] / power[j]
+        pairs = [(regions[a], regions[b]) for a, b in zip(i, j)]
+        return f, pairs, coherence.T.astype(np.float32)
+
+    def coherence(self, region1, region2, nperseg, window="hann"):
+        """The magnitude squared coherence, as scipy.signal.coherence."""
+        f, pxx = self.psd(region1, nperseg, window)
+        _, pyy = self.psd(region2, nperseg, window)
+        _, pxy = self.csd(region1, region2, nperseg, window)
+        return f, np.abs(pxy) ** 2 / pxx / pyy
+
+    def bandpower(self, region, band, nperseg, total_band=None, window="hann"):
+        """
+        Power in a band of a region, as NLfp.bandpower from NeuroChaT.
+
+        Parameters
+        ----------
+        region : str
+            The region.
+        band : list of float
+            The low and high frequency of the band.
+        nperseg : int
+            The Welch segment length.
+        total_band : list of float, optional
+            The band to find the total power in, defaults to all.
+        window : str, optional
+            The window, defaults to "hann".
+
+        Returns
+        -------
+        dict
+            "bandpower", "total_power" and "relative_power".
+
+        """
+        f, psd = self.psd(region, nperseg, window)
+        freq_res = f[1] - f[0]
+        idx_band = np.logical_and(f >= band[0], f <= band[1])
+        bp = scipy.integrate.simpson(psd[idx_band], dx=freq_res)
+        if total_band is not None:
+            idx_band = np.logical_and(f >= total_band[0], f <= total_band[1])
+            tp = scipy.integrate.simpson(psd[idx_band], dx=freq_res)
+        else:
+            tp = scipy.integrate.simpson(psd, dx=freq_res)
+        return {"bandpower": bp, "total_power": tp, "relative_power": bp / tp}
+
+
+def spectral_store(recording):
+    """
+    The SpectralStore of a recording, shared between analysis functions.
+
+    The stores of the last STORE_SIZE recordings are kept.
+
+    """
+    key = getattr(recording, "source_file", None) or id(recording)
+    if key in _stores:
+        _stores.move_to_end(key)
+    else:
+        _stores[key] = SpectralStore()
+        while len(_stores) > STORE_SIZE:
+            _stores.popitem(last=False)
+    return _stores[key]
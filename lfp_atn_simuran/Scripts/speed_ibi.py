@@ -1,6 +1,5 @@
 from copy import deepcopy
 import os
-from math import floor, ceil
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -10,6 +9,8 @@ import seaborn as sns
 import pandas as pd
 from skm_pyutils.py_table import list_to_df, df_from_file
 
+from lfp_atn_simuran.Scripts.decoded_cache import load_spatial, load_unit
+
 
 # 1. Compare speed and firing rate
 def speed_firing(self, spike_train, **kwargs):
@@ -23,6 +24,13 @@ def speed_firing(self, spike_train, **kwargs):
     bins = np.array([int(b) for b in graph_results["bins"]])
     rate = np.array([float(r) for r in graph_results["rate"]])
 
+    ax = plot_speed_rate(bins, rate, ax)
+
+    return results, ax
+
+
+def plot_speed_rate(bins, rate, ax=None):
+    """Plot the firing rate in each speed bin."""
     if ax is None:
         fig, ax = plt.subplots()
 
@@ -33,59 +41,258 @@ def speed_firing(self, spike_train, **kwargs):
     ax.set_xlabel("Speed (cm / s)")
     ax.set_ylabel("Firing rate (spike / s)")
 
-    return results, ax
+    return ax
+
+
+def speed_rate_cells(
+    speed, pos_times, pos_sr, spike_trains, binsize=1, speed_range=(0, 40)
+):
+    """
+    The firing rate in each speed bin of many cells, as NeuroChaT speed.
+
+    The speed is binned once, and the spikes of every cell are
+    assigned to a position sample with a single searchsorted.
+
+    Parameters
+    ----------
+    speed : np.ndarray
+        The speed at each position sample.
+    pos_times : np.ndarray
+        The time of each position sample, in seconds.
+    pos_sr : float
+        The position sampling rate.
+    spike_trains : list of np.ndarray
+        The spike times of each cell, in seconds.
+    binsize : float, optional
+        The width of the speed bins, defaults to 1.
+    speed_range : tuple of float, optional
+        The speeds to bin, defaults to (0, 40).
+
+    Returns
+    -------
+    dict
+        bins : np.ndarray
+            The speed bins visited for more than one second.
+        rate : np.ndarray
+            The firing rate of each cell (row) in each bin (column).
+        lin_fit_r : np.ndarray
+            The Pearson R of each cell's rate and its linear fit.
+        lin_fit_p : np.ndarray
+            The P value of each lin_fit_r.
+
+    """
+    speed = np.asarray(speed, dtype=float)
+    pos_times = np.asarray(pos_times, dtype=float)
+    min_speed, max_speed = speed_range
+    max_speed = min(max_speed, np.ceil(speed.max() / binsize) * binsize)
+    min_speed = max(min_speed, np.floor(speed.min() / binsize) * binsize)
+    bins = np.arange(min_speed, max_speed, binsize)
+    num_bins = bins.size
+
+    # The speed bin of each position sample
+    speed_edges = np.append(bins, bins[-1] + np.mean(np.diff(bins)))
+    visit_time = np.histogram(speed, speed_edges)[0] / pos_sr
+    speed_bin = np.digitize(speed, speed_edges) - 1
+
+    # The position sample of every spike, the last edge is in the last sample
+    time_edges = np.append(pos_times, pos_times[-1] + np.mean(np.diff(pos_times)))
+    lengths = [len(spike_train) for spike_train in spike_trains]
+    spikes = np.concatenate([np.asarray(t, dtype=float) for t in spike_trains])
+    cell = np.repeat(np.arange(len(spike_trains)), lengths)
+    pos_idx = np.searchsorted(time_edges, spikes, side="right") - 1
+    pos_idx[spikes == time_edges[-1]] = pos_times.size - 1
+    in_pos = (pos_idx >= 0) & (pos_idx < pos_times.size)
+    spike_bin = speed_bin[pos_idx[in_pos]]
+    in_bins = (spike_bin >= 0) & (spike_bin < num_bins)
+    counts = np.bincount(
+        cell[in_pos][in_bins] * num_bins + spike_bin[in_bins],
+        minlength=len(spike_trains) * num_bins,
+    ).reshape(len(spike_trains), num_bins)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = counts / visit_time
+    rate[np.isnan(rate)] = 0
+    visited = visit_time > 1
+    bins = bins[visited]
+    rate = rate[:, visited]
+
+    r, p = _linfit_pearson(bins, rate)
+    return {"bins": bins, "rate": rate, "lin_fit_r": r, "lin_fit_p": p}
+
+
+def _linfit_pearson(x, y):
+    """
+    Pearson R and P of each row of y and its least squares line on x.
+
+    The fitted line has the sign of the correlation of x and y,
+    so this is the absolute correlation, as NeuroChaT linfit reports.
+    Rows with no linear trend have a NaN R and P.
+
+    """
+    n = x.size
+    if n < 2:
+        nans = np.full(y.shape[0], np.nan)
+        return nans, nans.copy()
+    x = x - x.mean()
+    y = y - y.mean(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = (y @ x) / np.sqrt((y**2).sum(axis=1) * (x**2).sum())
+    r = np.minimum(np.abs(r), 1.0)
+    r[r == 0] = np.nan
+    if n == 2:
+        p = np.where(np.isnan(r), np.nan, 1.0)
+    else:
+        dist = scipy.stats.beta(n / 2 - 1, n / 2 - 1, loc=-1, scale=2)
+        p = 2 * dist.sf(r)
+    return r, p
 
 
 # 2. Compare speed and interburst interval
-def calc_ibi(spike_train, speed, speed_sr, burst_thresh=5):
-    unitStamp = spike_train
-    isi = 1000 * np.diff(unitStamp)
-
-    burst_start = []
-    burst_end = []
-    burst_duration = []
-    spikesInBurst = []
-    bursting_isi = []
-    num_burst = 0
-    ibi = []
-    k = 0
-    ibi_speeds = []
-    while k < isi.size:
-        if isi[k] <= burst_thresh:
-            burst_start.append(k)
-            spikesInBurst.append(2)
-            bursting_isi.append(isi[k])
-            burst_duration.append(isi[k])
-            m = k + 1
-            while m < isi.size and isi[m] <= burst_thresh:
-                spikesInBurst[num_burst] += 1
-                bursting_isi.append(isi[m])
-                burst_duration[num_burst] += isi[m]
-                m += 1
-            # to compensate for the span of the last spike
-            burst_duration[num_burst] += 1
-            burst_end.append(m)
-            k = m + 1
-            num_burst += 1
+def find_bursts(isi, burst_thresh=5, breaks=None):
+    """
+    Find bursts as runs of inter spike intervals of at most burst_thresh.
+
+    Parameters
+    ----------
+    isi : np.ndarray
+        The inter spike intervals in ms.
+    burst_thresh : float, optional
+        The longest interval in a burst in ms, defaults to 5.
+    breaks : np.ndarray, optional
+        A boolean for each interval that can't be in a burst,
+        such as the gap between the spike trains of two cells.
+
+    Returns
+    -------
+    burst_start : np.ndarray
+        The index of the first spike in each burst.
+    burst_end : np.ndarray
+        The index of the last spike in each burst.
+    burst_duration : np.ndarray
+        The duration of each burst in ms, plus 1 ms
+        to compensate for the span of the last spike.
+    spikes_in_burst : np.ndarray
+        The number of spikes in each burst.
+
+    """
+    in_burst = isi <= burst_thresh
+    if breaks is not None:
+        in_burst &= ~breaks
+    edges = np.diff(in_burst.astype(np.int8), prepend=0, append=0)
+    burst_start = np.flatnonzero(edges == 1)
+    burst_end = np.flatnonzero(edges == -1)
+    bounds = np.stack([burst_start, burst_end], axis=-1).ravel()
+    burst_duration = np.add.reduceat(np.append(isi, 0), bounds)[::2] + 1
+    spikes_in_burst = burst_end - burst_start + 1
+    return burst_start, burst_end, burst_duration, spikes_in_burst
+
+
+def interval_means(samples, starts, stops):
+    """
+    Mean of samples[start:stop] for each start and stop, from a cumulative sum.
+
+    Empty intervals, and intervals with a nan sample, are nan.
+
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    is_nan = np.isnan(samples)
+    cumulative = np.concatenate([[0.0], np.cumsum(np.where(is_nan, 0, samples))])
+    nan_count = np.concatenate([[0], np.cumsum(is_nan)])
+    starts = np.clip(starts, 0, samples.size)
+    stops = np.clip(stops, 0, samples.size)
+    lengths = stops - starts
+    means = np.full(lengths.shape, np.nan)
+    ok = (lengths > 0) & (nan_count[stops] == nan_count[starts])
+    means[ok] = (cumulative[stops[ok]] - cumulative[starts[ok]]) / lengths[ok]
+    return means
+
+
+def calc_ibi_cells(spike_trains, speed, speed_sr, burst_thresh=5):
+    """
+    The inter burst intervals of many cells, and the mean speed in each.
+
+    The spike trains are joined, so bursts of all cells are found by one
+    run length encoding and interval speeds come from one cumulative sum.
+
+    Parameters
+    ----------
+    spike_trains : list of np.ndarray
+        The spike times of each cell in seconds.
+    speed : np.ndarray
+        The speed of the animal.
+    speed_sr : float
+        The sampling rate of speed.
+    burst_thresh : float, optional
+        The longest inter spike interval in a burst in ms, defaults to 5.
+
+    Returns
+    -------
+    list of tuple
+        For each cell, (ibi, ibi_speeds) as from calc_ibi,
+        or (None, None) if it has no bursts.
+
+    """
+    trains = [np.asarray(train, dtype=np.float64).ravel() for train in spike_trains]
+    if len(trains) == 0:
+        return []
+    lengths = np.array([train.size for train in trains])
+    unit_stamp = np.concatenate(trains)
+    cell = np.repeat(np.arange(len(trains)), lengths)
+    isi = 1000 * np.diff(unit_stamp)
+
+    burst_start, burst_end, _, _ = find_bursts(
+        isi, burst_thresh, breaks=cell[1:] != cell[:-1]
+    )
+    burst_cell = cell[burst_start]
+    # Intervals from the end of a burst to the start of the next in that cell
+    same_cell = burst_cell[1:] == burst_cell[:-1]
+    time_start = unit_stamp[burst_end[:-1][same_cell]]
+    time_end = unit_stamp[burst_start[1:][same_cell]]
+    ibi = (time_end - time_start) * 1000
+    speed_time_idx1 = np.floor(time_start * speed_sr).astype(np.int64)
+    speed_time_idx2 = np.ceil(time_end * speed_sr).astype(np.int64)
+    ibi_speeds = interval_means(speed, speed_time_idx1, speed_time_idx2)
+
+    num_bursts = np.bincount(burst_cell, minlength=len(trains))
+    split_at = np.cumsum(np.maximum(num_bursts - 1, 0))[:-1]
+    results = []
+    for j, (cell_ibi, cell_speeds) in enumerate(
+        zip(np.split(ibi, split_at), np.split(ibi_speeds, split_at))
+    ):
+        if num_bursts[j] == 0:
+            simuran.log.warning("No burst detected")
+            results.append((None, None))
         else:
-            k += 1
-
-    if num_burst:
-        for j in range(0, num_burst - 1):
-            time_end = unitStamp[burst_start[j + 1]]
-            time_start = unitStamp[burst_end[j]]
-            ibi.append((time_end - time_start) * 1000)
-            speed_time_idx1 = int(floor(time_start * speed_sr))
-            speed_time_idx2 = int(ceil(time_end * speed_sr))
-            burst_speed = speed[speed_time_idx1:speed_time_idx2]
-            avg_speed = np.mean(burst_speed)
-            ibi_speeds.append(avg_speed)
+            results.append((cell_ibi, cell_speeds))
+    return results
 
-    else:
-        simuran.log.warning("No burst detected")
-        return None, None
 
-    return np.array(ibi), np.array(ibi_speeds)
+def calc_ibi(spike_train, speed, speed_sr, burst_thresh=5):
+    """
+    The inter burst intervals of a cell, and the mean speed in each.
+
+    Parameters
+    ----------
+    spike_train : np.ndarray
+        The spike times in seconds.
+    speed : np.ndarray
+        The speed of the animal.
+    speed_sr : float
+        The sampling rate of speed.
+    burst_thresh : float, optional
+        The longest inter spike interval in a burst in ms, defaults to 5.
+
+    Returns
+    -------
+    ibi : np.ndarray
+        The time from the last spike of each burst to the first spike
+        of the next in ms, or None if there are no bursts.
+    ibi_speeds : np.ndarray
+        The mean speed over each inter burst interval,
+        or None if there are no bursts.
+
+    """
+    return calc_ibi_cells([spike_train], speed, speed_sr, burst_thresh)[0]
 
 
 def speed_ibi(self, spike_train, **kwargs):
@@ -100,16 +307,47 @@ def speed_ibi(self, spike_train, **kwargs):
     bins = np.arange(min_speed, max_speed, binsize)
 
     ibi, ibi_speeds = calc_ibi(spike_train, speed, samples_per_sec)
-    if ibi is None:
-        return None, None, np.nan, np.nan, 0
-    elif len(ibi) < 10:
+    pd_df, spear_r, spear_p, num_bursts = ibi_speed_relation(ibi, ibi_speeds)
+    if pd_df is None:
         return None, None, np.nan, np.nan, 0
+
+    ax = plot_speed_ibi(pd_df, ax)
+
+    return pd_df, ax, spear_r, spear_p, num_bursts
+
+
+def ibi_speed_relation(ibi, ibi_speeds):
+    """
+    The Spearman correlation of speed and IBI, with the table to plot.
+
+    Parameters
+    ----------
+    ibi : np.ndarray
+        The inter burst intervals of a cell, from calc_ibi.
+    ibi_speeds : np.ndarray
+        The mean speed over each interval.
+
+    Returns
+    -------
+    tuple
+        The speed and IBI table (speeds up to 40 cm/s, rounded),
+        the Spearman R and P and the number of bursts.
+        (None, nan, nan, 0) if there are fewer than 10 intervals.
+
+    """
+    if ibi is None or len(ibi) < 10:
+        return None, np.nan, np.nan, 0
     spear_r, spear_p = scipy.stats.spearmanr(ibi_speeds, ibi)
 
     pd_df = list_to_df([ibi_speeds, ibi], transpose=True, headers=["Speed", "IBI"])
-    pd_df = pd_df[pd_df["Speed"] <= 40]
+    pd_df = pd_df[pd_df["Speed"] <= 40].copy()
     pd_df["Speed"] = np.around(pd_df["Speed"]).astype(int)
 
+    return pd_df, spear_r, spear_p, len(ibi) + 1
+
+
+def plot_speed_ibi(pd_df, ax=None):
+    """Plot the IBI against speed from ibi_speed_relation."""
     if ax is None:
         _, ax = plt.subplots()
     sns.lineplot(data=pd_df, x="Speed", y="IBI", ci=None, ax=ax)
@@ -117,7 +355,7 @@ def speed_ibi(self, spike_train, **kwargs):
     ax.set_xlabel("Speed (cm / s)")
     ax.set_title("Speed vs IBI")
 
-    return pd_df, ax, spear_r, spear_p, len(ibi) + 1
+    return ax
 
 
 def recording_ibi_headings():
@@ -136,12 +374,19 @@ def recording_ibi_headings():
 
 
 def recording_speed_ibi(recording, out_dir, base_dir, **kwargs):
-    """This is performed per cell in the recording."""
+    """
+    This is performed per cell in the recording.
+
+    The spatial data is processed once for all the cells,
+    see speed_rate_cells and calc_ibi_cells.
+    Figures of each cell are only saved if plot_cells is True.
+
+    """
     # How many results expected in a row?
     NUM_RESULTS = len(recording_ibi_headings())
     img_format = kwargs.get("img_format", ".png")
-
-    simuran.set_plot_style()
+    plot_cells = kwargs.get("plot_cells", False)
+    samples_per_sec = kwargs.get("samplesPerSec", 10)
 
     output = {}
     # To avoid overwriting what has been set to analyse
@@ -150,7 +395,7 @@ def recording_speed_ibi(recording, out_dir, base_dir, **kwargs):
     # Unit contains probe/tetrode info, to_analyse are list of cells
     spatial_error = False
     try:
-        recording.spatial.load()
+        load_spatial(recording)
     except BaseException:
         print(
             "WARNING: Unable to load spatial information for {}".format(
@@ -159,8 +404,8 @@ def recording_speed_ibi(recording, out_dir, base_dir, **kwargs):
         )
         spatial_error = True
 
-    os.makedirs(out_dir, exist_ok=True)
-    spatial = recording.spatial.underlying
+    # The cells with data, as (unit group, cell, spike train, duration)
+    cells = []
     for unit, to_analyse in zip(recording.units, all_analyse):
 
         # Two cases for empty list of cells
@@ -169,7 +414,7 @@ def recording_speed_ibi(recording, out_dir, base_dir, **kwargs):
         if len(to_analyse) == 0:
             continue
 
-        unit.load()
+        load_unit(unit)
         # Loading can overwrite units_to_use, so reset these after load
         unit.units_to_use = to_analyse
         out_str_start = str(unit.group)
@@ -191,40 +436,65 @@ def recording_speed_ibi(recording, out_dir, base_dir, **kwargs):
             if cell not in available_units:
                 continue
 
-            op = [np.nan] * NUM_RESULTS
-            fig, axes = plt.subplots(2, 1)
             unit.underlying.set_unit_no(cell)
-            spike_train = unit.underlying.get_unit_stamp()
-            ibi_df, ibi_ax, sr, sp, nb = speed_ibi(spatial, spike_train, ax=axes[0])
-            op[0] = sr
-            op[1] = sp
-            op[2] = nb
-
-            res, speed_ax = speed_firing(spatial, spike_train, ax=axes[1], binsize=2)
-
-            op[3] = res["lin_fit_r"]
-            op[4] = res["lin_fit_p"]
-            op[5] = np.median(np.array(spatial.get_speed()))
-            op[6] = float(np.mean(np.array(spatial.get_speed())))
-
-            if ibi_df is not None:
-                op[7] = ibi_df["IBI"].median()
-                op[8] = ibi_df["Speed"].median()
-                
-            op[9] = len(spike_train) / unit.underlying.get_duration()
-
-            simuran.despine()
-            plt.tight_layout()
-            out_name_end = recording.get_name_for_save(base_dir)
-            out_name_end += "_T{}_SS{}".format(out_str_start, str(cell))
-            out_name = os.path.join(out_dir, out_name_end) + img_format
-
-            fig.savefig(out_name, dpi=400)
-            plt.close(fig)
-
-            output[name_for_save] = op
-            # Do analysis on that unit
-            unit.underlying.reset_results()
+            spike_train = np.array(unit.underlying.get_unit_stamp())
+            duration = unit.underlying.get_duration()
+            cells.append((out_str_start, cell, spike_train, duration))
+
+    if len(cells) == 0:
+        return output
+
+    spatial = recording.spatial.underlying
+    speed = np.array(spatial.get_speed())
+    spike_trains = [spike_train for _, _, spike_train, _ in cells]
+    speed_rates = speed_rate_cells(
+        speed,
+        spatial.get_time(),
+        spatial.get_sampling_rate(),
+        spike_trains,
+        binsize=2,
+    )
+    ibi_results = calc_ibi_cells(spike_trains, speed, samples_per_sec)
+    median_speed = np.median(speed)
+    mean_speed = float(np.mean(speed))
+
+    if plot_cells:
+        simuran.set_plot_style()
+        os.makedirs(out_dir, exist_ok=True)
+    for i, (out_str_start, cell, spike_train, duration) in enumerate(cells):
+        op = [np.nan] * NUM_RESULTS
+        ibi_df, sr, sp, nb = ibi_speed_relation(*ibi_results[i])
+        op[0] = sr
+        op[1] = sp
+        op[2] = nb
+        op[3] = speed_rates["lin_fit_r"][i]
+        op[4] = speed_rates["lin_fit_p"][i]
+        op[5] = median_speed
+        op[6] = mean_speed
+
+        if ibi_df is not None:
+            op[7] = ibi_df["IBI"].median()
+            op[8] = ibi_df["Speed"].median()
+
+        op[9] = len(spike_train) / duration
+        output[out_str_start + "_" + str(cell)] = op
+
+        if not plot_cells:
+            continue
+        fig, axes = plt.subplots(2, 1)
+        if ibi_df is not None:
+            plot_speed_ibi(ibi_df, axes[0])
+        bins = speed_rates["bins"].astype(int)
+        plot_speed_rate(bins, speed_rates["rate"][i], axes[1])
+
+        simuran.despine()
+        plt.tight_layout()
+        out_name_end = recording.get_name_for_save(base_dir)
+        out_name_end += "_T{}_SS{}".format(out_str_start, str(cell))
+        out_name = os.path.join(out_dir, out_name_end) + img_format
+
+        fig.savefig(out_name, dpi=400)
+        plt.close(fig)
 
     return output
 
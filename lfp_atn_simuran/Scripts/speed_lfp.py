@@ -1,4 +1,4 @@
-from math import floor, ceil
+from math import floor
 import os
 
 import matplotlib.pyplot as plt
@@ -8,10 +8,102 @@ from skm_pyutils.py_table import list_to_df, df_to_file
 from skm_pyutils.py_plot import UnicodeGrabber
 import simuran
 import pandas as pd
+import scipy.fft
 import scipy.signal
 import scipy.integrate
+from numpy.lib.stride_tricks import sliding_window_view
 
 from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+from lfp_atn_simuran.Scripts.decoded_cache import load_spatial
+
+
+def window_bounds(times, sampling_rate, half_width, num_samples, end_round=np.floor):
+    """
+    The first and last sample of a window around each time.
+
+    Windows start at floor((t - half_width) * sampling_rate) and end at
+    end_round((t + half_width) * sampling_rate).
+    Negative starts index from the end of the samples, as when slicing.
+
+    """
+    times = np.asarray(times, dtype=np.float64)
+    low = np.floor((times - half_width) * sampling_rate).astype(np.int64)
+    high = end_round((times + half_width) * sampling_rate).astype(np.int64)
+    low = np.where(low < 0, np.maximum(low + num_samples, 0), low)
+    return low, high
+
+
+def window_means(samples, starts, stops):
+    """
+    Mean of samples[start:stop] for each start and stop.
+
+    Windows are gathered from a strided view, one batch for each window
+    length, so each mean is the same as taking np.mean of the slice.
+    Empty windows are nan.
+
+    """
+    samples = np.asarray(samples)
+    stops = np.minimum(stops, samples.size)
+    lengths = stops - starts
+    means = np.full(starts.shape, np.nan)
+    for size in np.unique(lengths[lengths > 0]):
+        which = lengths == size
+        windows = sliding_window_view(samples, size)
+        means[which] = np.mean(windows[starts[which]], axis=1)
+    return means
+
+
+def window_relative_power(
+    lfp_samples, sampling_rate, starts, stops, low_f, high_f, nfft=256
+):
+    """
+    Relative power in a band of lfp_samples[start:stop] for each window.
+
+    This matches scipy.signal.welch with a periodic Hann window as long
+    as each window and no overlap, followed by Simpson integration of
+    the band and total power. Windows of the same length are detrended,
+    tapered and transformed as one batch, and the integrals are products
+    with precomputed Simpson weights.
+
+    Parameters
+    ----------
+    lfp_samples : np.ndarray
+        The LFP samples.
+    sampling_rate : float
+        The sampling rate of the LFP.
+    starts, stops : np.ndarray
+        The first sample and one past the last sample of each window.
+    low_f, high_f : float
+        The frequency band.
+    nfft : int, optional
+        The FFT length, defaults to 256.
+
+    Returns
+    -------
+    np.ndarray
+        The band power over the total power of each window.
+
+    """
+    f = scipy.fft.rfftfreq(nfft, 1 / sampling_rate)
+    idx_band = np.logical_and(f >= low_f, f <= high_f)
+    total_weights = scipy.integrate.simpson(np.eye(f.size), x=f, axis=-1)
+    band_weights = np.zeros(f.size)
+    band_weights[idx_band] = scipy.integrate.simpson(
+        np.eye(np.count_nonzero(idx_band)), x=f[idx_band], axis=-1
+    )
+
+    lengths = stops - starts
+    power = np.zeros(starts.shape)
+    for size in np.unique(lengths):
+        which = lengths == size
+        segments = sliding_window_view(lfp_samples, size)[starts[which]]
+        segments = segments - np.mean(segments, axis=-1, keepdims=True)
+        taper = scipy.signal.windows.hann(size, False)
+        spectra = scipy.fft.rfft(segments * taper, nfft, axis=-1)
+        psd = (spectra.real**2 + spectra.imag**2) / (sampling_rate * np.sum(taper**2))
+        psd[:, 1 : None if nfft % 2 else -1] *= 2
+        power[which] = (psd @ band_weights) / (psd @ total_weights)
+    return power
 
 
 # 3. Compare theta and speed
@@ -20,7 +112,6 @@ def speed_vs_amp(self, lfp_signal, low_f, high_f, filter_kwargs=None, **kwargs):
     lim = kwargs.get("range", [0, self.get_duration()])
     samples_per_sec = kwargs.get("samplesPerSec", 5)
     do_spectrogram_plot = kwargs.get("do_spectogram_plot", False)
-    do_once = True
 
     # Not filtering anymore since using relative power
     # if filter_kwargs is None:
@@ -53,37 +144,25 @@ def speed_vs_amp(self, lfp_signal, low_f, high_f, filter_kwargs=None, **kwargs):
     else:
         lfp_samples = lfp_samples * 1000
 
-    for i, t in enumerate(time_to_use):
-        diff = 1 / (2 * samples_per_sec)
-
-        low_sample = floor((t - diff) * self.get_sampling_rate())
-        high_sample = floor((t + diff) * self.get_sampling_rate())
-        avg_speed[i] = np.mean(speed[low_sample:high_sample])
-
-        low_sample = floor((t - diff) * lfp_signal.get_sampling_rate())
-        high_sample = ceil((t + diff) * lfp_signal.get_sampling_rate())
-        if high_sample < len(lfp_samples):
-            lfp_sample_200ms = lfp_samples[low_sample : high_sample + 1]
-            slep_win = scipy.signal.hann(lfp_sample_200ms.size, False)
-            f, psd = scipy.signal.welch(
-                lfp_sample_200ms,
-                fs=lfp_signal.get_sampling_rate(),
-                window=slep_win,
-                nperseg=len(lfp_sample_200ms),
-                nfft=256,
-                noverlap=0,
-            )
-            idx_band = np.logical_and(f >= low_f, f <= high_f)
-            abs_power = scipy.integrate.simps(psd[idx_band], x=f[idx_band])
-            total_power = scipy.integrate.simps(psd, x=f)
-            lfp_amplitudes[i] = abs_power / total_power
-        elif do_once:
-            simuran.log.warning(
-                "Position data ({}s) is longer than EEG data ({}s)".format(
-                    time_to_use[-1], len(lfp_samples) / lfp_signal.get_sampling_rate()
-                )
+    diff = 1 / (2 * samples_per_sec)
+    low, high = window_bounds(
+        time_to_use, self.get_sampling_rate(), diff, len(speed), np.floor
+    )
+    avg_speed[:] = window_means(speed, low, high)
+
+    # The power of all the windows is found at once
+    lfp_rate = lfp_signal.get_sampling_rate()
+    low, high = window_bounds(time_to_use, lfp_rate, diff, len(lfp_samples), np.ceil)
+    valid = high < len(lfp_samples)
+    lfp_amplitudes[valid] = window_relative_power(
+        lfp_samples, lfp_rate, low[valid], high[valid] + 1, low_f, high_f
+    )
+    if not np.all(valid):
+        simuran.log.warning(
+            "Position data ({}s) is longer than EEG data ({}s)".format(
+                time_to_use[-1], len(lfp_samples) / lfp_rate
             )
-            do_once = False
+        )
 
     min_speed, max_speed = kwargs.get("SpeedRange", [0, 40])
     # This kind of logic can be used in general to bin the speeds
@@ -195,7 +274,7 @@ def speed_lfp_amp(
     do_spectrogram_plot = kwargs.get("do_spectogram_plot", False)
 
     # Single values
-    spatial = recording.spatial.underlying
+    spatial = load_spatial(recording).underlying
     simuran.set_plot_style()
     results = {}
     skip_rate = int(spatial.get_sampling_rate() / speed_sr)
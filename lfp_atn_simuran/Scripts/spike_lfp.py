@@ -6,6 +6,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+from lfp_atn_simuran.Scripts.decoded_cache import load_unit
+from lfp_atn_simuran.Scripts.spike_shuffle import SpikeLfpShuffle, SpikePhase
 from skm_pyutils.py_table import list_to_df, df_from_file, df_to_file
 from skm_pyutils.py_plot import UnicodeGrabber
 
@@ -70,8 +72,6 @@ def recording_spike_lfp(recording, clean_method="avg", **kwargs):
     lc = LFPClean(method=clean_method, visualise=False)
     fmin = 0
     fmax = 100
-    for i in range(len(recording.signals)):
-        recording.signals[i].load()
     signals_grouped_by_region = lc.clean(
         recording.signals, fmin, fmax, method_kwargs=clean_kwargs
     )["signals"]
@@ -85,10 +85,14 @@ def recording_spike_lfp(recording, clean_method="avg", **kwargs):
 
     sub_sig = signals_grouped_by_region["SUB"]
     nc_sig = sub_sig.to_neurochat()
+    shuffle_sub = SpikeLfpShuffle.from_neurochat(nc_sig, fwin=[0, 20])
+    phase_sub = SpikePhase.from_neurochat(nc_sig, fwin=fwin)
 
     if "RSC" in signals_grouped_by_region.keys():
         rsc_sig = signals_grouped_by_region["RSC"]
         nc_sig2 = rsc_sig.to_neurochat()
+        shuffle_rsc = SpikeLfpShuffle.from_neurochat(nc_sig2, fwin=[0, 20])
+        phase_rsc = SpikePhase.from_neurochat(nc_sig2, fwin=fwin)
     else:
         nc_sig2 = None
 
@@ -107,7 +111,7 @@ def recording_spike_lfp(recording, clean_method="avg", **kwargs):
         if len(to_analyse) == 0:
             continue
 
-        unit.load()
+        load_unit(unit)
         # Loading can overwrite units_to_use, so reset these after load
         unit.units_to_use = to_analyse
         out_str_start = str(unit.group)
@@ -151,10 +155,10 @@ def recording_spike_lfp(recording, clean_method="avg", **kwargs):
                 sta_rsc = None
                 sfc_rsc = None
 
-            g_data = nc_sig.phase_dist(spike_train, fwin=fwin)
-            mean_phase = nc_sig.get_results()["LFP Spike Mean Phase"]
-            phase_count = nc_sig.get_results()["LFP Spike Mean Phase Count"]
-            spike_phase_vect = nc_sig.get_results()["LFP Spike Phase Res Vect"]
+            g_data, results = phase_sub.phase_dist(spike_train)
+            mean_phase = results["LFP Spike Mean Phase"]
+            phase_count = results["LFP Spike Mean Phase Count"]
+            spike_phase_vect = results["LFP Spike Phase Res Vect"]
             os.makedirs(os.path.join(output_dir, "spike_phase_plots"), exist_ok=True)
             name = os.path.join(
                 output_dir,
@@ -166,10 +170,10 @@ def recording_spike_lfp(recording, clean_method="avg", **kwargs):
             plt.close(fig)
 
             if nc_sig2 is not None:
-                g_data = nc_sig2.phase_dist(spike_train, fwin=fwin)
-                mean_phase2 = nc_sig2.get_results()["LFP Spike Mean Phase"]
-                phase_count2 = nc_sig2.get_results()["LFP Spike Mean Phase Count"]
-                spike_phase_vect2 = nc_sig2.get_results()["LFP Spike Phase Res Vect"]
+                g_data, results = phase_rsc.phase_dist(spike_train)
+                mean_phase2 = results["LFP Spike Mean Phase"]
+                phase_count2 = results["LFP Spike Mean Phase Count"]
+                spike_phase_vect2 = results["LFP Spike Phase Res Vect"]
                 name = os.path.join(
                     output_dir,
                     "spike_phase_plots",
@@ -186,41 +190,15 @@ def recording_spike_lfp(recording, clean_method="avg", **kwargs):
             # Spike shuffling
             number_of_shuffles = kwargs.get("number_of_shuffles_sta", 500)
             shuffled_times = unit.underlying.shift_spike_times(number_of_shuffles, None)
-            shuffle_sfc_sub = np.zeros(shape=(number_of_shuffles, len(sfc)))
-            spike_phase_vects = np.zeros(number_of_shuffles)
+            shuffle_sfc_sub = shuffle_sub.bootstrap_sfc(shuffled_times, nrep=20)
 
-            if nc_sig2 is not None:
-                shuffle_sfc_rsc = np.zeros(shape=(number_of_shuffles, len(sfc)))
-                spike_phase_vects_rsc = np.zeros(number_of_shuffles)
-            else:
-                shuffle_sfc_rsc = None
-
-            for i in range(number_of_shuffles):
-                spike_times = shuffled_times[i]
-
-                g_data = nc_sig.plv(spike_times, mode="bs", fwin=[0, 20], nrep=20)
-                sfc_sub_rand = g_data["SFCm"]
-                shuffle_sfc_sub[i] = sfc_sub_rand
-
-                if nc_sig2 is not None:
-                    g_data = nc_sig2.plv(spike_times, mode="bs", fwin=[0, 20], nrep=20)
-                    sfc_rsc_rand = g_data["SFCm"]
-                    shuffle_sfc_rsc[i] = sfc_rsc_rand
-
-                nc_sig.phase_dist(spike_train, fwin=fwin)
-                spike_phase_vects[i] = nc_sig.get_results()["LFP Spike Phase Res Vect"]
-
-                if nc_sig2 is not None:
-                    nc_sig2.phase_dist(spike_train, fwin=fwin)
-                    spike_phase_vects_rsc[i] = nc_sig2.get_results()[
-                        "LFP Spike Phase Res Vect"
-                    ]
-
-            spike_phase_vect_sub_ci = np.percentile(spike_phase_vects, 95)
+            spike_phase_vect_sub_ci = phase_sub.shuffle_ci(shuffled_times)
 
             if nc_sig2 is not None:
-                spike_phase_vect_rsc_ci = np.percentile(spike_phase_vects_rsc, 95)
+                shuffle_sfc_rsc = shuffle_rsc.bootstrap_sfc(shuffled_times, nrep=20)
+                spike_phase_vect_rsc_ci = phase_rsc.shuffle_ci(shuffled_times)
             else:
+                shuffle_sfc_rsc = None
                 spike_phase_vect_rsc_ci = None
 
             theta_vals = []
@@ -0,0 +1,499 @@
+"""Batched spike triggered LFP analysis of many (shuffled) spike trains."""
+
+import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import hilbert
+from scipy.signal.windows import hann
+from neurochat.nc_utils import butter_filter, fft_psd
+
+
+def bootstrap_picks(num_spikes, nrep=20, nsample=50, rng=None):
+    """
+    Indices of nrep random samples of nsample spikes, without replacement.
+
+    Parameters
+    ----------
+    num_spikes : int
+        The number of spikes to sample from.
+    nrep : int, optional
+        The number of samples, defaults to 20.
+    nsample : int, optional
+        The number of spikes in each sample, defaults to 50.
+    rng : np.random.Generator or int, optional
+        The random number generator or seed to use.
+
+    Returns
+    -------
+    np.ndarray
+        nrep * nsample indices.
+
+    """
+    rng = np.random.default_rng(rng)
+    return np.array(
+        [rng.choice(num_spikes, nsample, replace=False) for _ in range(nrep)]
+    )
+
+
+class SpikeLfpShuffle(object):
+    """
+    Spike field coherence of many spike trains to one LFP signal.
+
+    This calculates the same SFC as NLfp.plv from NeuroChaT, but for a
+    batch of spike trains at once. The LFP window around each spike is
+    gathered from a strided view of the signal, and the windows of all
+    the spike trains in a batch are transformed together. This is a
+    matrix product with the needed DFT rows when only a narrow band of
+    frequencies is returned, and an FFT otherwise.
+    As the FFT is linear, the spectrum of the spike triggered average is
+    the average of the window spectra, so no further FFTs are needed.
+
+    NLfp.event_trig_average starts its sum of windows from the sample index
+    of the first spike rather than from zero, which adds a constant to the
+    spike triggered average. This is reproduced when match_neurochat is
+    True, so shuffled SFCs stay comparable to the SFC from NLfp.plv.
+
+    Attributes
+    ----------
+    lfp : np.ndarray
+        The LFP samples.
+    timestamps : np.ndarray
+        The time of each LFP sample in seconds.
+    win : np.ndarray
+        The sample offsets of the window around each spike.
+    nfft : int
+        The FFT length.
+    f : np.ndarray
+        The frequencies of the returned SFC.
+    workers : int
+        The number of threads used for the FFT, -1 for all cores.
+    match_neurochat : bool
+        Whether to reproduce the offset of the NeuroChaT STA.
+
+    Parameters
+    ----------
+    lfp : np.ndarray
+        The LFP samples.
+    timestamps : np.ndarray
+        The time of each LFP sample in seconds.
+    sampling_rate : float
+        The sampling rate of the LFP.
+    window : tuple of float, optional
+        The window around each spike in seconds, defaults to (-0.5, 0.5).
+    nfft : int, optional
+        The FFT length, defaults to 1024.
+    fwin : tuple of float, optional
+        The range of frequencies to return, defaults to all.
+    workers : int, optional
+        The number of threads used for the FFT, defaults to -1 (all cores).
+    match_neurochat : bool, optional
+        Whether to reproduce the offset of the NeuroChaT STA, defaults to True.
+
+    """
+
+    def __init__(
+        self,
+        lfp,
+        timestamps,
+        sampling_rate,
+        window=(-0.5, 0.5),
+        nfft=1024,
+        fwin=None,
+        workers=-1,
+        match_neurochat=True,
+    ):
+        self.lfp = np.asarray(lfp, dtype=np.float64)
+        self.timestamps = np.asarray(timestamps)
+        win = np.ceil(np.array(window) * sampling_rate).astype(int)
+        self.win = np.arange(win[0], win[1])
+        self.nfft = nfft
+        self.workers = workers
+        self.match_neurochat = match_neurochat
+
+        # As in NeuroChaT, the taper covers the whole window,
+        # but only the first nfft samples of it are transformed
+        self._taper = hann(self.win.size, False)[:nfft]
+        self._windows = sliding_window_view(self.lfp, self.win.size)
+
+        f = np.arange(0, sampling_rate, sampling_rate / nfft)[: nfft // 2 + 1]
+        if fwin is None or len(fwin) == 0:
+            self._f_idx = np.arange(f.size)
+        else:
+            self._f_idx = np.flatnonzero((f >= fwin[0]) & (f <= fwin[1]))
+        self.f = f[self._f_idx]
+        self._taper_spectrum = scipy.fft.rfft(self._taper, nfft)[self._f_idx]
+
+        # A matrix product is cheaper than the FFT for a few frequencies
+        n = self._taper.size
+        num_f = self._f_idx.size
+        self._dft = None
+        if 2 * num_f * n <= 5 * nfft * np.log2(nfft):
+            dft = self._taper[:, np.newaxis] * np.exp(
+                -2j * np.pi * np.outer(np.arange(n), self._f_idx) / nfft
+            )
+            # Interleave real and imaginary parts to view the result as complex
+            self._dft = np.empty((n, 2 * num_f))
+            self._dft[:, 0::2] = dft.real
+            self._dft[:, 1::2] = dft.imag
+
+    @classmethod
+    def from_neurochat(cls, nc_lfp, **kwargs):
+        """Set up from a NeuroChaT NLfp, scaled to uV like NLfp.plv."""
+        return cls(
+            nc_lfp.get_samples() * 1000,
+            nc_lfp.get_timestamp(),
+            nc_lfp.get_sampling_rate(),
+            **kwargs,
+        )
+
+    def window_starts(self, spike_times):
+        """
+        The first sample of the window around each spike.
+
+        Returns
+        -------
+        starts : np.ndarray
+            The index of the first sample of each window.
+        valid : np.ndarray
+            Whether each window is within the signal.
+
+        """
+        center = np.searchsorted(self.timestamps, spike_times)
+        starts = center + self.win[0]
+        valid = (starts >= 0) & (center + self.win[-1] < self.lfp.size)
+        return np.where(valid, starts, 0), valid
+
+    def sfc(self, spike_times):
+        """
+        Spike field coherence for each set of spike times.
+
+        Parameters
+        ----------
+        spike_times : np.ndarray
+            Spike times in seconds, the last axis holds the spikes of
+            one set and any leading axes are batched over.
+
+        Returns
+        -------
+        np.ndarray
+            The SFC in percent, with the spike axis replaced by frequency.
+
+        """
+        starts, valid = self.window_starts(spike_times)
+        segments = self._windows[starts][..., : self.nfft]
+        if self._dft is not None:
+            spectra = np.matmul(segments, self._dft).view(np.complex128)
+        else:
+            spectra = scipy.fft.rfft(
+                segments * self._taper, self.nfft, axis=-1, workers=self.workers
+            )
+            spectra = spectra[..., self._f_idx]
+        spectra[~valid] = 0
+        count = np.count_nonzero(valid, axis=-1)[..., np.newaxis]
+        sta_spectrum = spectra.sum(axis=-2)
+        if self.match_neurochat:
+            first = np.argmax(valid, axis=-1)[..., np.newaxis]
+            first_center = np.take_along_axis(starts, first, axis=-1) - self.win[0]
+            first_spectrum = np.take_along_axis(spectra, first[..., np.newaxis], -2)
+            sta_spectrum -= first_spectrum[..., 0, :]
+            sta_spectrum += first_center * self._taper_spectrum
+        f_sta = np.abs(sta_spectrum / count) ** 2
+        stp = np.sum(np.abs(spectra) ** 2, axis=-2) / count
+        return f_sta / stp * 100
+
+    def bootstrap_sfc(
+        self, spike_trains, nrep=20, nsample=50, rng=None, batch_size=10, picks=None
+    ):
+        """
+        Mean bootstrapped SFC of each spike train, as NLfp.plv(mode="bs").
+
+        Parameters
+        ----------
+        spike_trains : iterable of np.ndarray
+            The spike trains, for example shuffles of one spike train.
+        nrep : int, optional
+            The number of bootstrap samples per train, defaults to 20.
+        nsample : int, optional
+            The number of spikes per bootstrap sample, defaults to 50.
+        rng : np.random.Generator or int, optional
+            The random number generator or seed to draw the samples with.
+        batch_size : int, optional
+            The number of spike trains transformed together, which
+            bounds the memory used. Defaults to 10.
+        picks : list of np.ndarray, optional
+            The bootstrap_picks of each train, drawn with rng if None.
+
+        Returns
+        -------
+        np.ndarray
+            len(spike_trains) * len(f) mean SFC.
+
+        """
+        rng = np.random.default_rng(rng)
+        spike_trains = [np.asarray(train) for train in spike_trains]
+        if picks is None:
+            picks = [
+                bootstrap_picks(train.size, nrep, nsample, rng)
+                for train in spike_trains
+            ]
+        result = np.empty((len(spike_trains), self.f.size))
+        for start in range(0, len(spike_trains), batch_size):
+            stop = min(start + batch_size, len(spike_trains))
+            batch = np.array(
+                [spike_trains[i][picks[i]] for i in range(start, stop)]
+            )
+            result[start:stop] = self.sfc(batch).mean(axis=1)
+        return result
+
+
+class SpikePhase(object):
+    """
+    Spike to LFP phase locking of many (shuffled) spike trains.
+
+    This calculates the same statistics as NLfp.phase_dist from NeuroChaT.
+    The filtering, Hilbert transform and detection of the oscillation
+    segments only depend on the LFP, so they are done once and the
+    instantaneous phase and amplitude are kept as float32.
+    The phase of each spike is then interpolated from the stored phase,
+    and the phase histograms, mean phase and resultant vector length of
+    a batch of spike trains are calculated together.
+
+    Attributes
+    ----------
+    timestamps : np.ndarray
+        The time of each LFP sample in seconds.
+    phase : np.ndarray
+        The instantaneous phase of the band filtered LFP in degrees.
+    amplitude : np.ndarray
+        The instantaneous amplitude of the band filtered LFP.
+    fwin : tuple of float
+        The frequency band.
+    bins : np.ndarray
+        The start of each phase histogram bin in degrees.
+    segments : np.ndarray
+        The start and end time of each oscillation segment that spikes
+        are counted in, with shape (2, number of segments).
+
+    Parameters
+    ----------
+    lfp : np.ndarray
+        The LFP samples.
+    timestamps : np.ndarray
+        The time of each LFP sample in seconds.
+    sampling_rate : float
+        The sampling rate of the LFP.
+    fwin : tuple of float, optional
+        The frequency band, defaults to (6, 12).
+    binsize : float, optional
+        The phase histogram bin size in degrees, defaults to 5.
+    filtset : tuple, optional
+        The filter applied before checking the segment amplitude,
+        defaults to (10, 1.5, 40, "bandpass").
+    pratio : float, optional
+        The fraction of segment power that must be in the band,
+        defaults to 0.2.
+    aratio : float, optional
+        The fraction of the overall peak to peak amplitude that segments
+        must reach, defaults to 0.15.
+
+    """
+
+    def __init__(
+        self,
+        lfp,
+        timestamps,
+        sampling_rate,
+        fwin=(6, 12),
+        binsize=5,
+        filtset=(10, 1.5, 40, "bandpass"),
+        pratio=0.2,
+        aratio=0.15,
+    ):
+        lfp = np.asarray(lfp, dtype=np.float64)
+        self.timestamps = np.asarray(timestamps)
+        self.fwin = tuple(fwin)
+        num_bins = int(360 / binsize)
+        self.bins = np.arange(0, 360, 360 / num_bins)
+
+        fmin, fmax = fwin
+        b_lfp = butter_filter(lfp, sampling_rate, 5, fmin, fmax, "bandpass")
+        hilb = hilbert(b_lfp)
+        phase = np.angle(hilb, deg=True)
+        phase[phase < 0] += 360
+        mag = np.abs(hilb)
+        self.phase = phase.astype(np.float32)
+        self.amplitude = mag.astype(np.float32)
+
+        lfp = butter_filter(lfp, sampling_rate, *filtset)
+        self.segments = self._find_segments(
+            lfp, mag, sampling_rate, fmin, fmax, pratio, aratio
+        )
+
+    @classmethod
+    def from_neurochat(cls, nc_lfp, **kwargs):
+        """Set up from a NeuroChaT NLfp, scaled to uV like NLfp.phase_dist."""
+        return cls(
+            nc_lfp.get_samples() * 1000,
+            nc_lfp.get_timestamp(),
+            nc_lfp.get_sampling_rate(),
+            **kwargs,
+        )
+
+    def _find_segments(self, lfp, mag, fs, fmin, fmax, pratio, aratio):
+        """Segments between amplitude crossings that pass the power checks."""
+        time = self.timestamps
+        p2p = np.abs(np.max(lfp) - np.min(lfp))
+        xline = 0.5 * np.mean(mag)
+        mag1, mag2, mag3 = mag[0:-3], mag[1:-2], mag[2:-1]
+        xind = np.union1d(
+            np.flatnonzero((mag1 < xline) & (mag2 > xline)),
+            np.flatnonzero((mag1 < xline) & (mag2 == xline) & (mag3 > xline)),
+        )
+
+        starts, ends = [], []
+        i = 0
+        while i < len(xind) - 1:
+            k = i + 1
+            while time[xind[k]] - time[xind[i]] < 1 / fmin and k < len(xind) - 1:
+                k += 1
+            s_lfp = lfp[xind[i] : xind[k]]
+            if np.abs(np.max(s_lfp) - np.min(s_lfp)) >= aratio * p2p:
+                s_psd, f = fft_psd(s_lfp, fs)
+                band_power = np.sum(s_psd[(f >= fmin) & (f <= fmax)])
+                if band_power > pratio * np.sum(s_psd):
+                    starts.append(time[xind[i]])
+                    ends.append(time[xind[k]])
+            i = k
+        return np.array([starts, ends], dtype=np.float64).reshape(2, -1)
+
+    def spike_phases(self, spike_times):
+        """The LFP phase in degrees at each spike time."""
+        return np.interp(spike_times, self.timestamps, self.phase)
+
+    def in_segments(self, spike_times):
+        """Whether each spike time falls in an oscillation segment."""
+        starts, ends = self.segments
+        idx = np.searchsorted(ends, spike_times, side="left")
+        valid = idx < ends.size
+        idx[~valid] = 0
+        return valid & (spike_times > starts[idx])
+
+    def phase_counts(self, spike_times):
+        """
+        Histogram of the phase of the spikes in oscillation segments.
+
+        Parameters
+        ----------
+        spike_times : np.ndarray
+            Spike times in seconds, the last axis holds the spikes of
+            one train and any leading axes are batched over.
+
+        Returns
+        -------
+        np.ndarray
+            The spike count in each phase bin, with the spike axis
+            replaced by the bins.
+
+        """
+        spike_times = np.asarray(spike_times, dtype=np.float64)
+        num_bins = self.bins.size
+        phase_bin = np.floor(self.spike_phases(spike_times) * (num_bins / 360))
+        phase_bin = np.clip(phase_bin.astype(np.int64), 0, num_bins - 1)
+        lead_shape = spike_times.shape[:-1]
+        train = np.arange(int(np.prod(lead_shape))).reshape(lead_shape + (1,))
+        counts = np.bincount(
+            (train * num_bins + phase_bin).ravel(),
+            weights=self.in_segments(spike_times).ravel(),
+            minlength=train.size * num_bins,
+        )
+        return counts.reshape(lead_shape + (num_bins,))
+
+    def phase_stats(self, spike_times):
+        """
+        Mean phase and resultant vector length of each spike train.
+
+        Parameters
+        ----------
+        spike_times : np.ndarray
+            Spike times in seconds, as in phase_counts.
+
+        Returns
+        -------
+        dict
+            "counts", "mean_phase" in degrees, "mean_count"
+            and "resultant", each batched over the leading axes.
+
+        """
+        counts = self.phase_counts(spike_times)
+        theta = np.radians(self.bins)
+        xm = counts @ np.cos(theta)
+        ym = counts @ np.sin(theta)
+        mean_phase = np.degrees(np.arctan2(ym, xm))
+        mean_phase = np.where(mean_phase < 0, mean_phase + 360, mean_phase)
+        mean_count = np.sqrt(xm**2 + ym**2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            resultant = mean_count / counts.sum(axis=-1)
+        return {
+            "counts": counts,
+            "mean_phase": mean_phase,
+            "mean_count": mean_count,
+            "resultant": resultant,
+        }
+
+    def phase_dist(self, spike_train):
+        """
+        Phase distribution of one spike train, as NLfp.phase_dist.
+
+        Returns
+        -------
+        graph_data : dict
+            "phBins", "phCount" and "meanTheta" in radians, for plotting.
+        results : dict
+            "LFP Spike Mean Phase", "LFP Spike Mean Phase Count"
+            and "LFP Spike Phase Res Vect".
+
+        """
+        stats = self.phase_stats(spike_train)
+        graph_data = {
+            "phBins": self.bins,
+            "phCount": stats["counts"],
+            "meanTheta": np.radians(stats["mean_phase"]),
+        }
+        results = {
+            "LFP Spike Mean Phase": stats["mean_phase"],
+            "LFP Spike Mean Phase Count": stats["mean_count"],
+            "LFP Spike Phase Res Vect": stats["resultant"],
+        }
+        return graph_data, results
+
+    def shuffle_ci(self, spike_trains, percentile=95, batch_size=1000):
+        """
+        Percentile of the resultant vector length over shuffled spike trains.
+
+        Parameters
+        ----------
+        spike_trains : iterable of np.ndarray
+            The spike trains, for example shuffles of one spike train.
+        percentile : float, optional
+            The percentile to return, defaults to 95.
+        batch_size : int, optional
+            The number of spike trains processed together, which
+            bounds the memory used. Defaults to 1000.
+
+        Returns
+        -------
+        float
+            The percentile of the resultant vector lengths.
+
+        """
+        spike_trains = [np.asarray(train) for train in spike_trains]
+        resultants = []
+        for start in range(0, len(spike_trains), batch_size):
+            batch = spike_trains[start : start + batch_size]
+            if len({train.size for train in batch}) == 1:
+                resultants.append(self.phase_stats(np.array(batch))["resultant"])
+            else:
+                resultants.append(
+                    [self.phase_stats(train)["resultant"] for train in batch]
+                )
+        return np.nanpercentile(np.concatenate(resultants), percentile)
@@ -2,6 +2,10 @@ clean_kwargs = {
     "pick_property": "group",
     "channels": ["LFP"],
     "manual_ica": False,
+    # Fit the ICA on a decimated or cropped (in seconds) copy for speed
+    # "ica_decim": 4,
+    # "ica_start": 0.0,
+    # "ica_stop": 600.0,
     "base_dir": r"D:\SubRet_recordings_imaging",
 }
 
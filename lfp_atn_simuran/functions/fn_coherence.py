@@ -4,6 +4,10 @@ simuran_fn_params controls the functions that will be performed.
 These functions are performed on each recording in a loaded container.
 """
 
+# Regions to find the coherence of every pair of, in the "matrix" mode.
+# Leave empty for the coherence of the two regions of each recording.
+matrix_regions = []
+
 
 def setup_functions():
     """Establish the functions to run and arguments to pass."""
@@ -47,9 +51,12 @@ def setup_functions():
 
         """
         kwargs = {}
+        if matrix_regions:
+            kwargs["coherence_mode"] = "matrix"
+            kwargs["coherence_regions"] = matrix_regions
         args = [figures, recording_container.base_dir]
         arguments = {"plot_recording_coherence": (args, kwargs)}
-        
+
         return arguments
 
     return functions, argument_handler
@@ -88,6 +95,17 @@ def setup_output():
     # You can name each of these outputs
     output_names = ["Theta Coherence", "Delta Coherence", "Peak Theta coherence"]
 
+    # The summaries of each pair in the matrix mode, pairs as sorted regions
+    summaries = list(zip([key for _, _, key in save_list], output_names))
+    regions = sorted(matrix_regions)
+    for i, r1 in enumerate(regions):
+        for r2 in regions[i + 1 :]:
+            for key, name in summaries:
+                save_list.append(
+                    ("results", "plot_recording_coherence", f"{r1}-{r2} {key}")
+                )
+                output_names.append(f"{r1}-{r2} {name}")
+
     return save_list, output_names
 
 
@@ -123,7 +141,8 @@ def setup_sorting():
 def setup_loading():
     """Establish how recordings are loaded."""
     # Indicates if all information on a recording is loaded in bulk, or as needed
-    load_all = True
+    # The analysis loads what it needs through the decoded cache
+    load_all = False
 
     # If load_all is True, indicates what is loaded in bulk
     # Should be a subset of ["signals", "spatial", "units"]
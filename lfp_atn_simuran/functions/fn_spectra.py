@@ -148,7 +148,8 @@ def setup_sorting():
 def setup_loading():
     """Establish how recordings are loaded."""
     # Indicates if all information on a recording is loaded in bulk, or as needed
-    load_all = True
+    # The analysis loads what it needs through the decoded cache
+    load_all = False
 
     # If load_all is True, indicates what is loaded in bulk
     # Should be a subset of ["signals", "spatial", "units"]
@@ -1,19 +1,286 @@
+"""Index the Axona recordings below a directory, with what each one is of."""
+
+import datetime
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-import simuran
+import pandas as pd
 import typer
-from simuran.loaders.nc_loader import NCLoader
 
+from lib.data_lfp import read_set_file
+from lib.utils import decode_recordings
+
+# The columns and types of the index, so every run writes the same schema
+INDEX_SCHEMA = {
+    "directory": "string",
+    "filename": "string",
+    "mtime": "int64",
+    "size": "int64",
+    "duration": "float64",
+    "rat": "string",
+    "n_channels": "int64",
+    "sleep": "int64",
+    "maze": "string",
+    "habituation": "int64",
+    "treatment": "string",
+    "light": "float64",
+    "date_time": "datetime64[ns]",
+    "mapping": "string",
+}
+
+# Columns read from the .set headers, reused while a file is unchanged
+_HEADER_COLUMNS = ["duration", "date", "time"]
+
+# The raw headers of every .set file, including those left out of the index
+HEADER_SCHEMA = {
+    "directory": "string",
+    "filename": "string",
+    "mtime": "int64",
+    "size": "int64",
+    "duration": "string",
+    "date": "string",
+    "time": "string",
+}
+
+_ANIMAL_MAPPINGS = {
+    "CSubRet1": "CL-SR_1-3.py",
+    "CSubRet2": "CL-SR_1-3.py",
+    "CSubRet3": "CL-SR_1-3.py",
+    "CSubRet4": "CL-SR_4-6.py",
+    "CSubRet5": "CL-SR_4-6.py",
+    "CSR6": "CL-SR_4-6.py",
+}
+
+
+def main(
+    path_to_files: str,
+    output_path: str,
+    overwrite: bool = False,
+    num_workers: int = 8,
+) -> None:
+    """
+    Index the .set files below path_to_files into output_path.
+
+    A typed parquet copy of the index is kept next to output_path,
+    with the headers of every .set file in a _headers.parquet.
+    Files with the same size and modification time as in those headers
+    are not opened again, unless overwrite is passed.
+
+    """
+    parquet_path = os.path.splitext(output_path)[0] + ".parquet"
+    headers_path = os.path.splitext(output_path)[0] + "_headers.parquet"
+    previous = None
+    if not overwrite:
+        previous = read_index(headers_path)
+        if previous is None:
+            previous = read_index(parquet_path)
+    headers = read_headers(scan_set_files(path_to_files), previous, num_workers)
+    df = clean_data(headers)
+    print("Indexed {} recordings".format(len(df)))
+
+    out_dir = os.path.dirname(output_path)
+    if out_dir != "":
+        os.makedirs(out_dir, exist_ok=True)
+    if output_path != parquet_path:
+        df.to_csv(output_path, index=False)
+    write_index(df, parquet_path)
+    write_index(headers, headers_path)
+
+
+def scan_set_files(start_dir):
+    """
+    Find every .set file below start_dir with os.scandir.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The directory (with / separators), filename, mtime (ns) and
+        size of each .set file, sorted by directory and filename.
+
+    """
+    rows = []
+    to_scan = [start_dir]
+    while len(to_scan) > 0:
+        directory = to_scan.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                to_scan.append(entry.path)
+            elif entry.name.endswith(".set") and entry.is_file():
+                stat = entry.stat()
+                rows.append(
+                    (
+                        os.path.normpath(directory).replace("\\", "/"),
+                        entry.name,
+                        stat.st_mtime_ns,
+                        stat.st_size,
+                    )
+                )
+    df = pd.DataFrame(rows, columns=["directory", "filename", "mtime", "size"])
+    return df.sort_values(["directory", "filename"], ignore_index=True)
+
+
+def read_set_header(set_file):
+    """
+    The trial date, time and duration in the header of an Axona .set file.
+
+    The header is parsed by lib.data_lfp.read_set_file, so a file
+    already read by the lfp loaders is not read again.
+
+    Returns
+    -------
+    tuple
+        (duration, date, time) as int, str and str,
+        None for any that are missing.
+
+    """
+    try:
+        set_header = read_set_file(set_file)
+    except OSError:
+        return None, None, None
+    return set_header["duration"], set_header["date"], set_header["time"]
+
+
+def index_axona_files(start_dir, previous=None, num_workers=8):
+    """
+    Index the .set files below start_dir.
+
+    Parameters
+    ----------
+    start_dir : str
+        The directory to search.
+    previous : pandas.DataFrame, optional
+        Earlier headers from read_headers, or an earlier index.
+        The headers of files with an unchanged mtime and size
+        are taken from here instead of being read.
+    num_workers : int, optional
+        The number of threads reading new .set headers, defaults to 8.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The cleaned index, with the columns of INDEX_SCHEMA.
+
+    """
+    return index_set_files(scan_set_files(start_dir), previous, num_workers)
+
+
+def index_set_files(df, previous=None, num_workers=8):
+    """
+    Index already found .set files, see index_axona_files.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The directory, filename, mtime and size of each .set file,
+        as from scan_set_files.
+    previous : pandas.DataFrame, optional
+        Earlier headers or an earlier index, see read_headers.
+    num_workers : int, optional
+        The number of threads reading new .set headers, defaults to 8.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The cleaned index, with the columns of INDEX_SCHEMA.
 
-def main(path_to_files: str, output_path: str) -> None:
-    simuran.index_ephys_files(
-        start_dir=path_to_files,
-        loader=NCLoader(system="Axona", loader_kwargs={"pos_extension": ".pos"}),
-        output_path=output_path,
-        overwrite=True,
-        post_process_fn=clean_data,
+    """
+    return clean_data(read_headers(df, previous, num_workers))
+
+
+def _previous_headers(previous):
+    """The header columns of earlier headers or of an earlier index."""
+    keys = ["directory", "filename", "mtime", "size"]
+    if "date_time" not in previous.columns:
+        return previous[list(HEADER_SCHEMA)].astype(HEADER_SCHEMA)
+    # An index only has the files that were kept, with parsed values
+    old = previous.loc[
+        previous["duration"].notna() & previous["date_time"].notna(),
+        keys + ["duration", "date_time"],
+    ]
+    date_time = pd.to_datetime(old["date_time"])
+    old = old.assign(
+        duration=old["duration"].astype("int64").astype(str),
+        date=date_time.dt.strftime("%d %b %Y"),
+        time=date_time.dt.strftime("%H:%M:%S"),
     )
+    return old[list(HEADER_SCHEMA)].astype(HEADER_SCHEMA)
+
+
+def read_headers(df, previous=None, num_workers=8):
+    """
+    The trial date, time and duration of each .set file in df.
+
+    Every file is kept, including config files and setup folders that
+    clean_data leaves out of the index, so that unchanged files are
+    never read again when these headers are passed as previous.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The directory, filename, mtime and size of each .set file,
+        as from scan_set_files.
+    previous : pandas.DataFrame, optional
+        Earlier headers from read_headers, or an earlier index.
+        The headers of files with an unchanged mtime and size
+        are taken from here instead of being read.
+    num_workers : int, optional
+        The number of threads reading new .set headers, defaults to 8.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The headers, with the columns of HEADER_SCHEMA.
+
+    """
+    keys = ["directory", "filename", "mtime", "size"]
+    df = df[keys].astype({key: HEADER_SCHEMA[key] for key in keys})
+    if previous is not None and len(previous) > 0:
+        old = _previous_headers(previous).drop_duplicates(keys)
+        df = df.merge(old, on=keys, how="left", indicator=True)
+        known = (df.pop("_merge") == "both").to_numpy()
+    else:
+        df = df.assign(**{column: None for column in _HEADER_COLUMNS})
+        known = np.zeros(len(df), dtype=bool)
+    df = df.astype(HEADER_SCHEMA)
+
+    to_read = df.index[~known]
+    print("Reading {} new or changed .set files of {}".format(len(to_read), len(df)))
+    paths = (df.loc[to_read, "directory"] + "/" + df.loc[to_read, "filename"]).tolist()
+    with ThreadPoolExecutor(num_workers) as executor:
+        headers = list(executor.map(read_set_header, paths))
+    if len(headers) > 0:
+        read = pd.DataFrame(
+            headers, index=to_read, columns=_HEADER_COLUMNS, dtype=object
+        )
+        read["duration"] = read["duration"].map(lambda d: None if d is None else str(d))
+        df.loc[to_read, _HEADER_COLUMNS] = read.astype("string")
+
+    return df
+
+
+def read_index(index_path):
+    """Read an index written by write_index, or None if there is not one."""
+    if not os.path.exists(index_path):
+        return None
+    try:
+        return pd.read_parquet(index_path)
+    except ImportError:
+        print("WARNING: Install pyarrow to reuse {}".format(index_path))
+        return None
+
+
+def write_index(df, index_path):
+    """Write the index to parquet, if a parquet engine is installed."""
+    try:
+        df.to_parquet(index_path, index=False)
+    except ImportError:
+        print("WARNING: Install pyarrow to write {}".format(index_path))
 
 
 def get_rat_name(s):
@@ -312,12 +579,10 @@ def clean_setup_files(s):
 def get_date_from_files(fold, file):
     """Get date from the set file"""
     try:
-        with open(fold + "/" + file + ".set") as f:
-            date = f.readline()[-12:].strip()
-            return date
-
-    except:
+        date = read_set_file(fold + "/" + file + ".set")["date"]
+    except OSError:
         return np.nan
+    return np.nan if date is None else date
 
 
 def get_missing_dates(s):
@@ -358,71 +623,29 @@ def animal_to_mapping(s):
 
 def clean_data(df, **kwargs):
     """
-    Sequency of cleaning dataframe
+    Decode what each recording is of from its file and folder names.
 
-    Parameters:
-    df (pandas dataframe): Dataframe with all data
-    Returns:
-    dataframe: Cleaned dataframe
+    The decoding is shared with lib.utils.clean_data, see
+    lib.utils.decode_recordings.
 
-    """
-    df["recording_name"] = df.filename.apply(lambda x: x[:-4])
-    # Rat name
-    df["rat"] = df.recording_name.apply(get_rat_name)
-    df["name_folder"] = df.directory.apply(get_rat_name_folder)
-    df["rat"] = df["rat"].combine_first(df["name_folder"])
-    df.drop("name_folder", axis=1, inplace=True)
-    # number of channels
-    df["n_channels"] = df.filename.apply(n_channels)
-    # sleep experiment
-    df["sleep"] = df.filename.apply(get_sleep_awake)
-    df["sleep_folder"] = df.filename.apply(get_sleep_awake_folder)
-    df["sleep"] = df["sleep"].combine_first(df["sleep_folder"])
-    df.drop("sleep_folder", axis=1, inplace=True)
-    # get mazes
-    df["maze"] = df.filename.apply(get_maze)
-    df["maze_folder"] = df.directory.apply(get_maze_from_folder)
-    df["maze"] = df["maze"].combine_first(df["maze_folder"])
-    df.drop("maze_folder", axis=1, inplace=True)
-    # get habituation
-    df["habituation"] = df.filename.apply(get_habituation)
-    df["habituation_folder"] = df.filename.apply(get_habituation_folder)
-    df["habituation"] = df["habituation"].combine_first(df["habituation_folder"])
-    df.drop("habituation_folder", axis=1, inplace=True)
-    # Get treatment
-    df["treatment"] = df.filename.apply(get_treatment)
-    df["treatment_folder"] = df.filename.apply(get_treatment_folder)
-    df["treatment"] = df["treatment"].combine_first(df["treatment_folder"])
-    df.drop("treatment_folder", axis=1, inplace=True)
-    # Get duration
-    df["duration"] = df.duration.apply(clean_config_files)
-    df.dropna(subset=["duration"], inplace=True)
-    # light or dark
-    df["light"] = df.filename.apply(get_light_dark)
-    df["light"] = df["light"].fillna(11)
-    # Cleaning
-    df["directory"] = df.directory.apply(clean_setup_files)
-    df.dropna(subset=["directory"], inplace=True)
-    # Combine datetime
-    # Dates from file
-    fold_file = df[["directory", "recording_name"]].values
-    df["date"] = [get_date_from_files(fold, file) for fold, file in fold_file]
-    df.loc[df.date.isnull(), "date"] = df.loc[df.date.isnull(), "recording_name"].apply(
-        get_missing_dates
-    )
-    df["date_time"] = df["date"] + " " + df["time"]
-    df["date_time"] = df["date_time"].apply(convert_datetime)
-    df.drop(["date", "time"], inplace=True, axis=1)
-    df["name_dec"] = df.rat.apply(decode_name)
-    df.drop("recording_name", axis=1, inplace=True)
-    df.loc[df.treatment.isnull(), "treatment"] = df.loc[
-        df.treatment.isnull()
-    ].name_dec.apply(update_maze)
-    df.drop("name_dec", axis=1, inplace=True)
-
-    df["mapping"] = df.rat.apply(animal_to_mapping)
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The directory, filename, duration, date and time of each .set file.
+        date can be missing, in which case it is taken from the filename.
 
-    return df
+    Returns
+    -------
+    pandas.DataFrame
+        Cleaned dataframe, with the columns of INDEX_SCHEMA.
+
+    """
+    df = decode_recordings(df, "directory")
+    df["mapping"] = df["rat"].map(_ANIMAL_MAPPINGS).fillna("NOT_EXIST")
+    for column in INDEX_SCHEMA:
+        if column not in df.columns:
+            df[column] = None
+    return df[list(INDEX_SCHEMA)].astype(INDEX_SCHEMA).reset_index(drop=True)
 
 
 if __name__ == "__main__":
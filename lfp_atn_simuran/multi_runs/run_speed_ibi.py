@@ -33,7 +33,8 @@ fn_args = [out_dir, dirname]
 
 # Keyword arguments to pass into fn_to_run
 # By default these are added to the config file chosen
-fn_kwargs = {}
+# Set plot_cells to True to save the speed figures of each cell
+fn_kwargs = {"plot_cells": False}
 
 # Headers for the output
 headers = recording_ibi_headings()
@@ -0,0 +1,352 @@
+"""A queryable catalogue of the indexed Axona recordings, updated by folder."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import typer
+
+from lfp_atn_simuran.index_axona_files import (
+    HEADER_SCHEMA,
+    INDEX_SCHEMA,
+    clean_data,
+    read_headers,
+)
+
+here = os.path.dirname(os.path.abspath(__file__))
+mapping_dir = os.path.join(here, "recording_mappings")
+
+# The index columns, with the repeated names stored as categories
+CATALOGUE_SCHEMA = dict(
+    INDEX_SCHEMA,
+    rat="category",
+    maze="category",
+    treatment="category",
+    mapping="category",
+)
+
+_FOLDER_SCHEMA = {"directory": "string", "mtime": "int64"}
+
+
+def main(
+    path_to_files: str,
+    catalogue_path: str,
+    num_workers: int = 8,
+) -> None:
+    """
+    Create or update the session catalogue in catalogue_path.
+
+    Only folders with a new modification time are scanned again.
+
+    """
+    catalogue = SessionCatalogue.load(catalogue_path)
+    changed = catalogue.update(path_to_files, num_workers)
+    print(
+        "Scanned {} new or changed folders, {} recordings in the catalogue".format(
+            len(changed), len(catalogue)
+        )
+    )
+    catalogue.save(catalogue_path)
+
+
+def scan_folders(start_dir):
+    """
+    Find every folder below start_dir and the .set files directly in it.
+
+    Returns
+    -------
+    dict
+        The folder (with / separators) to its mtime (ns) and the list of
+        os.DirEntry of the .set files in it. The mtime is read before the
+        folder is listed, so a file added meanwhile marks it as changed.
+
+    """
+    folders = {}
+    to_scan = [start_dir]
+    while len(to_scan) > 0:
+        directory = to_scan.pop()
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        set_files = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                to_scan.append(entry.path)
+            elif entry.name.endswith(".set") and entry.is_file():
+                set_files.append(entry)
+        folders[os.path.normpath(directory).replace("\\", "/")] = (mtime, set_files)
+    return folders
+
+
+class SessionCatalogue(object):
+    """
+    The indexed recordings below a directory, with group indexes to query.
+
+    The recordings are stored as parquet with categorical rat, maze,
+    treatment and mapping columns. The rows of each rat, maze, treatment,
+    sleep and date are found once, when the catalogue is created, so
+    queries on those columns intersect row positions instead of
+    comparing every row. Updates only scan the folders that have a new
+    modification time since the last update.
+
+    Attributes
+    ----------
+    sessions : pandas.DataFrame
+        One row per recording, with the columns of CATALOGUE_SCHEMA.
+    folders : pandas.DataFrame
+        The directory and mtime of each folder at the last update.
+    headers : pandas.DataFrame
+        The header of every .set file, including those left out of
+        sessions, so unchanged files are not read again.
+    groups : dict
+        Each of GROUP_COLUMNS to a dict of value to the sorted
+        row positions of sessions with that value.
+
+    Parameters
+    ----------
+    sessions : pandas.DataFrame, optional
+        An index from index_axona_files, empty by default.
+    folders : pandas.DataFrame, optional
+        The folder mtimes, empty by default, so the first
+        update scans every folder.
+    headers : pandas.DataFrame, optional
+        The .set file headers from read_headers, empty by default.
+
+    """
+
+    GROUP_COLUMNS = ["rat", "maze", "treatment", "sleep", "date"]
+
+    def __init__(self, sessions=None, folders=None, headers=None):
+        """See help(SessionCatalogue)."""
+        if sessions is None:
+            sessions = pd.DataFrame(columns=list(CATALOGUE_SCHEMA))
+        if folders is None:
+            folders = pd.DataFrame(columns=list(_FOLDER_SCHEMA))
+        if headers is None:
+            headers = pd.DataFrame(columns=list(HEADER_SCHEMA))
+        self.folders = folders.astype(_FOLDER_SCHEMA).reset_index(drop=True)
+        self.headers = headers.astype(HEADER_SCHEMA).reset_index(drop=True)
+        self._set_sessions(sessions)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _set_sessions(self, sessions):
+        """Store the sessions sorted by file and build the group indexes."""
+        sessions = sessions[list(INDEX_SCHEMA)].astype(INDEX_SCHEMA)
+        sessions = sessions.astype(CATALOGUE_SCHEMA)
+        self.sessions = sessions.sort_values(
+            ["directory", "filename"], ignore_index=True
+        )
+        keys = {
+            column: self.sessions[column]
+            for column in self.GROUP_COLUMNS
+            if column != "date"
+        }
+        keys["date"] = self.sessions["date_time"].dt.normalize()
+        self.groups = {
+            column: key.groupby(key, observed=True, sort=False).indices
+            for column, key in keys.items()
+        }
+
+    @classmethod
+    def load(cls, catalogue_path):
+        """The catalogue saved in catalogue_path, or an empty one."""
+        sessions_path = os.path.join(catalogue_path, "sessions.parquet")
+        folders_path = os.path.join(catalogue_path, "folders.parquet")
+        headers_path = os.path.join(catalogue_path, "headers.parquet")
+        if not os.path.exists(sessions_path):
+            return cls()
+        try:
+            headers = None
+            if os.path.exists(headers_path):
+                headers = pd.read_parquet(headers_path)
+            return cls(
+                pd.read_parquet(sessions_path), pd.read_parquet(folders_path), headers
+            )
+        except ImportError:
+            print("WARNING: Install pyarrow to reuse {}".format(catalogue_path))
+            return cls()
+
+    def save(self, catalogue_path):
+        """Write the catalogue to the folder catalogue_path as parquet."""
+        os.makedirs(catalogue_path, exist_ok=True)
+        tables = (
+            ("sessions", self.sessions),
+            ("folders", self.folders),
+            ("headers", self.headers),
+        )
+        for name, df in tables:
+            out_path = os.path.join(catalogue_path, name + ".parquet")
+            tmp_path = out_path + ".tmp"
+            try:
+                df.to_parquet(tmp_path, index=False)
+            except ImportError:
+                print("WARNING: Install pyarrow to write {}".format(catalogue_path))
+                return
+            os.replace(tmp_path, out_path)
+
+    def update(self, start_dir, num_workers=8):
+        """
+        Index the folders below start_dir that changed since the last update.
+
+        Folders that are no longer below start_dir are removed, along
+        with their recordings. Within a changed folder, the headers of
+        unchanged .set files are still taken from the catalogue.
+
+        Parameters
+        ----------
+        start_dir : str
+            The directory to catalogue.
+        num_workers : int, optional
+            The number of threads reading new .set headers, defaults to 8.
+
+        Returns
+        -------
+        list of str
+            The new or changed folders.
+
+        """
+        folders = scan_folders(start_dir)
+        old_mtimes = dict(zip(self.folders["directory"], self.folders["mtime"]))
+        changed = [
+            directory
+            for directory, (mtime, _) in folders.items()
+            if old_mtimes.get(directory, None) != mtime
+        ]
+
+        rows = []
+        for directory in changed:
+            for entry in folders[directory][1]:
+                stat = entry.stat()
+                rows.append((directory, entry.name, stat.st_mtime_ns, stat.st_size))
+        scanned = pd.DataFrame(rows, columns=["directory", "filename", "mtime", "size"])
+        # Catalogues saved without headers reuse the headers of the sessions
+        previous = self.headers if len(self.headers) > 0 else self.sessions
+        headers = read_headers(scanned, previous, num_workers)
+        new = clean_data(headers)
+
+        unchanged = set(folders.keys()).difference(changed)
+        kept = self.sessions.loc[self.sessions["directory"].isin(unchanged)]
+        kept_headers = self.headers.loc[self.headers["directory"].isin(unchanged)]
+        self.headers = pd.concat([kept_headers, headers], ignore_index=True)
+        self.folders = pd.DataFrame(
+            [(directory, mtime) for directory, (mtime, _) in folders.items()],
+            columns=list(_FOLDER_SCHEMA),
+        ).astype(_FOLDER_SCHEMA)
+        self._set_sessions(
+            pd.concat([kept.astype(INDEX_SCHEMA), new], ignore_index=True)
+        )
+        return changed
+
+    def select(self, **filters):
+        """
+        The row positions of the sessions matching every filter.
+
+        Parameters
+        ----------
+        **filters
+            Column name to a value or list of values to keep.
+            GROUP_COLUMNS use the group indexes, dates can be given
+            as any string or date pandas.Timestamp accepts.
+            Other columns are compared row by row.
+
+        Returns
+        -------
+        np.ndarray
+            The sorted row positions.
+
+        Raises
+        ------
+        ValueError
+            If a filter is not a column of the catalogue.
+
+        """
+        positions = None
+        mask = np.ones(len(self.sessions), dtype=bool)
+        for column, values in filters.items():
+            if isinstance(values, str) or not np.iterable(values):
+                values = [values]
+            if column in self.groups:
+                if column == "date":
+                    values = [pd.Timestamp(value).normalize() for value in values]
+                index = self.groups[column]
+                found = [index[value] for value in values if value in index]
+                rows = np.unique(np.concatenate(found)) if found else np.array([])
+                rows = rows.astype(np.int64)
+                positions = (
+                    rows
+                    if positions is None
+                    else np.intersect1d(positions, rows, assume_unique=True)
+                )
+            elif column in self.sessions.columns:
+                mask &= self.sessions[column].isin(values).to_numpy()
+            else:
+                raise ValueError("Can't filter the catalogue on {}".format(column))
+        if positions is None:
+            positions = np.arange(len(self.sessions))
+        return positions[mask[positions]]
+
+    def query(self, **filters):
+        """The sessions matching every filter, see select."""
+        return self.sessions.iloc[self.select(**filters)]
+
+    def paths(self, **filters):
+        """The .set file path of the sessions matching every filter."""
+        df = self.query(**filters)
+        return (df["directory"] + "/" + df["filename"]).tolist()
+
+    def mappings(self, **filters):
+        """The .set file path to mapping file name of the matching sessions."""
+        df = self.query(**filters)
+        return dict(
+            zip(df["directory"] + "/" + df["filename"], df["mapping"].astype(str))
+        )
+
+    def to_container(self, param_dir=None, base_dir=None, **filters):
+        """
+        A simuran recording container of the sessions matching every filter.
+
+        The recordings are made from the catalogue and their mapping,
+        so the drive is not searched again.
+        Sessions without a mapping (NOT_EXIST) are left out.
+
+        Parameters
+        ----------
+        param_dir : str, optional
+            The folder of the mapping files, recording_mappings by default.
+        base_dir : str, optional
+            The base_dir of the container.
+        **filters
+            See select.
+
+        Returns
+        -------
+        simuran.RecordingContainer
+            The recordings, not yet loaded.
+
+        """
+        import simuran
+
+        if param_dir is None:
+            param_dir = mapping_dir
+        container = simuran.RecordingContainer()
+        if base_dir is not None:
+            container.base_dir = base_dir
+        for path, mapping in self.mappings(**filters).items():
+            if mapping == "NOT_EXIST":
+                print("WARNING: No mapping for {}".format(path))
+                continue
+            recording = simuran.Recording(
+                param_file=os.path.join(param_dir, mapping),
+                base_file=path,
+                load=False,
+            )
+            container.append(recording)
+        return container
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,23 +1,26 @@
 import os
 from math import floor, ceil
 from pprint import pprint
-import csv
 import argparse
+import hashlib
+import json
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import simuran
 import pandas as pd
 import matplotlib.pyplot as plt
 import astropy.units as u
-from neurochat.nc_lfp import NLfp
 import numpy as np
 from scipy.signal import coherence
-from skm_pyutils.py_table import list_to_df, df_from_file, df_to_file
+from skm_pyutils.py_table import df_from_file, df_to_file
 from skm_pyutils.py_config import parse_args
 import seaborn as sns
-from scipy.signal import welch
 
 try:
     from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+    from lfp_atn_simuran.Scripts.decoded_cache import load_spatial
+    from lfp_atn_simuran.Scripts.epoch_spectra import EpochSpectra
 
     do_analysis = True
 except ImportError:
@@ -25,6 +28,9 @@ except ImportError:
 
 from neuronal.decoding import LFPDecoder
 
+# Bump when the results of a session change to invalidate old session shards
+SHARD_VERSION = 1
+
 
 def decoding(lfp_array, groups, labels, base_dir):
 
@@ -61,6 +67,406 @@ def decoding(lfp_array, groups, labels, base_dir):
         decoder.visualise_features(output_folder=base_dir, name=f"_{group}")
 
 
+def final_trial_type(r, trial_type):
+    """Forced, or whether the choice trial was Correct or Incorrect."""
+    if trial_type == "forced":
+        return "Forced"
+    if r.passed.strip().upper() == "Y":
+        return "Correct"
+    elif r.passed.strip().upper() == "N":
+        return "Incorrect"
+    return "ERROR IN ANALYSIS"
+
+
+def t_maze_epoch_results(
+    sig_dict, trials, group, window_sec, frange, delta, theta, full_coherence
+):
+    """
+    Power and SUB-RSC coherence of every part of every trial in a session.
+
+    All the parts are analysed together by EpochSpectra, without units.
+
+    Parameters
+    ----------
+    sig_dict : dict
+        Region to cleaned simuran signal, with "SUB" and "RSC".
+    trials : list of tuple
+        (row, trial type, dict of part to (start, end) LFP sample) per trial.
+    group : str
+        The group of the animal.
+    window_sec : float
+        The Welch segment length in seconds.
+    frange, delta, theta : tuple of float
+        The frequencies to keep, and the delta and theta bands.
+    full_coherence : tuple of float
+        The theta and delta coherence over the whole recording.
+
+    Returns
+    -------
+    res_df : pd.DataFrame
+        The powers and coherence summaries, one row per part of each trial.
+    coherence_df : pd.DataFrame
+        The coherence at each frequency of each part.
+    power_df : pd.DataFrame
+        The SUB power relative to its maximum, in dB, for each part.
+    (f, Cxy) : tuple of np.ndarray
+        The frequencies and parts * frequencies coherence.
+
+    """
+    parts = []
+    for r, trial_type, lfp_portions in trials:
+        for k, (start, end) in lfp_portions.items():
+            parts.append((r, final_trial_type(r, trial_type), k, start, end))
+    starts = [p[3] for p in parts]
+    stops = [p[4] for p in parts]
+    epochs = EpochSpectra.from_signals(sig_dict, starts, stops, unit="mV")
+    nperseg = int(window_sec * epochs.sampling_rate)
+
+    powers = epochs.relative_power([delta, theta], nperseg)
+    sub, rsc = epochs.regions.index("SUB"), epochs.regions.index("RSC")
+
+    f, Cxy = epochs.coherence("SUB", "RSC", nperseg, nfft=256)
+    in_range = np.nonzero((f >= frange[0]) & (f <= frange[1]))[0]
+    f, Cxy = f[in_range], Cxy[:, in_range]
+    theta_co = Cxy[:, np.nonzero((f >= theta[0]) & (f <= theta[1]))[0]]
+    delta_co = Cxy[:, np.nonzero((f >= delta[0]) & (f <= delta[1]))[0]]
+    theta_co_peak = Cxy[:, np.nonzero((f >= 11.0) & (f <= 13.0))[0]]
+
+    info = {
+        "location": [p[0].location for p in parts],
+        "session": [p[0].session for p in parts],
+        "animal": [p[0].animal for p in parts],
+        "test": [p[0].test for p in parts],
+        "choice": [p[0].passed.strip() for p in parts],
+        "part": [p[2] for p in parts],
+        "trial": [p[1] for p in parts],
+    }
+    res_df = pd.DataFrame(info)
+    res_df["SUB_delta"] = powers[sub, :, 0]
+    res_df["SUB_theta"] = powers[sub, :, 1]
+    res_df["RSC_delta"] = powers[rsc, :, 0]
+    res_df["RSC_theta"] = powers[rsc, :, 1]
+    res_df["Theta_coherence"] = np.nanmean(theta_co, axis=1)
+    res_df["Delta_coherence"] = np.nanmean(delta_co, axis=1)
+    res_df["Full_theta_coherence"] = full_coherence[0]
+    res_df["Full_delta_coherence"] = full_coherence[1]
+    res_df["Peak 12Hz Theta coherence"] = np.nanmax(theta_co_peak, axis=1)
+    res_df["Group"] = group
+
+    # One row per frequency of each part
+    n_f = f.size
+    coherence_df = pd.DataFrame(
+        {
+            "Frequency (Hz)": np.tile(f, len(parts)),
+            "Coherence": Cxy.ravel(),
+            "Passed": np.repeat(info["choice"], n_f),
+            "Group": group,
+            "Test": np.repeat(info["test"], n_f),
+            "Session": np.repeat(info["session"], n_f),
+            "Part": np.repeat(info["part"], n_f),
+            "Trial": np.repeat(info["trial"], n_f),
+        }
+    )
+
+    # Convert to full scale relative dB (so max at 0)
+    f_welch, Pxx = epochs.psd(nperseg)
+    in_range = np.nonzero((f_welch >= frange[0]) & (f_welch <= frange[1]))[0]
+    f_welch, Pxx = f_welch[in_range], Pxx[sub][:, in_range]
+    Pxx = 10 * np.log10(Pxx / np.max(Pxx, axis=1, keepdims=True))
+    n_f = f_welch.size
+    power_df = pd.DataFrame(
+        {
+            "Frequency (Hz)": np.tile(f_welch, len(parts)),
+            "Power (dB)": Pxx.ravel(),
+            "Passed": np.repeat(info["choice"], n_f),
+            "Group": group,
+            "Part": np.repeat(info["part"], n_f),
+            "Trial": np.repeat(info["trial"], n_f),
+        }
+    )
+
+    return res_df, coherence_df, power_df, (f, Cxy)
+
+
+def session_key(row1, row2, params):
+    """
+    Hash of the two rows of a t-maze session and the analysis params.
+
+    The row index is left out, so rows added above a session keep its key.
+
+    """
+    h = hashlib.blake2b(digest_size=16)
+    content = [SHARD_VERSION, list(row1)[1:], list(row2)[1:], params]
+    h.update(json.dumps(content, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_shard(shard_file):
+    """The saved results of a session, or None if it has not been analysed."""
+    try:
+        return pd.read_pickle(shard_file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def save_shard(shard, shard_file):
+    """Save the results of a session, replacing any old file atomically."""
+    tmp_file = "{}.{}.tmp".format(shard_file, os.getpid())
+    pd.to_pickle(shard, tmp_file)
+    os.replace(tmp_file, shard_file)
+
+
+def analyse_session(
+    j,
+    row1,
+    row2,
+    base_dir,
+    params,
+    plot_individual_sessions=False,
+    do_coherence=True,
+    num_sessions=None,
+    plot_dir="",
+):
+    """
+    Analyse the forced and choice trial of one t-maze session.
+
+    Parameters
+    ----------
+    j : int
+        The index of the session.
+    row1, row2 : namedtuple
+        The rows of the forced and choice trial from the t-maze times.
+    base_dir : str
+        The base directory of the data.
+    params : dict
+        The analysis params from main, which make up the session_key.
+    plot_individual_sessions : bool, optional
+        Whether to plot the session into plot_dir, defaults to False.
+    do_coherence : bool, optional
+        Whether to analyse power and coherence, defaults to True.
+    num_sessions : int, optional
+        The number of sessions, for printing progress.
+    plot_dir : str, optional
+        Where to save the plots of the session.
+
+    Returns
+    -------
+    dict or None
+        The "results", "coherence" and "power" DataFrames, the "group"
+        and "choice" of the session and the theta coherence at the choice
+        point of each trial as "choice_theta". None if not do_coherence.
+
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    delta_min, delta_max = params["delta"]
+    theta_min, theta_max = params["theta"]
+    fmin, fmax = params["frange"]
+    window_sec = params["window_sec"]
+    clean_method = params["clean_method"]
+    clean_kwargs = params["clean_kwargs"]
+    max_lfp_lengths_seconds = params["max_lfp_lengths_seconds"]
+
+    # Load the t-maze data
+    recording_location = os.path.join(base_dir, row1.location)
+    recording_location = recording_location.replace("--", os.sep)
+    param_file = os.path.join(here, "..", "recording_mappings", row1.mapping)
+    recording = simuran.Recording(
+        param_file=param_file, base_file=recording_location, load=False
+    )
+    lfp_clean = LFPClean(method=clean_method, visualise=False)
+    sig_dict = lfp_clean.clean(
+        recording, min_f=fmin, max_f=fmax, method_kwargs=clean_kwargs
+    )["signals"]
+    x = np.array(sig_dict["SUB"].samples.to(u.mV))
+    duration = len(x) / 250
+    y = np.array(sig_dict["RSC"].samples.to(u.mV))
+
+    fs = sig_dict["SUB"].sampling_rate
+
+    # Setup and loading done -- Analyse the t-maze data
+    if do_coherence:
+        # Coherence over the whole recording
+        f, Cxy = coherence(x, y, fs, nperseg=window_sec * 250)
+        in_range = np.nonzero((f >= fmin) & (f <= fmax))
+        f, Cxy = f[in_range], Cxy[in_range]
+
+        theta_co = Cxy[np.nonzero((f >= theta_min) & (f <= theta_max))]
+        delta_co = Cxy[np.nonzero((f >= delta_min) & (f <= delta_max))]
+        max_theta_coherence_ = np.nanmean(theta_co)
+        max_delta_coherence_ = np.nanmean(delta_co)
+
+    if plot_individual_sessions:
+        # Used to plot t-maze sessions - mostly for verification
+        spatial = load_spatial(recording).underlying
+        fig, ax = plt.subplots()
+
+    trials = []
+    for k_, r in enumerate(
+        (
+            row1,
+            row2,
+        )
+    ):
+        if k_ == 0:
+            trial_type = "forced"
+        else:
+            trial_type = "choice"
+
+        # Parse out the times
+        t1, t2, t3 = r.start, r.choice, r.end
+
+        # Make sure there are no parsing Incorrect
+        if t3 > duration:
+            raise RuntimeError(
+                "Last time {} greater than duration {}".format(t3, duration)
+            )
+
+        # Convert these times into LFP samples
+        lfpt1, lfpt2, lfpt3 = (
+            int(floor(t1 * fs)),
+            int(ceil(t2 * fs)),
+            int(ceil(t3 * fs)),
+        )
+
+        # Split the LFP into three parts, the start, choice, and end
+        lfp_portions = {}
+        time_dict = {
+            "start": (lfpt1, lfpt2, lfpt2),
+            "choice": (lfpt1, lfpt2, lfpt3),
+            "end": (lfpt2, lfpt3, lfpt3),
+        }
+        for k, v in max_lfp_lengths_seconds.items():
+            max_len = v
+            start_time = time_dict[k][0]
+            choice_time = time_dict[k][1]
+            end_time = time_dict[k][2]
+
+            if k == "start":
+                # If the start bit is longer than max_len, take the last X
+                # seconds before the choice data
+                ct = max_lfp_lengths_seconds["choice"][0]
+                end_time = max(end_time - int(floor(ct * fs)), start_time)
+                natural_start_time = end_time - max_len * fs
+                start_time = max(natural_start_time, start_time)
+            elif k == "choice":
+                # For the choice, take (max_len[0], max_len[1]) seconds
+                # of data around the point
+                left_push = int(floor(v[0] * fs))
+                right_push = int(ceil(v[1] * fs))
+
+                start_time = max(choice_time - left_push, start_time)
+                end_time = min(choice_time + right_push, end_time)
+            elif k == "end":
+                # For the end time, if the end is longer than max_len, take the first X seconds after the choice data
+                ct = max_lfp_lengths_seconds["choice"][1]
+                start_time = min(start_time + int(ceil(ct * fs)), end_time)
+                natural_end_time = start_time + max_len * fs
+                end_time = min(natural_end_time, end_time)
+            else:
+                raise RuntimeError(f"Unsupported key {k}")
+
+            # Make sure have at least 1 second
+            if (end_time - start_time) < fs:
+                end_time = start_time + fs
+
+            if end_time > int(ceil(duration * 250)):
+                raise RuntimeError(
+                    "End time {} greater than duration {}".format(
+                        end_time, duration
+                    )
+                )
+
+            lfp_portions[k] = (start_time, end_time)
+
+        if j % 20 == 0:
+            print(f"On iteration {j} of {num_sessions} -- trial {trial_type}")
+            for k in lfp_portions.keys():
+                print(
+                    "{}: {} -- {}".format(
+                        k,
+                        np.array(time_dict[k]) / 250,
+                        np.array(lfp_portions[k]) / 250,
+                    )
+                )
+            print("----------------------")
+
+        if plot_individual_sessions:
+            if r.test == "first":
+                c = "k"
+            else:
+                c = "r"
+
+            st1, st2 = int(floor(t1 * 50)), int(ceil(t3 * 50))
+            x_time = spatial.get_pos_x()[st1:st2]
+            y_time = spatial.get_pos_y()[st1:st2]
+            c_end = int(floor(t2 * 50))
+            spat_c = (spatial.get_pos_x()[c_end], spatial.get_pos_y()[c_end])
+            ax.plot(x_time, y_time, c=c, label=r.test)
+            ax.plot(spat_c[0], spat_c[1], c="b", marker="x", label="decision")
+            ax.plot(x_time[0], y_time[0], c="b", marker="o", label="start")
+            ax.plot(x_time[-1], y_time[-1], c="b", marker=".", label="end")
+
+        trials.append((r, trial_type, lfp_portions))
+
+    shard = None
+    if do_coherence:
+        animal = row1.animal.lower()
+        group = "Control" if animal.startswith("c") else "Lesion (ATNx)"
+        res_df, coherence_df, power_df, (f, Cxy) = t_maze_epoch_results(
+            sig_dict,
+            trials,
+            group,
+            window_sec,
+            (fmin, fmax),
+            (delta_min, delta_max),
+            (theta_min, theta_max),
+            (max_theta_coherence_, max_delta_coherence_),
+        )
+
+        # The theta coherence at the choice point of each trial, for decoding
+        theta_idx = np.nonzero((f >= theta_min) & (f <= theta_max))[0]
+        choice_epochs = np.nonzero(res_df["part"] == "choice")[0]
+        shard = {
+            "results": res_df,
+            "coherence": coherence_df,
+            "power": power_df,
+            "group": group,
+            "choice": str(row2.passed).strip(),
+            "choice_theta": [Cxy[epoch, theta_idx] for epoch in choice_epochs],
+        }
+
+    name = os.path.splitext(row1.location)[0]
+    if plot_individual_sessions and do_coherence:
+        for i, (r, _, lfp_portions) in enumerate(trials):
+            # The last part of each trial
+            lfpt1, lfpt2 = lfp_portions["end"]
+            e = (i + 1) * len(lfp_portions) - 1
+            x = np.array(sig_dict["SUB"].samples[lfpt1:lfpt2].to(u.mV))
+            y = np.array(sig_dict["RSC"].samples[lfpt1:lfpt2].to(u.mV))
+            fig2, ax2 = plt.subplots(3, 1)
+            ax2[0].plot(f, Cxy[e], c="k")
+            ax2[1].plot([i / 250 for i in range(len(x))], x, c="k")
+            ax2[2].plot([i / 250 for i in range(len(y))], y, c="k")
+            fig2.savefig(
+                os.path.join(
+                    plot_dir,
+                    "coherence_{}_{}_{}.png".format(
+                        row1.location, r.session, r.test
+                    ),
+                )
+            )
+            plt.close(fig2)
+
+    if plot_individual_sessions:
+        ax.invert_yaxis()
+        ax.legend()
+        figname = os.path.join(plot_dir, name) + "_tmaze.png"
+        fig.savefig(figname, dpi=400)
+        plt.close(fig)
+
+    return shard
+
+
 def main(
     excel_location,
     base_dir,
@@ -68,44 +474,39 @@ def main(
     do_coherence=True,
     do_decoding=True,
     overwrite=False,
+    num_workers=1,
 ):
 
     # Setup
     df = df_from_file(excel_location)
     cfg = simuran.parse_config()
-    delta_min = cfg["delta_min"]
-    delta_max = cfg["delta_max"]
-    theta_min = cfg["theta_min"]
-    theta_max = cfg["theta_max"]
-    clean_method = cfg["clean_method"]
-    clean_kwargs = cfg["clean_kwargs"]
-
-    window_sec = 0.5
-    fmin, fmax = 2.0, 40
-    max_lfp_lengths_seconds = {"start": 20, "choice": (3.5, 0.5), "end": 10}
-
-    ituples = df.itertuples()
+    params = {
+        "delta": (cfg["delta_min"], cfg["delta_max"]),
+        "theta": (cfg["theta_min"], cfg["theta_max"]),
+        "clean_method": cfg["clean_method"],
+        "clean_kwargs": cfg["clean_kwargs"],
+        "window_sec": 0.5,
+        "frange": (2.0, 40),
+        "max_lfp_lengths_seconds": {"start": 20, "choice": (3.5, 0.5), "end": 10},
+    }
+
+    rows = list(df.itertuples())
     num_rows = len(df)
+    # row1 is the forced movement, row2 is the choice trial
+    sessions = [(rows[2 * j], rows[2 * j + 1]) for j in range(num_rows // 2)]
 
     no_pass = False
     if "passed" not in df.columns:
         print("Please add passed as a column to the df.")
         no_pass = True
 
-    results = []
-    coherence_df_list = []
-
-    base_dir_new = os.path.dirname(excel_location)
     here = os.path.dirname(os.path.abspath(__file__))
-    decoding_loc = out_name = os.path.join(
-        here, "..", "sim_results", "tmaze", "lfp_decoding.csv"
-    )
+    decoding_loc = os.path.join(here, "..", "sim_results", "tmaze", "lfp_decoding.csv")
     lfp_len = 6
     hf = lfp_len // 2
     new_lfp = np.zeros(shape=(num_rows // 2, lfp_len))
     groups = []
     choices = []
-    pxx_arr = []
     oname_coherence = os.path.join(
         here, "..", "sim_results", "tmaze", "coherence_full.csv"
     )
@@ -116,411 +517,79 @@ def main(
     o_name_res = os.path.join(
         here, "..", "sim_results", "tmaze", split[0] + "_results" + split[1]
     )
-
-    # Load existing data if instructed to and it exists
-    os.makedirs(os.path.dirname(oname_coherence), exist_ok=True)
-    skip = (
-        (os.path.exists(decoding_loc))
-        and (not overwrite)
-        and (os.path.exists(oname_coherence))
+    shard_dir = os.path.join(here, "..", "sim_results", "tmaze", "sessions")
+    os.makedirs(shard_dir, exist_ok=True)
+
+    ## Load the sessions analysed before, unless overwriting or plotting them
+    shards = [None] * len(sessions)
+    shard_files = [
+        os.path.join(shard_dir, session_key(row1, row2, params) + ".pkl")
+        for row1, row2 in sessions
+    ]
+    if do_coherence and not (overwrite or plot_individual_sessions):
+        shards = [load_shard(shard_file) for shard_file in shard_files]
+    to_run = [j for j, shard in enumerate(shards) if shard is None]
+    print(
+        "Analysing {} of {} t-maze sessions, {} from previous runs".format(
+            len(to_run), len(sessions), len(sessions) - len(to_run)
+        )
     )
-    if skip:
-        with open(decoding_loc, "r") as f:
-            csvreader = csv.reader(f, delimiter=",")
-            for i, row in enumerate(csvreader):
-                groups.append(row[0])
-                choices.append(row[1])
-                vals = row[2:]
-                new_lfp[i] = np.array([float(v) for v in vals[:lfp_len]])
-
-        coherence_df = df_from_file(oname_coherence)
-        power_df = df_from_file(oname_power_tmaze)
-        res_df = df_from_file(o_name_res)
 
     ## Extract LFP, do coherence, and plot
-    if not skip:
-        for j in range(num_rows // 2):
-
-            # row1 is the forced movement
-            row1 = next(ituples)
-            # row2 is the choice trial
-            row2 = next(ituples)
-
-            # Load the t-maze data
-            recording_location = os.path.join(base_dir, row1.location)
-            recording_location = recording_location.replace("--", os.sep)
-            param_file = os.path.join(here, "..", "recording_mappings", row1.mapping)
-            recording = simuran.Recording(
-                param_file=param_file, base_file=recording_location, load=False
-            )
-            lfp_clean = LFPClean(method=clean_method, visualise=False)
-            recording.signals.load()
-            sig_dict = lfp_clean.clean(
-                recording, min_f=fmin, max_f=fmax, method_kwargs=clean_kwargs
-            )["signals"]
-            x = np.array(sig_dict["SUB"].samples.to(u.mV))
-            duration = len(x) / 250
-            y = np.array(sig_dict["RSC"].samples.to(u.mV))
-            fig, ax = plt.subplots()
-
-            fs = sig_dict["SUB"].sampling_rate
-
-            # Setup and loading done -- Analyse the t-maze data
-            if do_coherence:
-                # Coherence over the whole recording
-                f, Cxy = coherence(x, y, fs, nperseg=window_sec * 250)
-                f = f[np.nonzero((f >= fmin) & (f <= fmax))]
-                Cxy = Cxy[np.nonzero((f >= fmin) & (f <= fmax))]
-
-                theta_co = Cxy[np.nonzero((f >= theta_min) & (f <= theta_max))]
-                delta_co = Cxy[np.nonzero((f >= delta_min) & (f <= delta_max))]
-                max_theta_coherence_ = np.nanmean(theta_co)
-                max_delta_coherence_ = np.nanmean(delta_co)
-
-            if plot_individual_sessions:
-                # Used to plot t-maze sessions - mostly for verification
-                recording.spatial.load()
-                spatial = recording.spatial.underlying
-                fig, ax = plt.subplots()
-
-            for k_, r in enumerate(
-                (
-                    row1,
-                    row2,
-                )
-            ):
-                if k_ == 0:
-                    trial_type = "forced"
-                else:
-                    trial_type = "choice"
-
-                # Parse out the times
-                t1, t2, t3 = r.start, r.choice, r.end
-
-                # Make sure there are no parsing Incorrect
-                if t3 > duration:
-                    raise RuntimeError(
-                        "Last time {} greater than duration {}".format(t3, duration)
-                    )
-
-                # Convert these times into LFP samples
-                lfpt1, lfpt2, lfpt3 = (
-                    int(floor(t1 * fs)),
-                    int(ceil(t2 * fs)),
-                    int(ceil(t3 * fs)),
-                )
-
-                # Split the LFP into three parts, the start, choice, and end
-                lfp_portions = {}
-                time_dict = {
-                    "start": (lfpt1, lfpt2, lfpt2),
-                    "choice": (lfpt1, lfpt2, lfpt3),
-                    "end": (lfpt2, lfpt3, lfpt3),
-                }
-                for k, v in max_lfp_lengths_seconds.items():
-                    max_len = v
-                    start_time = time_dict[k][0]
-                    choice_time = time_dict[k][1]
-                    end_time = time_dict[k][2]
-
-                    if k == "start":
-                        # If the start bit is longer than max_len, take the last X
-                        # seconds before the choice data
-                        ct = max_lfp_lengths_seconds["choice"][0]
-                        end_time = max(end_time - int(floor(ct * fs)), start_time)
-                        natural_start_time = end_time - max_len * fs
-                        start_time = max(natural_start_time, start_time)
-                    elif k == "choice":
-                        # For the choice, take (max_len[0], max_len[1]) seconds
-                        # of data around the point
-                        left_push = int(floor(v[0] * fs))
-                        right_push = int(ceil(v[1] * fs))
-
-                        start_time = max(choice_time - left_push, start_time)
-                        end_time = min(choice_time + right_push, end_time)
-                    elif k == "end":
-                        # For the end time, if the end is longer than max_len, take the first X seconds after the choice data
-                        ct = max_lfp_lengths_seconds["choice"][1]
-                        start_time = min(start_time + int(ceil(ct * fs)), end_time)
-                        natural_end_time = start_time + max_len * fs
-                        end_time = min(natural_end_time, end_time)
-                    else:
-                        raise RuntimeError(f"Unsupported key {k}")
-
-                    # Make sure have at least 1 second
-                    if (end_time - start_time) < fs:
-                        end_time = start_time + fs
-
-                    if end_time > int(ceil(duration * 250)):
-                        raise RuntimeError(
-                            "End time {} greater than duration {}".format(
-                                end_time, duration
-                            )
-                        )
-
-                    lfp_portions[k] = (start_time, end_time)
-
-                if j % 20 == 0:
-                    print(f"On iteration {j} of {num_rows // 2} -- trial {trial_type}")
-                    for k in lfp_portions.keys():
-                        print(
-                            "{}: {} -- {}".format(
-                                k,
-                                np.array(time_dict[k]) / 250,
-                                np.array(lfp_portions[k]) / 250,
-                            )
-                        )
-                    print("----------------------")
-
-                if plot_individual_sessions:
-                    if r.test == "first":
-                        c = "k"
-                    else:
-                        c = "r"
-
-                    st1, st2 = int(floor(t1 * 50)), int(ceil(t3 * 50))
-                    x_time = spatial.get_pos_x()[st1:st2]
-                    y_time = spatial.get_pos_y()[st1:st2]
-                    c_end = int(floor(t2 * 50))
-                    spat_c = (spatial.get_pos_x()[c_end], spatial.get_pos_y()[c_end])
-                    ax.plot(x_time, y_time, c=c, label=r.test)
-                    ax.plot(spat_c[0], spat_c[1], c="b", marker="x", label="decision")
-                    ax.plot(x_time[0], y_time[0], c="b", marker="o", label="start")
-                    ax.plot(x_time[-1], y_time[-1], c="b", marker=".", label="end")
-
-                if do_coherence:
-                    res_dict = {}
-                    # Power
-                    for k, v in lfp_portions.items():
-                        for region, signal in sig_dict.items():
-                            lfpt1, lfpt2 = v
-                            lfp = NLfp()
-                            lfp.set_channel_id(signal.channel)
-
-                            lfp._timestamp = np.array(
-                                signal.timestamps[lfpt1:lfpt2].to(u.s)
-                            )
-                            lfp._samples = np.array(
-                                signal.samples[lfpt1:lfpt2].to(u.mV)
-                            )
-                            lfp._record_info["Sampling rate"] = signal.sampling_rate
-                            delta_power = lfp.bandpower(
-                                [delta_min, delta_max],
-                                window_sec=window_sec,
-                                band_total=True,
-                            )
-                            theta_power = lfp.bandpower(
-                                [theta_min, theta_max],
-                                window_sec=window_sec,
-                                band_total=True,
-                            )
-                            res_dict["{}-{}_delta".format(region, k)] = delta_power[
-                                "relative_power"
-                            ]
-                            res_dict["{}-{}_theta".format(region, k)] = theta_power[
-                                "relative_power"
-                            ]
-
-                        sub_s = sig_dict["SUB"]
-                        rsc_s = sig_dict["RSC"]
-                        x = np.array(sub_s.samples[lfpt1:lfpt2].to(u.mV))
-                        y = np.array(rsc_s.samples[lfpt1:lfpt2].to(u.mV))
-
-                        f, Cxy = coherence(x, y, fs, nperseg=window_sec * 250, nfft=256)
-                        f = f[np.nonzero((f >= fmin) & (f <= fmax))]
-                        Cxy = Cxy[np.nonzero((f >= fmin) & (f <= fmax))]
-
-                        if do_decoding:
-                            if k == "choice":
-                                coherence_vals_for_decode = Cxy[
-                                    np.nonzero((f >= theta_min) & (f <= theta_max))
-                                ]
-                                s, e = (k_) * hf, (k_ + 1) * hf
-                                new_lfp[j, s:e] = coherence_vals_for_decode
-
-                        theta_co = Cxy[np.nonzero((f >= theta_min) & (f <= theta_max))]
-                        delta_co = Cxy[np.nonzero((f >= delta_min) & (f <= delta_max))]
-                        max_theta_coherence = np.nanmean(theta_co)
-                        max_delta_coherence = np.nanmean(delta_co)
-
-                        theta_co_peak = Cxy[np.nonzero((f >= 11.0) & (f <= 13.0))]
-                        peak_theta_coherence = np.nanmax(theta_co_peak)
-
-                        if trial_type == "forced":
-                            final_trial_type = "Forced"
-                        else:
-                            if r.passed.strip().upper() == "Y":
-                                final_trial_type = "Correct"
-                            elif r.passed.strip().upper() == "N":
-                                final_trial_type = "Incorrect"
-                            else:
-                                final_trial_type = "ERROR IN ANALYSIS"
-
-                        res_list = [
-                            r.location,
-                            r.session,
-                            r.animal,
-                            r.test,
-                            r.passed.strip(),
-                            k,
-                            final_trial_type,
-                        ]
-                        res_list += [
-                            res_dict[f"SUB-{k}_delta"],
-                            res_dict[f"SUB-{k}_theta"],
-                            res_dict[f"RSC-{k}_delta"],
-                            res_dict[f"RSC-{k}_theta"],
-                        ]
-                        res_list += [max_theta_coherence, max_delta_coherence]
-                        res_list += [
-                            max_theta_coherence_,
-                            max_delta_coherence_,
-                            peak_theta_coherence,
-                        ]
-
-                        if no_pass is False:
-                            group = (
-                                "Control"
-                                if r.animal.lower().startswith("c")
-                                else "Lesion (ATNx)"
-                            )
-                            if do_coherence:
-                                for f_, cxy_ in zip(f, Cxy):
-                                    coherence_df_list.append(
-                                        (
-                                            f_,
-                                            cxy_,
-                                            r.passed.strip(),
-                                            group,
-                                            r.test,
-                                            r.session,
-                                            k,
-                                            final_trial_type,
-                                        )
-                                    )
-
-                                f_welch, Pxx = welch(
-                                    x,
-                                    fs=fs,
-                                    nperseg=window_sec * 250,
-                                    return_onesided=True,
-                                    scaling="density",
-                                    average="mean",
-                                )
-
-                                f_welch = f_welch[
-                                    np.nonzero((f_welch >= fmin) & (f_welch <= fmax))
-                                ]
-                                Pxx = Pxx[
-                                    np.nonzero((f_welch >= fmin) & (f_welch <= fmax))
-                                ]
-
-                                # Convert to full scale relative dB (so max at 0)
-                                Pxx_max = np.max(Pxx)
-                                Pxx = 10 * np.log10(Pxx / Pxx_max)
-                                for p_val, f_val in zip(Pxx, f_welch):
-                                    pxx_arr.append(
-                                        [
-                                            f_val,
-                                            p_val,
-                                            r.passed.strip(),
-                                            group,
-                                            k,
-                                            final_trial_type,
-                                        ]
-                                    )
-                        res_list += [group]
-                        results.append(res_list)
-
-                    name = os.path.splitext(r.location)[0]
-                    if plot_individual_sessions:
-                        fig2, ax2 = plt.subplots(3, 1)
-                        ax2[0].plot(f, Cxy, c="k")
-                        ax2[1].plot([i / 250 for i in range(len(x))], x, c="k")
-                        ax2[2].plot([i / 250 for i in range(len(y))], y, c="k")
-                        base_dir_new = os.path.dirname(excel_location)
-                        fig2.savefig(
-                            os.path.join(
-                                base_dir_new,
-                                "coherence_{}_{}_{}.png".format(
-                                    row1.location, r.session, r.test
-                                ),
-                            )
-                        )
-                        plt.close(fig2)
-
+    jobs = {
+        j: (
+            j,
+            *sessions[j],
+            base_dir,
+            params,
+            plot_individual_sessions,
+            do_coherence,
+            len(sessions),
+            os.path.dirname(excel_location),
+        )
+        for j in to_run
+    }
+    if num_workers > 1 and len(to_run) > 1:
+        with ProcessPoolExecutor(num_workers) as executor:
+            futures = {executor.submit(analyse_session, *jobs[j]): j for j in to_run}
+            for future in as_completed(futures):
+                j = futures[future]
+                shards[j] = future.result()
+                if shards[j] is not None:
+                    save_shard(shards[j], shard_files[j])
+    else:
+        for j in to_run:
+            shards[j] = analyse_session(*jobs[j])
+            if shards[j] is not None:
+                save_shard(shards[j], shard_files[j])
+
+    if do_coherence:
+        # Combine the sessions in the order of the t-maze times
+        for j, shard in enumerate(shards):
+            groups.append(shard["group"])
+            choices.append(shard["choice"])
             if do_decoding:
-                groups.append(group)
-                choices.append(str(r.passed).strip())
-
-            if plot_individual_sessions:
-                ax.invert_yaxis()
-                ax.legend()
-                base_dir_new = os.path.dirname(excel_location)
-                figname = os.path.join(base_dir_new, name) + "_tmaze.png"
-                fig.savefig(figname, dpi=400)
-                plt.close(fig)
-
-    if do_coherence and not skip:
-        # Save the results
-        headers = [
-            "location",
-            "session",
-            "animal",
-            "test",
-            "choice",
-            "part",
-            "trial",
-            "SUB_delta",
-            "SUB_theta",
-            "RSC_delta",
-            "RSC_theta",
-            "Theta_coherence",
-            "Delta_coherence",
-            "Full_theta_coherence",
-            "Full_delta_coherence",
-            "Peak 12Hz Theta coherence",
-            "Group",
-        ]
-
-        res_df = pd.DataFrame(results, columns=headers)
+                for k_, vals in enumerate(shard["choice_theta"]):
+                    s, e = (k_) * hf, (k_ + 1) * hf
+                    new_lfp[j, s:e] = vals
 
-        split = os.path.splitext(os.path.basename(excel_location))
-        out_name = os.path.join(
-            here, "..", "sim_results", "tmaze", split[0] + "_results" + split[1]
-        )
-        df_to_file(res_df, out_name, index=False)
+        # Save the results
+        res_df = pd.concat([shard["results"] for shard in shards], ignore_index=True)
+        df_to_file(res_df, o_name_res, index=False)
 
         # Plot difference between pass and fail trials
-        headers = [
-            "Frequency (Hz)",
-            "Coherence",
-            "Passed",
-            "Group",
-            "Test",
-            "Session",
-            "Part",
-            "Trial",
-        ]
-        coherence_df = list_to_df(coherence_df_list, headers=headers)
-
-        df_to_file(coherence_df, oname_coherence, index=False)
-
-        power_df = list_to_df(
-            pxx_arr,
-            headers=[
-                "Frequency (Hz)",
-                "Power (dB)",
-                "Passed",
-                "Group",
-                "Part",
-                "Trial",
-            ],
-        )
+        if no_pass is False:
+            coherence_df = pd.concat(
+                [shard["coherence"] for shard in shards], ignore_index=True
+            )
+            df_to_file(coherence_df, oname_coherence, index=False)
 
-        df_to_file(power_df, oname_power_tmaze, index=False)
+            power_df = pd.concat(
+                [shard["power"] for shard in shards], ignore_index=True
+            )
+            df_to_file(power_df, oname_power_tmaze, index=False)
 
-    if do_coherence or skip:
+    if do_coherence:
 
         simuran.set_plot_style()
         # res_df["ID"] = res_df["trial"] + "_" + res_df["part"]
@@ -662,7 +731,7 @@ def main(
         plt.close("all")
 
     # Try to decode pass and fail trials.
-    if not os.path.exists(decoding_loc) or overwrite:
+    if do_coherence:
         with open(decoding_loc, "w") as f:
             for i in range(len(groups)):
                 line = ""
@@ -708,6 +777,13 @@ if __name__ == "__main__":
         action="store_true",
         help="Whether to overwrite existing output",
     )
+    parser.add_argument(
+        "--num_workers",
+        "-n",
+        type=int,
+        default=1,
+        help="The number of processes to analyse sessions in.",
+    )
     parsed = parse_args(parser, verbose=False)
 
     cfg_name = parsed.config
@@ -730,4 +806,5 @@ if __name__ == "__main__":
         main_do_coherence,
         main_do_decoding,
         main_overwrite,
+        parsed.num_workers,
     )
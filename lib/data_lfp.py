@@ -1,308 +1,486 @@
 import os
 import re
+import mmap
+from functools import lru_cache
+
 import mne
 import numpy as np
 
 
+# Marks the end of the binary block in Axona data files
+_DATA_END = b"\r\ndata_end\r"
+
+
+def _tokenize_header(header_bytes):
+    """Split Axona header lines into a dict of key to (string) value."""
+    header = {}
+    for line in header_bytes.decode("latin-1").splitlines():
+        parts = line.split(maxsplit=1)
+        if len(parts) == 0:
+            continue
+        header[parts[0]] = parts[1].strip() if len(parts) == 2 else ""
+    return header
+
+
+def read_axona_header(file_name):
+    """
+    Read the text header of an Axona data file (.eeg, .egf, .pos, ...).
+
+    The file is memory mapped and the "data_start" marker is located with
+    a single search, so the binary data is never read here.
+
+    Parameters
+    ----------
+    file_name : str
+        The path to the Axona data file.
+
+    Returns
+    -------
+    header : dict
+        Maps header keys to their (string) values.
+        None if the file is blank.
+    header_offset : int
+        The byte offset of the first sample after "data_start".
+        None if the marker is not found.
+
+    """
+    if os.path.getsize(file_name) == 0:
+        return None, None
+    with open(file_name, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data_start = mm.find(b"data_start")
+            if data_start == -1:
+                header_bytes = mm[:]
+                header_offset = None
+            else:
+                header_bytes = mm[:data_start]
+                header_offset = data_start + len("data_start")
+
+    header = _tokenize_header(header_bytes)
+
+    # Blank file
+    if header.get("trial_date", None) == "":
+        return None, header_offset
+
+    return header, header_offset
+
+
+def _to_number(value, kind=int):
+    """kind(value), or None if value is missing or not a number."""
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _numbered(header, prefix, kind=int):
+    """Map N to the value of each prefixN key of header."""
+    values = {}
+    for key, value in header.items():
+        if key.startswith(prefix) and key[len(prefix) :].isdigit():
+            values[int(key[len(prefix) :])] = _to_number(value, kind)
+    return values
+
+
+@lru_cache(maxsize=512)
+def _parse_set_file(set_file, mtime_ns, size):
+    """The parse of read_set_file, cached while mtime and size are unchanged."""
+    with open(set_file, "rb") as f:
+        header = _tokenize_header(f.read())
+
+    date = header.get("trial_date", "")
+    # Drop the day of the week from "Tuesday, 1 Dec 2017"
+    date = date.split(",")[-1].strip() or None
+    return {
+        "header": header,
+        "date": date,
+        "time": header.get("trial_time", "") or None,
+        "duration": _to_number(header.get("duration", None)),
+        "fullscale_mv": _to_number(header.get("ADC_fullscale_mv", None), float),
+        "gains": _numbered(header, "gain_ch_"),
+        "channel_map": _numbered(header, "EEG_ch_"),
+        "save_eeg": _numbered(header, "saveEEG_ch_", lambda v: int(v) != 0),
+    }
+
+
+def read_set_file(set_file):
+    """
+    Read the header of an Axona .set file into typed values.
+
+    The file is read and tokenized once, and the result is memoized
+    on its path, mtime and size, so the loaders and indexers
+    reading the same .set file share one parse.
+    The returned dict is shared between callers and must not be changed.
+
+    Parameters
+    ----------
+    set_file : str
+        The path to the .set file.
+
+    Returns
+    -------
+    dict
+        header : dict of key to (string) value, all of the header.
+        date : str, the trial date without the weekday, e.g. "1 Dec 2017".
+        time : str, the trial time, e.g. "10:58:00".
+        duration : int, the duration in seconds.
+        fullscale_mv : float, the ADC fullscale in mV.
+        gains : dict of channel (from 0) to gain.
+        channel_map : dict of eeg number (from 1) to channel (from 1).
+        save_eeg : dict of eeg number to whether it was recorded.
+        Values missing from the file are None.
+
+    Raises
+    ------
+    OSError
+        If the file can not be read.
+
+    """
+    st = os.stat(set_file)
+    return _parse_set_file(os.path.abspath(set_file), st.st_mtime_ns, st.st_size)
+
+
+def read_lfp_samples(
+    file_name, header_offset, bytes_per_sample, num_samples, scale=1.0, dtype=None
+):
+    """
+    Decode the samples of an Axona lfp file.
+
+    Samples are stored as signed little-endian integers, so they are
+    read directly as int8 or int16 through a memory map.
+
+    Parameters
+    ----------
+    file_name : str
+        The path to the lfp file.
+    header_offset : int
+        The byte offset of the first sample.
+    bytes_per_sample : int
+        Either 1 (.eeg) or 2 (.egf).
+    num_samples : int
+        The number of samples stated in the header.
+    scale : float, optional
+        Multiplier converting ADC counts to the output unit.
+        Only used if dtype is not None.
+    dtype : np.dtype, optional
+        The output floating point type. If None (default),
+        the raw ADC counts are returned as a read only memory map.
+
+    Returns
+    -------
+    np.ndarray
+        The samples.
+
+    """
+    sample_dtype = np.dtype("i1") if bytes_per_sample == 1 else np.dtype("<i2")
+    data_bytes = (
+        os.path.getsize(file_name) - header_offset - len(_DATA_END) - bytes_per_sample
+    )
+    num_available = max(0, -(-data_bytes // bytes_per_sample))
+    count = min(num_available, num_samples)
+
+    if count == 0:
+        adc_counts = np.zeros(0, dtype=sample_dtype)
+    else:
+        adc_counts = np.memmap(
+            file_name,
+            dtype=sample_dtype,
+            mode="r",
+            offset=header_offset,
+            shape=(count,),
+        )
+
+    if dtype is None:
+        if count < num_samples:
+            adc_counts = np.concatenate(
+                [adc_counts, np.zeros(num_samples - count, dtype=sample_dtype)]
+            )
+        return adc_counts
+
+    samples = np.zeros(num_samples, dtype=dtype)
+    np.multiply(adc_counts, scale, out=samples[:count], casting="unsafe")
+    return samples
+
+
 # Function from NeuroChat - read LFP
-def load_lfp_Axona(file_name):
+def load_lfp_Axona(file_name, dtype=np.float64):
+    """
+    Load a single channel of Axona lfp data (.eeg or .egf) in uV.
+
+    Parameters
+    ----------
+    file_name : str
+        The path to the lfp file, e.g. recording.eeg3.
+    dtype : np.dtype, optional
+        The floating point type of the output, np.float64 by default.
+        If None, the raw ADC counts are returned without scaling.
+
+    Returns
+    -------
+    np.ndarray
+        The lfp samples, or None if the file is blank or missing.
+
+    """
     file_directory, file_basename = os.path.split(file_name)
     file_tag, file_extension = os.path.splitext(file_basename)
     file_extension = file_extension[1:]
     set_file = os.path.join(file_directory, file_tag + ".set")
     if os.path.isfile(file_name):
-        with open(file_name, "rb") as f:
-            while True:
-                line = f.readline()
-                try:
-                    line = line.decode("latin-1")
-                except BaseException:
-                    break
-
-                if line == "":
-                    break
-                if line.startswith("trial_date"):
-                    # Blank eeg file
-                    if line.strip() == "trial_date":
-                        total_samples = 0
-                        return
-                    date = " ".join(line.replace(",", " ").split()[1:])
-                if line.startswith("trial_time"):
-                    time = line.split()[1]
-                if line.startswith("experimenter"):
-                    experimenter = " ".join(line.split()[1:])
-                if line.startswith("comments"):
-                    comments = " ".join(line.split()[1:])
-                if line.startswith("duration"):
-                    duration = float("".join(line.split()[1:]))
-                if line.startswith("sw_version"):
-                    file_version = line.split()[1]
-                if line.startswith("num_chans"):
-                    total_channel = int("".join(line.split()[1:]))
-                if line.startswith("sample_rate"):
-                    sampling_rate = float("".join(re.findall(r"\d+.\d+|\d+", line)))
-                if line.startswith("bytes_per_sample"):
-                    bytes_per_sample = int("".join(line.split()[1:]))
-                if line.startswith("num_" + file_extension[:3].upper() + "_samples"):
-                    total_samples = int("".join(line.split()[1:]))
-                if line.startswith("data_start"):
-                    break
-
-            num_samples = total_samples
-            f.seek(0, 0)
-            header_offset = []
-            while True:
-                try:
-                    buff = f.read(10).decode("UTF-8")
-                except BaseException:
-                    break
-                if buff == "data_start":
-                    header_offset = f.tell()
-                    break
-                else:
-                    f.seek(-9, 1)
-
-            eeg_ID = re.findall(r"\d+", file_extension)
-            file_tag = 1 if not eeg_ID else int(eeg_ID[0])
-            max_ADC_count = 2 ** (8 * bytes_per_sample - 1) - 1
-            max_byte_value = 2 ** (8 * bytes_per_sample)
-
-            with open(set_file, "r", encoding="latin-1") as f_set:
-                lines = f_set.readlines()
-                channel_lines = dict(
-                    [
-                        tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
-                        for line in lines
-                        if line.startswith("EEG_ch_")
-                    ]
-                )
-                channel_id = channel_lines[file_tag]
-                channel_id = channel_id
-
-                gain_lines = dict(
-                    [
-                        tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
-                        for line in lines
-                        if "gain_ch_" in line
-                    ]
-                )
-                gain = gain_lines[channel_id - 1]
-
-                for line in lines:
-                    if line.startswith("ADC_fullscale_mv"):
-                        fullscale_mv = int(re.findall(r"\d+.\d+|d+", line)[0])
-                        break
-                AD_bit_uvolt = (
-                    2 * fullscale_mv / (gain * np.power(2, 8 * bytes_per_sample))
-                )
-
-            record_size = bytes_per_sample
-            sample_le = 256 ** (np.arange(0, bytes_per_sample, 1))
-
-            if not header_offset:
-                print("Error: data_start marker not found!")
-            else:
-                f.seek(header_offset, 0)
-                byte_buffer = np.fromfile(f, dtype="uint8")
-                len_bytebuffer = len(byte_buffer)
-                end_offset = len("\r\ndata_end\r")
-                lfp_wave = np.zeros([num_samples,], dtype=np.float64,)
-                for k in np.arange(0, bytes_per_sample, 1):
-                    byte_offset = k
-                    sample_value = (
-                        sample_le[k]
-                        * byte_buffer[
-                            byte_offset : byte_offset
-                            + len_bytebuffer
-                            - end_offset
-                            - record_size : record_size
-                        ]
-                    )
-                    if sample_value.size < num_samples:
-                        sample_value = np.append(
-                            sample_value, np.zeros([num_samples - sample_value.size,]),
-                        )
-                    sample_value = sample_value.astype(
-                        np.float64, casting="unsafe", copy=False
-                    )
-                    np.add(lfp_wave, sample_value, out=lfp_wave)
-                np.putmask(
-                    lfp_wave, lfp_wave > max_ADC_count, lfp_wave - max_byte_value
-                )
-
-                samples = lfp_wave * AD_bit_uvolt
-                # timestamp = (
-                #     np.arange(0, num_samples, 1) / sampling_rate)
-                return samples
+        header, header_offset = read_axona_header(file_name)
+        if header is None:
+            # Blank eeg file
+            return
+
+        bytes_per_sample = int(header["bytes_per_sample"])
+        num_samples = int(
+            header.get("num_" + file_extension[:3].upper() + "_samples", 0)
+        )
+
+        if header_offset is None:
+            print("Error: data_start marker not found!")
+            return
+
+        eeg_ID = re.findall(r"\d+", file_extension)
+        file_tag = 1 if not eeg_ID else int(eeg_ID[0])
+
+        set_header = read_set_file(set_file)
+        channel_id = set_header["channel_map"][file_tag]
+        gain = set_header["gains"][channel_id - 1]
+        fullscale_mv = set_header["fullscale_mv"]
+        AD_bit_uvolt = 2 * fullscale_mv / (gain * np.power(2, 8 * bytes_per_sample))
+
+        return read_lfp_samples(
+            file_name,
+            header_offset,
+            bytes_per_sample,
+            num_samples,
+            scale=AD_bit_uvolt,
+            dtype=dtype,
+        )
 
     else:
         print("No lfp file found for file {}".format(file_name))
 
 
-def mne_lfp_Axona(file_name):
+class AxonaLfpArray(object):
+    """
+    Lazy channels x samples view over the lfp files of an Axona recording.
+
+    The .set file and the header of each .eegN file are parsed once on
+    creation, but no samples are read. Each channel is memory mapped on
+    first use and only the requested channels and sample windows are
+    ever converted to floating point.
+
+    Attributes
+    ----------
+    set_file : str
+        The path to the .set file.
+    channels : list of int
+        The recorded eeg channel numbers with a data file present.
+    sampling_rate : float
+        The sampling rate in Hz.
+    num_samples : int
+        The number of samples per channel.
+
+    Parameters
+    ----------
+    file_name : str
+        Axona .set file in the same folder as the EEG recordings
+
+    """
+
+    def __init__(self, file_name):
+        """See help(AxonaLfpArray)."""
+        file_directory, file_basename = os.path.split(file_name)
+        file_tag, _ = os.path.splitext(file_basename)
+        self.set_file = os.path.join(file_directory, file_tag + ".set")
+        self.channels = []
+        self.sampling_rate = None
+        self.num_samples = 0
+        self._info = {}
+        self._memmaps = {}
+
+        set_header = read_set_file(self.set_file)
+        fullscale_mv = set_header["fullscale_mv"]
+        channel_map = set_header["channel_map"]  # map internal channels
+        recorded_channels = set_header["save_eeg"]  # map of recorded channels
+        gains = set_header["gains"]
+
+        for ch, recorded in recorded_channels.items():
+            if not recorded:
+                continue
+            eeg_file = os.path.join(file_directory, file_tag + ".eeg")
+            if ch != 1:
+                eeg_file += str(ch)
+            if not os.path.isfile(eeg_file):
+                continue
+
+            header, header_offset = read_axona_header(eeg_file)
+            if header is None:
+                # Blank eeg file
+                continue
+            if header_offset is None:
+                print("Error: data_start marker not found in {}!".format(eeg_file))
+                continue
+
+            bytes_per_sample = int(header["bytes_per_sample"])
+            num_samples = int(header["num_EEG_samples"])
+            AD_bit_uvolt = (
+                2
+                * fullscale_mv
+                / (gains[channel_map[ch] - 1] * np.power(2, 8 * bytes_per_sample))
+            )
+            self.sampling_rate = float(
+                "".join(re.findall(r"\d+.\d+|\d+", header["sample_rate"]))
+            )
+            self.num_samples = max(self.num_samples, num_samples)
+            self.channels.append(ch)
+            self._info[ch] = {
+                "file": eeg_file,
+                "header_offset": header_offset,
+                "bytes_per_sample": bytes_per_sample,
+                "num_samples": num_samples,
+                "scale": AD_bit_uvolt,
+            }
+
+    def __len__(self):
+        return len(self.channels)
+
+    @property
+    def shape(self):
+        """The (channels, samples) shape of the full view."""
+        return (len(self.channels), self.num_samples)
+
+    @property
+    def ch_names(self):
+        """The channel names, as ch_N for eeg channel N."""
+        return [f"ch_{ch}" for ch in self.channels]
+
+    def get_channel_counts(self, ch):
+        """Get the raw ADC counts of channel ch as a read only memory map."""
+        if ch not in self._memmaps:
+            info = self._info[ch]
+            self._memmaps[ch] = read_lfp_samples(
+                info["file"],
+                info["header_offset"],
+                info["bytes_per_sample"],
+                info["num_samples"],
+            )
+        return self._memmaps[ch]
+
+    def _parse_picks(self, picks):
+        if picks is None:
+            return list(self.channels)
+        picked = []
+        for p in picks:
+            if isinstance(p, str):
+                p = int(p[len("ch_") :]) if p.startswith("ch_") else int(p)
+            if p not in self._info:
+                raise ValueError(f"Channel {p} was not recorded in {self.set_file}")
+            picked.append(p)
+        return picked
+
+    def get_data(self, picks=None, start=0, stop=None, dtype=np.float64, divisor=1):
+        """
+        Materialise a window of the requested channels.
+
+        Parameters
+        ----------
+        picks : list of int or str, optional
+            Channel numbers (or names ch_N) to read, all by default.
+        start : int, optional
+            First sample to read, 0 by default.
+        stop : int, optional
+            Sample to stop reading at (exclusive), the end by default.
+        dtype : np.dtype, optional
+            The floating point output type, np.float64 by default.
+        divisor : float, optional
+            Divides the data in uV, e.g. 1000 to get mV. 1 by default.
+
+        Returns
+        -------
+        np.ndarray
+            A len(picks) x (stop - start) array.
+
+        """
+        picks = self._parse_picks(picks)
+        stop = self.num_samples if stop is None else min(stop, self.num_samples)
+        start = max(start, 0)
+        data = np.zeros((len(picks), max(stop - start, 0)), dtype=dtype)
+        for i, ch in enumerate(picks):
+            counts = self.get_channel_counts(ch)[start:stop]
+            np.multiply(
+                counts,
+                self._info[ch]["scale"],
+                out=data[i, : len(counts)],
+                casting="unsafe",
+            )
+        if divisor != 1:
+            np.divide(data, divisor, out=data)
+        return data
+
+    def to_mne(self, picks=None, tmin=None, tmax=None, drop_flat=True):
+        """
+        Create a mne RawArray from a window of the requested channels.
+
+        Parameters
+        ----------
+        picks : list of int or str, optional
+            Channel numbers (or names ch_N) to read, all by default.
+        tmin : float, optional
+            Start time in seconds, the start of the recording by default.
+        tmax : float, optional
+            End time in seconds, the end of the recording by default.
+        drop_flat : bool, optional
+            Drop channels that are never positive, True by default.
+
+        Returns
+        -------
+        mne.io.RawArray
+            The data in mV with channels named ch_N.
+
+        """
+        picks = self._parse_picks(picks)
+        start = 0 if tmin is None else int(round(tmin * self.sampling_rate))
+        stop = None if tmax is None else int(round(tmax * self.sampling_rate))
+        data = self.get_data(picks, start, stop, divisor=1000)
+
+        if drop_flat:
+            if data.shape[1]:
+                keep = np.max(data, axis=1) > 0
+            else:
+                keep = np.zeros(data.shape[0], dtype=bool)
+            # Indexing copies the data, so only do it if a channel is dropped
+            if not keep.all():
+                data = data[keep]
+                picks = [ch for ch, k in zip(picks, keep) if k]
+
+        labels = [f"ch_{ch}" for ch in picks]
+        info = mne.create_info(
+            ch_names=labels, sfreq=self.sampling_rate, ch_types=["eeg"] * len(labels)
+        )
+        return mne.io.RawArray(data, info)
+
+
+def mne_lfp_Axona(file_name, picks=None, tmin=None, tmax=None):
     """
     Create a mne object from a Axona recording.
     ------
-    Load all channels from an Axona recording into a mne object
+    Load recorded channels from an Axona recording into a mne object.
+    Only the requested channels and time window are read from disk,
+    see AxonaLfpArray.
 
 
     Parameters:
     ------
     file_name (str): Axona .set file in the same folder as the EEG recordings referents to the set file
+    picks (list): Channel numbers or ch_N names to load, all by default
+    tmin (float): Start time in seconds, the start by default
+    tmax (float): End time in seconds, the end by default
 
     Returns:
     ------
     MNE object with N channels named as ch_0 - ch_N
 
     """
-    file_directory, file_basename = os.path.split(file_name)
-    file_tag, file_extension = os.path.splitext(file_basename)
-    set_file = os.path.join(file_directory, file_tag + ".set")
-
-    # Open Set files configurations
-    with open(file_name, "r", encoding="latin-1") as f_set:
-        lines = f_set.readlines()
-        for line in lines:
-            if line.startswith("ADC_fullscale_mv"):
-                fullscale_mv = int(re.findall(r"\d+.\d+|d+", line)[0])
-        channel_map = dict(  # map internal channels from Axona set
-            [
-                tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
-                for line in lines
-                if line.startswith("EEG_ch_")
-            ]
-        )
-        recorded_channels = dict(  # map or recorded channels from Axona set
-            [
-                tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
-                for line in lines
-                if line.startswith("saveEEG_ch_")
-            ]
-        )
-        channel_ids = [
-            ch for ch in recorded_channels.keys() if recorded_channels[ch]
-        ]  # All recorded EEG channels
-        gains = [
-            int((re.findall(r"\d+.\d+|\d+", line)[0].split()[1]))
-            for line in lines
-            if "gain_ch_" in line
-        ]  # List of gains
-
-    data = []
-    labels = []
-    ch_types = []
-    for ch in channel_ids:  # Loop for all channels
-        if ch == 1:
-            eeg_file = (
-                file_directory + "/" + file_tag + ".eeg"
-            )  # if it is the first eeg channel
-        else:
-            eeg_file = file_directory + "/" + file_tag + ".eeg" + str(ch)
-
-        if os.path.isfile(eeg_file):  # open eeg file
-            with open(eeg_file, "rb") as f:
-                while True:
-                    line = f.readline()
-                    try:
-                        line = line.decode("latin-1")
-                    except:
-                        try:
-                            line = line.decode("UTF-8")
-                        except BaseException:
-                            break
-                    if line == "":
-                        break
-                    if line.startswith("trial_date"):
-                        # Blank eeg file
-                        if line.strip() == "trial_date":
-                            total_samples = 0
-                            break
-                        date = " ".join(line.replace(",", " ").split()[1:])
-                    if line.startswith("trial_time"):
-                        time = line.split()[1]
-                    if line.startswith("experimenter"):
-                        experimenter = " ".join(line.split()[1:])
-                    if line.startswith("comments"):
-                        comments = " ".join(line.split()[1:])
-                    if line.startswith("duration"):
-                        duration = float("".join(line.split()[1:]))
-                    if line.startswith("sw_version"):
-                        file_version = line.split()[1]
-                    if line.startswith("num_chans"):
-                        total_channel = int("".join(line.split()[1:]))
-                    if line.startswith("sample_rate"):
-                        sampling_rate = float("".join(re.findall(r"\d+.\d+|\d+", line)))
-                    if line.startswith("bytes_per_sample"):
-                        bytes_per_sample = int("".join(line.split()[1:]))
-                    if line.startswith("num_EEG_samples"):
-                        total_samples = int("".join(line.split()[1:]))
-                    if line.startswith("data_start"):
-                        break
-
-                f.seek(0, 0)
-                header_offset = []
-                while True:
-                    try:
-                        buff = f.read(10).decode("UTF-8")
-                    except BaseException:
-                        break
-                    if buff == "data_start":
-                        header_offset = f.tell()
-                        break
-                    else:
-                        f.seek(-9, 1)
-                if not header_offset:
-                    print("Error: data_start marker not found!")
-                else:
-                    AD_bit_uvolt = (
-                        2
-                        * fullscale_mv
-                        / (
-                            gains[channel_map[ch] - 1]
-                            * np.power(2, 8 * bytes_per_sample)
-                        )
-                    )
-                    num_samples = total_samples
-                    max_ADC_count = 2 ** (8 * bytes_per_sample - 1) - 1
-                    max_byte_value = 2 ** (8 * bytes_per_sample)
-                    record_size = bytes_per_sample
-                    sample_le = 256 ** (np.arange(0, bytes_per_sample, 1))
-                    f.seek(header_offset, 0)
-                    byte_buffer = np.fromfile(f, dtype="uint8")
-                    len_bytebuffer = len(byte_buffer)
-                    end_offset = len("\r\ndata_end\r")
-                    lfp_wave = np.zeros([num_samples,], dtype=np.float64,)
-                    for k in np.arange(0, bytes_per_sample, 1):
-                        byte_offset = k
-                        sample_value = (
-                            sample_le[k]
-                            * byte_buffer[
-                                byte_offset : byte_offset
-                                + len_bytebuffer
-                                - end_offset
-                                - record_size : record_size
-                            ]
-                        )
-                        if sample_value.size < num_samples:
-                            sample_value = np.append(
-                                sample_value,
-                                np.zeros([num_samples - sample_value.size,]),
-                            )
-                        sample_value = sample_value.astype(
-                            np.float64, casting="unsafe", copy=False
-                        )
-                        np.add(lfp_wave, sample_value, out=lfp_wave)
-                    np.putmask(
-                        lfp_wave, lfp_wave > max_ADC_count, lfp_wave - max_byte_value
-                    )
-                    samples = lfp_wave * AD_bit_uvolt
-
-                    timestamp = np.arange(0, num_samples, 1) / sampling_rate
-                    lfp_data = lfp_wave * AD_bit_uvolt
-                    if max(lfp_data) > 0:
-                        data.append((lfp_wave * AD_bit_uvolt) / 1000)
-                        labels.append(f"ch_{ch}")
-                        ch_types.append("eeg")
-
-    info = mne.create_info(ch_names=labels, sfreq=sampling_rate, ch_types=ch_types)
-    return mne.io.RawArray(np.array(data), info)
+    return AxonaLfpArray(file_name).to_mne(picks=picks, tmin=tmin, tmax=tmax)
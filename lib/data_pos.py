@@ -3,7 +3,8 @@ import logging
 from shapely.geometry import Point, Polygon
 import pandas as pd
 import numpy as np
-import math
+
+from lib.data_lfp import read_axona_header
 
 
 def is_inside(x, y, position):
@@ -23,6 +24,84 @@ def is_inside(x, y, position):
     return points_inside
 
 
+# Axona 20 byte position record, all fields big-endian
+POS_RECORD_DTYPE = np.dtype(
+    [
+        ("t", ">u4"),
+        ("x1", ">u2"),
+        ("y1", ">u2"),
+        ("x2", ">u2"),
+        ("y2", ">u2"),
+        ("numpix1", ">u2"),
+        ("numpix2", ">u2"),
+        ("total_pix", ">u2"),
+        ("unused", ">u2"),
+    ]
+)
+
+# Coordinate value used by Axona when an LED is not tracked
+MISSING_LED = 1023
+
+
+def fix_missing_led(big, small):
+    """
+    Replace untracked coordinates of one LED by those of the other.
+
+    If both LEDs are untracked at a time point, both become NaN.
+
+    """
+    big = np.array(big, dtype=np.float64)
+    small = np.array(small, dtype=np.float64)
+    big_missing = big == MISSING_LED
+    small_missing = small == MISSING_LED
+    both_missing = big_missing & small_missing
+
+    big[big_missing] = small[big_missing]
+    small[small_missing] = big[small_missing]
+    big[both_missing] = np.nan
+    small[both_missing] = np.nan
+    return big, small
+
+
+def interpolate_nans(a):
+    """
+    Linearly interpolate NaN values in a.
+
+    Matches pandas Series.interpolate("linear"), so trailing NaNs take
+    the last valid value and leading NaNs are left in place.
+
+    """
+    a = np.asarray(a, dtype=np.float64)
+    valid = ~np.isnan(a)
+    if valid.all() or not valid.any():
+        return a.copy()
+    idx = np.arange(len(a))
+    out = np.interp(idx, idx[valid], a[valid])
+    out[: np.argmax(valid)] = np.nan
+    return out
+
+
+def pad_and_convolve(xx, kernel):
+    """Convolve xx with kernel, padding the edges with the edge values."""
+    npad = len(kernel)
+    xx = np.pad(xx, (npad, npad), "edge")
+    yy = np.convolve(xx, kernel, mode="same")
+    return yy[npad:-npad]
+
+
+def boxcar_smooth(xx, size):
+    """
+    Moving average of xx over size samples, using a cumulative sum.
+
+    Equivalent to pad_and_convolve(xx, np.ones(size) / size).
+
+    """
+    xx = np.pad(np.asarray(xx, dtype=np.float64), (size, size), "edge")
+    csum = np.concatenate(([0.0], np.cumsum(xx)))
+    start = np.arange(size, len(xx) - size) - size // 2
+    return (csum[start + size] - csum[start]) / size
+
+
 class RecPos:
     """
     This data class contains information about the recording position.
@@ -47,6 +126,8 @@ class RecPos:
         The head direction data
     raw_position : dict
         The raw position data decoded from .pos file.
+    led_position : list
+        The cleaned [(big x, big y), (small x, small y)] LED positions.
 
     Parameters
     ----------
@@ -65,6 +146,7 @@ class RecPos:
         self.speed = np.array([])
         self.head_direction = np.array([])
         self.raw_position = {}
+        self.led_position = []
         if file_name is not None:
             self.set_file(file_name)
             if load:
@@ -92,106 +174,57 @@ class RecPos:
         self.bytes_per_sample = 20  # Axona daqUSB manual
 
         if os.path.isfile(self.pos_file):
-            with open(self.pos_file, "rb") as f:
-                while True:
-                    line = f.readline()
-                    try:
-                        line = line.decode("latin-1")
-                    except BaseException:
-                        break
-                    if line == "":
-                        break
-                    if line.startswith("trial_date"):
-                        # Blank pos file
-                        if line.strip() == "trial_date":
-                            total_samples = 0
-                            print("No position data.")
-                            return
-                        date = " ".join(line.replace(",", " ").split()[1:])
-                    if line.startswith("num_colours"):
-                        colors = int(line.split()[1])
-                    if line.startswith("min_x"):
-                        self.min_x = int(line.split()[1])
-                    if line.startswith("max_x"):
-                        self.max_x = int(line.split()[1])
-                    if line.startswith("min_y"):
-                        self.min_y = int(line.split()[1])
-                    if line.startswith("max_y"):
-                        self.max_y = int(line.split()[1])
-                    if line.startswith("window_min_x"):
-                        self.window_min_x = int(line.split()[1])
-                    if line.startswith("window_max_x"):
-                        self.window_max_x = int(line.split()[1])
-                    if line.startswith("window_min_y"):
-                        self.window_min_y = int(line.split()[1])
-                    if line.startswith("window_max_y"):
-                        self.window_max_y = int(line.split()[1])
-                    if line.startswith("bytes_per_timestamp"):
-                        self.bytes_per_tstamp = int(line.split()[1])
-                    if line.startswith("bytes_per_coord"):
-                        self.bytes_per_coord = int(line.split()[1])
-                    if line.startswith("pixels_per_metre"):
-                        self.pixels_per_metre = int(line.split()[1])
-                        self.pixels_per_cm = self.pixels_per_metre / 100
-                    if line.startswith("num_pos_samples"):
-                        self.total_samples = int(line.split()[1])
-                    if line.startswith("pos_format"):
-                        info = line.split(" ")[-1]
-                        if info[:-2] != "t,x1,y1,x2,y2,numpix1,numpix2":
-                            logging.error(
-                                ".pos reading only supports 2-spot mode currently"
-                            )
-                            print(info[:-2])
-                            print("t,x1,y1,x2,y2,numpix1,numpix2")
-                            return
-                    if line.startswith("data_start"):
-                        break
-
-                f.seek(0, 0)
-                header_offset = []
-                while True:
-                    try:
-                        buff = f.read(10).decode("UTF-8")
-                    except BaseException:
-                        break
-                    if buff == "data_start":
-                        header_offset = f.tell()
-                        break
-                    else:
-                        f.seek(-9, 1)
-
-                if not header_offset:
-                    print("Error: data_start marker not found!")
-                else:
+            header, header_offset = read_axona_header(self.pos_file)
+            if header is None:
+                # Blank pos file
+                print("No position data.")
+                return
+            for key in (
+                "min_x",
+                "max_x",
+                "min_y",
+                "max_y",
+                "window_min_x",
+                "window_max_x",
+                "window_min_y",
+                "window_max_y",
+            ):
+                if key in header:
+                    setattr(self, key, int(header[key].split()[0]))
+            if "bytes_per_timestamp" in header:
+                self.bytes_per_tstamp = int(header["bytes_per_timestamp"].split()[0])
+            if "bytes_per_coord" in header:
+                self.bytes_per_coord = int(header["bytes_per_coord"].split()[0])
+            if "pixels_per_metre" in header:
+                self.pixels_per_metre = int(header["pixels_per_metre"].split()[0])
+                self.pixels_per_cm = self.pixels_per_metre / 100
+            if "num_pos_samples" in header:
+                self.total_samples = int(header["num_pos_samples"].split()[0])
+            if "pos_format" in header:
+                info = header["pos_format"].split(" ")[-1]
+                if info != "t,x1,y1,x2,y2,numpix1,numpix2":
+                    logging.error(".pos reading only supports 2-spot mode currently")
+                    print(info)
+                    print("t,x1,y1,x2,y2,numpix1,numpix2")
+                    return
+
+            if header_offset is None:
+                print("Error: data_start marker not found!")
+            else:
+                # pos format: t,x1,y1,x2,y2,numpix1,numpix2 => 20 bytes
+                with open(self.pos_file, "rb") as f:
                     f.seek(header_offset, 0)
-                    byte_buffer = np.fromfile(f, dtype="uint8")
-                    big_spotx = np.zeros([self.total_samples, 1])
-                    big_spoty = np.zeros([self.total_samples, 1])
-                    little_spotx = np.zeros([self.total_samples, 1])
-                    little_spoty = np.zeros([self.total_samples, 1])
-                    # pos format: t,x1,y1,x2,y2,numpix1,numpix2 => 20 bytes
-                    for i, k in enumerate(
-                        np.arange(0, self.total_samples * 20, 20)
-                    ):  # Extract bytes from 20 bytes words
-                        big_spotx[i] = int(
-                            256 * byte_buffer[k + 4] + byte_buffer[k + 5]
-                        )  # 4,5 bytes for big LED x
-                        big_spoty[i] = int(
-                            256 * byte_buffer[k + 6] + byte_buffer[k + 7]
-                        )  # 6,7 bytes for big LED x
-                        little_spotx[i] = int(
-                            256 * byte_buffer[k + 8] + byte_buffer[k + 9]
-                        )
-                        little_spoty[i] = int(
-                            256 * byte_buffer[k + 10] + byte_buffer[k + 11]
-                        )
-
-                    self.raw_position = {
-                        "big_spotx": big_spotx,
-                        "big_spoty": big_spoty,
-                        "little_spotx": little_spotx,
-                        "little_spoty": little_spoty,
-                    }
+                    byte_buffer = f.read(self.total_samples * self.bytes_per_sample)
+                records = np.frombuffer(
+                    byte_buffer, dtype=POS_RECORD_DTYPE, count=self.total_samples
+                )
+
+                self.raw_position = {
+                    "big_spotx": records["x1"].astype(np.float64),
+                    "big_spoty": records["y1"].astype(np.float64),
+                    "little_spotx": records["x2"].astype(np.float64),
+                    "little_spoty": records["y2"].astype(np.float64),
+                }
 
         else:
             print(f"No pos file found for file {self.pos_file}")
@@ -244,23 +277,22 @@ class RecPos:
         return self.pixels_per_metre
 
     def get_raw_pos(self):
-        bigx = [value[0] for value in self.raw_position["big_spotx"]]
-        bigy = [value[0] for value in self.raw_position["big_spoty"]]
-        smallx = [value[0] for value in self.raw_position["little_spotx"]]
-        smally = [value[0] for value in self.raw_position["little_spoty"]]
+        bigx = self.raw_position["big_spotx"]
+        bigy = self.raw_position["big_spoty"]
+        smallx = self.raw_position["little_spotx"]
+        smally = self.raw_position["little_spoty"]
         return bigx, bigy, smallx, smally
 
     def filter_max_speed(self, x, y, max_speed=4):  # max speed 4m/s ()
-        tmp_x = x.copy()
-        tmp_y = y.copy()
+        tmp_x = np.array(x, dtype=np.float64)
+        tmp_y = np.array(y, dtype=np.float64)
         threshold = (
             max_speed * self.pixels_per_metre * 50
         )  # max speed * distance (m) /  50 samples (s)
-        for i in range(1, len(tmp_x)):
-            distance = math.sqrt((x[i] - x[i - 1]) ** 2 + (y[i] - y[i - 1]) ** 2)
-            if distance > threshold:
-                tmp_x[i] = np.nan
-                tmp_y[i] = np.nan
+        distance = np.hypot(np.diff(tmp_x), np.diff(tmp_y))
+        jumps = np.concatenate(([False], distance > threshold))
+        tmp_x[jumps] = np.nan
+        tmp_y[jumps] = np.nan
 
         return tmp_x, tmp_y
 
@@ -273,89 +305,49 @@ class RecPos:
     def calculate_position(self, raw=False):
         # TODO include the checking for big-small mix ups
         try:
-            count_missing = 0
-            bxx, sxx = [], []
-            byy, syy = [], []
-            bigx = [value[0] for value in self.raw_position["big_spotx"]]
-            bigy = [value[0] for value in self.raw_position["big_spoty"]]
-            smallx = [value[0] for value in self.raw_position["little_spotx"]]
-            smally = [value[0] for value in self.raw_position["little_spoty"]]
-            for bx, sx in zip(bigx, smallx):  # Try to clean single blocked LED x
-                if bx == 1023 and sx != 1023:
-                    bx = sx
-                elif bx != 1023 and sx == 1023:
-                    sx = bx
-                elif bx == 1023 and sx == 1023:
-                    count_missing += 1
-                    bx = np.nan
-                    sx = np.nan
-                bxx.append(bx)
-                sxx.append(sx)
-
-            for by, sy in zip(bigy, smally):  # Try to clean single blocked LED y
-                if by == 1023 and sy != 1023:
-                    by = sy
-                elif by != 1023 and sy == 1023:
-                    sy = by
-                elif by == 1023 and sy == 1023:
-                    by = np.nan
-                    sy = np.nan
-                byy.append(by)
-                syy.append(sy)
+            bigx, bigy, smallx, smally = self.get_raw_pos()
+
+            ### Try to clean single blocked LEDs
+            bxx, sxx = fix_missing_led(bigx, smallx)
+            byy, syy = fix_missing_led(bigy, smally)
 
             ### Remove coordinates with max_speed > 4ms
             bxx, byy = self.filter_max_speed(bxx, byy)
             sxx, syy = self.filter_max_speed(sxx, syy)
 
             ### Interpolate missing values
-            bxx = (pd.Series(bxx).astype(float)).interpolate("linear")
-            sxx = (pd.Series(sxx).astype(float)).interpolate("linear")
-            byy = (pd.Series(byy).astype(float)).interpolate("linear")
-            syy = (pd.Series(syy).astype(float)).interpolate("linear")
+            bxx = interpolate_nans(bxx)
+            sxx = interpolate_nans(sxx)
+            byy = interpolate_nans(byy)
+            syy = interpolate_nans(syy)
+            self.led_position = [(bxx, byy), (sxx, syy)]
             if raw:
                 return [(bxx, byy), (sxx, syy)]
 
             ### Average both LEDs
-            x = list((bxx + sxx) / 2)
-            y = list((byy + syy) / 2)
+            x = (bxx + sxx) / 2
+            y = (byy + syy) / 2
 
             ## Boxcar filter 400 ms (axona tint default)
             # sample rate = 20 ms
             b = int(400 / 20)
             kernel = np.ones(b) / b
 
-            def pad_and_convolve(xx, kernel):
-                npad = len(kernel)
-                xx = np.pad(xx, (npad, npad), "edge")
-                yy = np.convolve(xx, kernel, mode="same")
-                return yy[npad:-npad]
-
             x = pad_and_convolve(x, kernel)
             y = pad_and_convolve(y, kernel)
 
-            if np.count_nonzero(np.isnan(x)) != 0:
-                num_start_nan = 0
-                for val in x:
-                    if np.isnan(val):
-                        num_start_nan += 1
-                    else:
-                        break
-                if num_start_nan != 0:
-                    np.put(x, np.arange(0, num_start_nan, 1), x[num_start_nan])
-                    np.put(y, np.arange(0, num_start_nan, 1), y[num_start_nan])
-
-            if np.count_nonzero(np.isnan(x)) != 0:
-                num_end_nan = 0
-                for val in x[::-1]:
-                    if np.isnan(val):
-                        num_end_nan += 1
-                    else:
-                        break
-                from_end = len(x) - num_end_nan
+            # Fill NaN at the start and end with the nearest valid value
+            is_valid = ~np.isnan(x)
+            num_start_nan = np.argmax(is_valid)
+            if num_start_nan != 0:
+                x[:num_start_nan] = x[num_start_nan]
+                y[:num_start_nan] = y[num_start_nan]
+
+            num_end_nan = np.argmax(is_valid[::-1])
+            if num_end_nan != 0:
                 back = num_end_nan + 1
-                if num_end_nan != 0:
-                    np.put(x, np.arange(from_end, len(x), 1), x[-back])
-                    np.put(y, np.arange(from_end, len(x), 1), y[-back])
+                x[len(x) - num_end_nan :] = x[-back]
+                y[len(x) - num_end_nan :] = y[-back]
 
             self.x = x / self.pixels_per_cm
             self.y = y / self.pixels_per_cm
@@ -367,7 +359,9 @@ class RecPos:
     def get_speed(self):
         return self.speed
 
-    def calculate_speed(self, num_samples=5, smooth_size=5, smooth=True):
+    def calculate_speed(
+        self, num_samples=5, smooth_size=5, smooth=True, head_direction=False
+    ):
         """
         Calculate the speed.
 
@@ -379,72 +373,77 @@ class RecPos:
         4. Interpolate these values to get speed at every time point(50Hz)
         5. Smooth the interpolated speeds to remove bumps around sample times.
 
+        Parameters
+        ----------
+        num_samples : int
+            The step in samples between speed estimates, 5 by default.
+        smooth_size : int
+            The size of the boxcar smoothing the speed, 5 by default.
+        smooth : bool
+            Whether to smooth the speed, True by default.
+        head_direction : bool
+            Also calculate the head direction in the same pass,
+            see get_angular_pos. False by default.
+
+        Returns
+        -------
+        np.ndarray or (np.ndarray, np.ndarray)
+            The float32 speed in cm/s, and the head direction if requested.
+
         """
         x, y = self.get_position()
 
-        def pad_and_convolve(xx, kernel):
-            npad = len(kernel)
-            xx = np.pad(xx, (npad, npad), "edge")
-            yy = np.convolve(xx, kernel, mode="same")
-            return yy[npad:-npad]
-
-        speed = [0]
         s_rate = num_samples  # 50 Hz is too fine grained
         t_rate = 0.02 * s_rate
         duration = len(x) * 0.02
-        for i in range(s_rate * 3 // 2, len(x), s_rate):
-            cm_dist = math.sqrt(
-                (x[i] - x[i - s_rate]) ** 2 + (y[i] - y[i - s_rate]) ** 2
-            )
-            # (pixel/s) - 300 pixels per metre * 100 (cm/s)
-            cms_speed = cm_dist / t_rate
-            speed.append(cms_speed)
-        xp = np.array(
-            [0.0] + [0.02 * i for i in range(s_rate, len(x) - (s_rate // 2), s_rate)]
+
+        # Distance between positions s_rate samples apart
+        idx = np.arange(s_rate * 3 // 2, len(x), s_rate)
+        # (pixel/s) - 300 pixels per metre * 100 (cm/s)
+        cm_dist = np.hypot(x[idx] - x[idx - s_rate], y[idx] - y[idx - s_rate])
+        cms_speed = cm_dist / t_rate
+        speed = np.concatenate(([0.0], cms_speed))
+        xp = np.concatenate(
+            ([0.0], 0.02 * np.arange(s_rate, len(x) - (s_rate // 2), s_rate))
         )
         xs = np.arange(0, duration, 0.02)
-        kernel_size = smooth_size
         interp_speed = np.interp(xs, xp, speed)
 
         if smooth:
-            kernel = np.ones(kernel_size) / kernel_size
-            interp_speed = pad_and_convolve(interp_speed, kernel)
-
-        self.speed = interp_speed
-        return interp_speed
-
-    def get_angular_pos(self):  # Suposing Big Led in the Right side
-
-        # To do: (Not working)
-        # Check LEDs sides
-        # Fix the function
-        # implement Axona's checks
-        #  no. pixels in big light = 18.35 +/- 8.48
-        #  no. pixels in small light = 10.96 +/- 5.92
-        #  1615 points swapped as 2-light confusions
-
-        def calc_angle(R, L, d=12):  # d - distance from LEDs in pixels
-            if R[1] == L[1]:
-                if R[0] > L[0]:
-                    return 0.0
-                return 180.0
-            elif R[0] == L[0]:
-                if R[1] > L[1]:
-                    return 90.0
-                return 270.0
-            elif R[1] > L[1]:
-                return math.acos((R[0] - L[0]) / d) * 180 / math.pi
-            elif R[0] < L[0]:
-                return 90 + math.acos((R[0] - L[0]) / d) * 180 / math.pi
-            else:
-                return 360 - math.acos((R[0] - L[0]) / d) * 180 / math.pi
-
-        L, R = self.get_position(raw=True)
-        d = []
-        for i in range(0, len(R) - 1):
-            d.append(((R[i] - R[i + 1]) ** 2 + (L[i] - L[i + 1]) ** 2) ** 0.5)
-        d = np.median(np.asarray(d))
-        angles = []
-        for r, l in zip(R, L):
-            angles.append(calc_angle(r, l, d))
-        return angles
\ No newline at end of file
+            interp_speed = boxcar_smooth(interp_speed, smooth_size)
+
+        self.speed = interp_speed.astype(np.float32)
+        if head_direction:
+            return self.speed, self.get_angular_pos()
+        return self.speed
+
+    def get_angular_pos(self):
+        """
+        Calculate the head direction from the two LEDs.
+
+        The direction is the angle of the vector from the big LED to the
+        small LED, in degrees from 0 to 360 in camera coordinates.
+
+        To do:
+            * Check LEDs sides
+            * implement Axona's checks
+                no. pixels in big light = 18.35 +/- 8.48
+                no. pixels in small light = 10.96 +/- 5.92
+                1615 points swapped as 2-light confusions
+
+        Returns
+        -------
+        np.ndarray
+            The float32 head direction at each position sample.
+
+        """
+        if len(self.led_position) == 0:
+            self.calculate_position(raw=True)
+        (bxx, byy), (sxx, syy) = self.led_position
+
+        angles = np.degrees(np.arctan2(syy - byy, sxx - bxx)) % 360
+        angles = angles.astype(np.float32)
+        # Values just below 360 can round up in single precision
+        angles[angles >= 360] = 0
+        self.head_direction = angles
+        return self.head_direction
@@ -3,11 +3,115 @@ import numpy as np
 import os
 import datetime
 import re
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+from lib.data_lfp import read_set_file
+
 # Run the create dataframe and clean data function
 file = "../data_scheme_w.csv"
 
+# The columns and types of the cleaned dataframe, as written to parquet
+DATA_SCHEME = {
+    "filename": "string",
+    "folder": "string",
+    "duration": "float64",
+    "rat": "category",
+    "n_channels": "int64",
+    "sleep": "int64",
+    "maze": "category",
+    "habituation": "int64",
+    "treatment": "category",
+    "light": "float64",
+    "date_time": "datetime64[ns]",
+}
+
+_RAT_NAME_PARTS = "Su|Ca|LR|CS|CR|LS"
+_RAT_FROM_FILE = re.compile(r"(?:^|_)([^_]*(?:{})[^_]*)".format(_RAT_NAME_PARTS))
+_RAT_FROM_FOLDER = re.compile(r"(?:^|/)([^/]*(?:{})[^/]*)".format(_RAT_NAME_PARTS))
+
+
+def _token(*words, seps="_."):
+    """A regex matching any of words as a whole token, split on seps."""
+    alternatives = "|".join(re.escape(word) for word in words)
+    sep = "[" + re.escape(seps) + "]"
+    return re.compile(r"(?:^|{0})(?:{1})(?:{0}|$)".format(sep, alternatives))
+
+
+_FOLDER_SEPS = "_. /"
+
+# Ordered (condition, maze) from get_maze, conditions are and-ed tokens
+_MAZES_FROM_FILE = [
+    ([_token("smallsq")], "small_sq"),
+    ([_token("bigsq", "big")], "big_sq"),
+    ([_token("smallsqdownup"), _token("up")], "smallsqdownup_up"),
+    ([_token("smallsqdownup"), _token("down")], "smallsqdownup_down"),
+    ([_token("small sq")], "small_sq"),
+    ([_token("btm")], "btm"),
+    ([_token("noborders")], "noborders"),
+    ([_token("movespatcue", "spacue")], "movespatcue"),
+    ([_token("bigsq1wall")], "bigsq1wall"),
+    ([_token("maze"), _token("+", "t")], "tmaze"),
+    ([_token("+maze")], "tmaze"),
+    ([_token("mazedown")], "mazedown"),
+]
+
+# Ordered (condition, maze) from get_maze_from_folder
+_MAZES_FROM_FOLDER = [
+    (
+        [
+            _token(
+                "smallsq",
+                "small",
+                "smallsqrest",
+                "smallsw",
+                "smallaq",
+                seps=_FOLDER_SEPS,
+            )
+        ],
+        "small_sq",
+    ),
+    ([_token("bigsq", "big", seps=_FOLDER_SEPS)], "big_sq"),
+    (
+        [_token("smallsqdownup", seps=_FOLDER_SEPS), _token("up", seps=_FOLDER_SEPS)],
+        "smallsqdownup_up",
+    ),
+    (
+        [
+            _token("smallsqdownup", "smallsqdown", seps=_FOLDER_SEPS),
+            _token("down", seps=_FOLDER_SEPS),
+        ],
+        "smallsqdownup_down",
+    ),
+    ([_token("btm", seps=_FOLDER_SEPS)], "btm"),
+    ([_token("movespatcue", seps=_FOLDER_SEPS)], "movespatcue"),
+    ([_token("bigsq1wall", seps=_FOLDER_SEPS)], "bigsq1wall"),
+    ([_token("screening", "screen", seps=_FOLDER_SEPS)], "screening"),
+    ([_token("spat", "spatial", seps=_FOLDER_SEPS)], "spatial_cues"),
+    (
+        [_token("maze", seps=_FOLDER_SEPS), _token("+", "t", seps=_FOLDER_SEPS)],
+        "tmaze",
+    ),
+    ([_token("+maze", seps=_FOLDER_SEPS)], "tmaze"),
+    ([_token("wb", seps=_FOLDER_SEPS)], "wb_task"),
+    ([_token("donut", seps=_FOLDER_SEPS)], "donut"),
+    (
+        [_token("move", seps=_FOLDER_SEPS), _token("walls", seps=_FOLDER_SEPS)],
+        "move_walls",
+    ),
+    ([_token("smallsqresting", seps=_FOLDER_SEPS)], "small_sq"),
+    ([_token("one", seps=_FOLDER_SEPS)], "bigsq1wall"),
+    ([_token("two", seps=_FOLDER_SEPS)], "bigsq2walls"),
+    ([_token("sleep", "sleeps", seps=_FOLDER_SEPS)], "sleep"),
+]
+
+_SLEEP = _token("sleep")
+_SALINE = _token("saline")
+_MUSCIMOL = _token("muscimol", "musc")
+_SHAM = _token("sham")
+_LIGHT = _token("light")
+_DARK = _token("dark")
+
 
 def windows_folder(folder):
     """
@@ -18,50 +122,61 @@ def windows_folder(folder):
     return folder
 
 
-def create_dataframe(folder):
+def read_set_columns(set_file):
+    """
+    The time, duration and date columns of one .set file.
+
+    Returns
+    -------
+    tuple
+        (time, duration, date), None for any that are missing,
+        as for config files.
+
+    """
+    try:
+        set_header = read_set_file(set_file)
+    except OSError:
+        return None, None, None
+    return set_header["time"], set_header["duration"], set_header["date"]
+
+
+def create_dataframe(folder, num_workers=8):
     """
     Create a dataframe from set files found in folder
 
-    This function recursively scan folder for Axona .set files and return
-    a pandas dataframe with ['filename', 'folder', 'time', 'duration']
-    columns
+    This function recursively scan folder for Axona .set files and
+    reads the header of each in a thread pool, once.
 
     Parameters:
     folder (str): A folder containing the data
+    num_workers (int): The number of threads reading headers, 8 by default
 
     Returns:
-    dataframe: Pandas dataframe with all set files
+    dataframe: Pandas dataframe with ['filename', 'folder', 'time',
+        'duration', 'date'] columns for all set files
 
     """
+    print("Indexing files...")
     set_file = []
     root_folder = []
-    time = []
-    duration = []
-
-    try:
-        print("Load files ..")
-        df = pd.read_csv(file)
-    except:
-        print("Indexing files...")
-        for root, _, files in tqdm(os.walk(folder)):
-            for file in files:
-                if file.endswith(".set"):
-                    set_file.append(file)
-                    root_folder.append(root)
-                    with open(root + "/" + file) as f:
-                        f.readline()
-                        t = f.readline()[-9:-2]
-                        try:
-                            int(t[:2])
-                            time.append(t)
-                            f.readline()
-                            f.readline()
-                            duration.append(f.readline()[-11:-8])
-                        except:
-                            continue
-
-    df = pd.DataFrame([set_file, root_folder, time, duration]).T
-    df.columns = ["filename", "folder", "time", "duration"]
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.endswith(".set"):
+                set_file.append(name)
+                root_folder.append(root)
+
+    paths = [root + "/" + name for root, name in zip(root_folder, set_file)]
+    with ThreadPoolExecutor(num_workers) as executor:
+        headers = list(tqdm(executor.map(read_set_columns, paths), total=len(paths)))
+
+    df = pd.DataFrame(
+        headers,
+        columns=["time", "duration", "date"],
+        index=range(len(paths)),
+        dtype=object,
+    )
+    df.insert(0, "filename", set_file)
+    df.insert(1, "folder", root_folder)
     if os.name == "nt":
         df["folder"] = df["folder"].apply(windows_folder)
     print(f"Found {len(set_file)} set files")
@@ -367,12 +482,10 @@ def clean_setup_files(s):
 def get_date_from_files(fold, file):
     """Get date from the set file"""
     try:
-        with open(fold + "/" + file + ".set") as f:
-            date = f.readline()[-12:].strip()
-            return date
-
-    except:
+        date = read_set_file(fold + "/" + file + ".set")["date"]
+    except OSError:
         return np.nan
+    return np.nan if date is None else date
 
 
 def get_missing_dates(s):
@@ -396,70 +509,150 @@ def update_maze(s):
         return "lesion"
 
 
-def clean_data(df):
+def _has(strings, pattern):
+    return strings.str.contains(pattern, na=False).to_numpy()
+
+
+def _first_match(strings, ordered):
+    """The value of the first (patterns, value) with every pattern in strings."""
+    # Each distinct string is matched once, as every file in a folder shares it
+    codes, uniques = pd.factorize(strings)
+    uniques = pd.Series(uniques, dtype=object)
+    conditions = [
+        np.logical_and.reduce([_has(uniques, pattern) for pattern in patterns])
+        for patterns, _ in ordered
+    ]
+    values = [value for _, value in ordered]
+    matched = np.append(np.select(conditions, values, None), None)
+    return pd.Series(matched[codes], index=strings.index)
+
+
+def decode_treatment_from_name(rat):
     """
-    Sequency of cleaning dataframe
+    "Control" or "lesion" from a rat name, as update_maze(decode_name(rat)).
 
-    Parameters:
-    df (pandas dataframe): Dataframe with all data
-    Returns:
-    dataframe: Cleaned dataframe
+    Names are Control if CC, CR or CS is left after removing a leading
+    "Can", every "Ca" and every "L", otherwise lesion if they had an "L".
 
     """
-    print("Cleaning files..")
-    df["recording_name"] = df.filename.apply(lambda x: x[:-4])
+    without_ca = rat.str.replace(r"^Can", "", regex=True).str.replace(
+        "Ca", "", regex=False
+    )
+    lesion = _has(without_ca, "L")
+    control = _has(without_ca.str.replace("L", "", regex=False), "CC|CR|CS")
+    return pd.Series(
+        np.select([control, lesion], ["Control", "lesion"], None), index=rat.index
+    )
+
+
+def decode_recordings(df, folder_column="folder"):
+    """
+    Decode what each recording is of from its file and folder names.
+
+    Each column is decoded with a vectorised string operation over
+    precompiled patterns, giving the same values as the get_* functions.
+    Config and setup files are dropped.
+    Dates missing from the date column are taken from the filename,
+    and if there is no date column they are read from the .set files.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The filename, folder, duration and time of each .set file.
+    folder_column : str, optional
+        The column holding the folder of each file, "folder" by default.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A copy of df with the rat, n_channels, sleep, maze, habituation,
+        treatment, light and date_time columns added.
+
+    """
+    df = df.copy()
+    filename = df["filename"].astype(str)
+    folder = df[folder_column].astype(str)
+    recording_name = filename.str[:-4]
+    lower_name = filename.str.lower()
+    lower_folder = folder.str.lower()
+
     # Rat name
-    df["rat"] = df.recording_name.apply(get_rat_name)
-    df["name_folder"] = df.folder.apply(get_rat_name_folder)
-    df["rat"] = df["rat"].combine_first(df["name_folder"])
-    df.drop("name_folder", axis=1, inplace=True)
-    # number of channels
-    df["n_channels"] = df.filename.apply(n_channels)
+    rat = recording_name.str.extract(_RAT_FROM_FILE, expand=False)
+    df["rat"] = rat.combine_first(folder.str.extract(_RAT_FROM_FOLDER, expand=False))
+    # number of channels, the filename is lower case before checking for C64
+    df["n_channels"] = 32
     # sleep experiment
-    df["sleep"] = df.filename.apply(get_sleep_awake)
-    df["sleep_folder"] = df.filename.apply(get_sleep_awake_folder)
-    df["sleep"] = df["sleep"].combine_first(df["sleep_folder"])
-    df.drop("sleep_folder", axis=1, inplace=True)
+    df["sleep"] = _has(lower_name, _SLEEP).astype(np.int64)
     # get mazes
-    df["maze"] = df.filename.apply(get_maze)
-    df["maze_folder"] = df.folder.apply(get_maze_from_folder)
-    df["maze"] = df["maze"].combine_first(df["maze_folder"])
-    df.drop("maze_folder", axis=1, inplace=True)
+    maze = _first_match(lower_name, _MAZES_FROM_FILE)
+    df["maze"] = maze.combine_first(_first_match(lower_folder, _MAZES_FROM_FOLDER))
     # get habituation
-    df["habituation"] = df.filename.apply(get_habituation)
-    df["habituation_folder"] = df.filename.apply(get_habituation_folder)
-    df["habituation"] = df["habituation"].combine_first(df["habituation_folder"])
-    df.drop("habituation_folder", axis=1, inplace=True)
+    df["habituation"] = _has(lower_name, "hab").astype(np.int64)
     # Get treatment
-    df["treatment"] = df.filename.apply(get_treatment)
-    df["treatment_folder"] = df.filename.apply(get_treatment_folder)
-    df["treatment"] = df["treatment"].combine_first(df["treatment_folder"])
-    df.drop("treatment_folder", axis=1, inplace=True)
-    # Get duration
-    df["duration"] = df.duration.apply(clean_config_files)
-    df.dropna(subset=["duration"], inplace=True)
+    treatment = np.select(
+        [
+            _has(lower_name, _SALINE),
+            _has(lower_name, _MUSCIMOL),
+            _has(lower_name, _SHAM),
+        ],
+        ["control", "muscimol", "control"],
+        None,
+    )
+    df["treatment"] = pd.Series(treatment, index=df.index).combine_first(
+        decode_treatment_from_name(df["rat"].astype(object).fillna(""))
+    )
+    # Get duration, config files have no integer duration
+    duration = df["duration"].astype(object).where(df["duration"].notna(), "")
+    is_int = duration.astype(str).str.fullmatch(r"\s*[+-]?\d+\s*")
+    df["duration"] = pd.to_numeric(duration.where(is_int), errors="coerce")
     # light or dark
-    df["light"] = df.filename.apply(get_light_dark)
-    df["light"] = df["light"].fillna(11)
-    # Cleaning
-    df["folder"] = df.folder.apply(clean_setup_files)
-    df.dropna(subset=["folder"], inplace=True)
+    df["light"] = np.select(
+        [_has(lower_name, _LIGHT), _has(lower_name, _DARK)], [1.0, 0.0], 11.0
+    )
+    # Cleaning, drop config and setup files
+    df = df.loc[df["duration"].notna() & ~_has(folder, "setup")].copy()
     # Combine datetime
-    # Dates from file
-    fold_file = df[["folder", "recording_name"]].values
-    df["date"] = [get_date_from_files(fold, file) for fold, file in fold_file]
-    df.loc[df.date.isnull(), "date"] = df.loc[df.date.isnull(), "recording_name"].apply(
-        get_missing_dates
+    # Dates from file, then from the filename
+    if "date" not in df.columns:
+        fold_file = df[[folder_column, "filename"]].values
+        df["date"] = [get_date_from_files(fold, f[:-4]) for fold, f in fold_file]
+    date = df["date"].astype(object).combine_first(recording_name.str.split("_").str[0])
+    df["date_time"] = pd.to_datetime(
+        date + " " + df["time"].astype(object),
+        format="%d %b %Y %H:%M:%S",
+        errors="coerce",
     )
-    df["date_time"] = df["date"] + " " + df["time"]
-    df["date_time"] = df["date_time"].apply(convert_datetime)
-    df.drop(["date", "time"], inplace=True, axis=1)
-    df["name_dec"] = df.rat.apply(decode_name)
-    df.drop("recording_name", axis=1, inplace=True)
-    df.loc[df.treatment.isnull(), "treatment"] = df.loc[
-        df.treatment.isnull()
-    ].name_dec.apply(update_maze)
-    df.drop("name_dec", axis=1, inplace=True)
-    df.to_csv(file, index=False)
+    return df
+
+
+def clean_data(df, output_path=None):
+    """
+    Sequency of cleaning dataframe
+
+    The columns are decoded from the file and folder names by
+    decode_recordings.
+    The result is written to output_path as csv, with a typed parquet
+    copy (categorical rat, maze and treatment) next to it.
+
+    Parameters:
+    df (pandas dataframe): Dataframe from create_dataframe. If it has
+        no date column, dates are read from the .set files.
+    output_path (str): The csv to write, data_scheme_w.csv by default
+    Returns:
+    dataframe: Cleaned dataframe, with the columns of DATA_SCHEME
+
+    """
+    print("Cleaning files..")
+    if output_path is None:
+        output_path = file
+    df = decode_recordings(df, "folder")
+    df = df[list(DATA_SCHEME)].astype(DATA_SCHEME).reset_index(drop=True)
+
+    df.to_csv(output_path, index=False)
+    parquet_path = os.path.splitext(output_path)[0] + ".parquet"
+    try:
+        df.to_parquet(parquet_path, index=False)
+    except ImportError:
+        print("WARNING: Install pyarrow to write {}".format(parquet_path))
 
     return df
@@ -0,0 +1,108 @@
+import sys
+
+sys.path.insert(0, "..")
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from lfp_atn_simuran.Scripts.cell_list_runner import (
+    group_cell_list,
+    merge_results,
+    results_file,
+    run_cell_list,
+)
+
+analysed = []
+
+
+def count_cells(recording, *args, **kwargs):
+    """Give each cell the number of times its recording was analysed."""
+    analysed.append(recording.source_file)
+    if recording.source_file.endswith("2.set"):
+        raise OSError("Can't read the data")
+    return {"3_1": [analysed.count(recording.source_file)]}
+
+
+def broken_analysis(recording, *args, **kwargs):
+    raise TypeError("A bug in the analysis")
+
+
+def main():
+    df = pd.DataFrame(
+        {
+            "Directory": ["a", "b", "a", "a", "b"],
+            "Filename": ["1.set", "2.set", "1.set", "1.set", "2.set"],
+            "Mapping": ["CL-SR_1-3.py"] * 5,
+            "Group": [3, 3, 3, 6, 3],
+            "Unit": [1, 2, 5, 5, 4],
+        }
+    )
+    recordings = group_cell_list(df)
+    key_a = ("a", "1.set", "CL-SR_1-3.py")
+    key_b = ("b", "2.set", "CL-SR_1-3.py")
+    assert list(recordings.keys()) == [key_a, key_b]
+    assert recordings[key_a] == {"3": [1, 5], "6": [5]}
+    assert recordings[key_b] == {"3": [2, 4]}
+
+    # Outputs arrive in any order from the workers, a failed cell is missing
+    outputs = {
+        key_b: {"3_2": [2, "b"], "3_4": [4, "d"]},
+        key_a: {"3_1": [1, "a"], "6_5": [6, "c"]},
+    }
+    info = merge_results(df, outputs, ["Value", "Name"])
+    assert list(info.columns) == list(df.columns) + ["Value", "Name"]
+    assert info["Value"].tolist()[:2] == [1, 2]
+    assert np.isnan(info["Value"][2])
+    assert info["Name"].tolist()[3:] == ["c", "d"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cell_list_path = os.path.join(tmp, "cells.csv")
+        df.drop(columns="Mapping").to_csv(cell_list_path, index=False)
+        params = {
+            "cell_list_path": cell_list_path,
+            "function_to_run": count_cells,
+            "fn_args": [],
+            "fn_kwargs": {},
+            "headers": ["Count"],
+            "out_dir": os.path.join(tmp, "out"),
+        }
+
+        # Unreadable recordings give NaN results
+        info = run_cell_list(params, {}, save=True)
+        assert info["Count"].tolist()[0] == 1 and info["Count"].isnull().sum() == 4
+        assert os.path.isfile(results_file(params))
+
+        # Saved results are reused unless overwriting
+        info = run_cell_list(params, {}, overwrite=False, save=True)
+        assert info["Count"][0] == 1 and len(analysed) == 2
+        # Only when saving
+        info = run_cell_list(params, {}, overwrite=False)
+        assert info["Count"][0] == 2 and len(analysed) == 4
+        # And not after the arguments change
+        info = run_cell_list(params, {"fmin": 2}, overwrite=False, save=True)
+        assert info["Count"][0] == 3 and len(analysed) == 6
+        # Or the units of a recording change
+        more_units = df.drop(columns="Mapping")
+        more_units.loc[len(more_units)] = ["a", "1.set", 3, 7]
+        more_units.to_csv(cell_list_path, index=False)
+        info = run_cell_list(params, {}, overwrite=False, save=True)
+        assert info["Count"][0] == 4 and len(analysed) == 7
+        info = run_cell_list(params, {}, overwrite=True, save=True)
+        assert info["Count"][0] == 5 and len(analysed) == 9
+
+        # Errors in the analysis itself are raised
+        params["function_to_run"] = broken_analysis
+        try:
+            run_cell_list(params, {})
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("Analysis errors should not be hidden")
+
+    print("Cell list grouping and merging passed")
+
+
+if __name__ == "__main__":
+    main()
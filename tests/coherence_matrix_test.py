@@ -0,0 +1,56 @@
+import sys
+
+sys.path.insert(0, "..")
+from itertools import combinations
+from time import perf_counter
+
+import numpy as np
+from scipy.signal import coherence
+
+from lfp_atn_simuran.Scripts.spectral_store import SpectralStore
+
+
+def main(duration_mins=20, fs=250, num_regions=6):
+    rng = np.random.default_rng(0)
+    time = np.arange(int(duration_mins * 60 * fs)) / fs
+    theta = np.sin(2 * np.pi * 8 * time)
+    regions = [f"R{i}" for i in range(num_regions)]
+    samples = {
+        region: 100 * np.roll(theta, 3 * i) + rng.normal(0, 50 * (i + 1), time.size)
+        for i, region in enumerate(regions)
+    }
+
+    t0 = perf_counter()
+    old = [
+        coherence(samples[r1], samples[r2], fs, nperseg=2 * fs)[1]
+        for r1, r2 in combinations(regions, 2)
+    ]
+    t_old = perf_counter() - t0
+
+    t0 = perf_counter()
+    store = SpectralStore()
+    for region in regions:
+        store.add(region, samples[region], fs)
+    f, pairs, Cxy = store.coherence_matrix(2 * fs)
+    t_new = perf_counter() - t0
+
+    assert pairs == list(combinations(regions, 2))
+    assert Cxy.dtype == np.float32
+    assert Cxy.shape == (f.size, len(pairs))
+    for i, old_Cxy in enumerate(old):
+        assert np.allclose(Cxy[:, i], old_Cxy, rtol=1e-5, atol=1e-7)
+    assert np.allclose(
+        Cxy[:, 0], store.coherence(*pairs[0], 2 * fs)[1], rtol=1e-5, atol=1e-7
+    )
+    # One FFT pass per region, not per pair
+    assert len(store._spectra) == num_regions
+
+    print(
+        "{} pairs: scipy {:.3f}s, coherence matrix {:.3f}s".format(
+            len(pairs), t_old, t_new
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import tempfile
+from itertools import product
+from time import perf_counter
+
+sys.path.insert(0, "..")
+import numpy as np
+import pandas as pd
+
+import lib.utils as utils
+from synthetic_axona import write_set_file
+
+
+def legacy_clean_data(df):
+    """clean_data as it was, with a .apply of each get_* function per row."""
+    df = df.copy()
+    df["recording_name"] = df.filename.apply(lambda x: x[:-4])
+    df["rat"] = df.recording_name.apply(utils.get_rat_name)
+    df["rat"] = df["rat"].combine_first(df.folder.apply(utils.get_rat_name_folder))
+    df["n_channels"] = df.filename.apply(utils.n_channels)
+    df["sleep"] = df.filename.apply(utils.get_sleep_awake)
+    df["maze"] = df.filename.apply(utils.get_maze)
+    df["maze"] = df["maze"].combine_first(df.folder.apply(utils.get_maze_from_folder))
+    df["habituation"] = df.filename.apply(utils.get_habituation)
+    df["treatment"] = df.filename.apply(utils.get_treatment)
+    df["treatment"] = df["treatment"].combine_first(
+        df.filename.apply(utils.get_treatment_folder)
+    )
+    df["duration"] = df.duration.apply(utils.clean_config_files)
+    df.dropna(subset=["duration"], inplace=True)
+    df["light"] = df.filename.apply(utils.get_light_dark).fillna(11)
+    df["folder"] = df.folder.apply(utils.clean_setup_files)
+    df.dropna(subset=["folder"], inplace=True)
+    fold_file = df[["folder", "recording_name"]].values
+    df["date"] = [utils.get_date_from_files(fold, f) for fold, f in fold_file]
+    df.loc[df.date.isnull(), "date"] = df.loc[df.date.isnull(), "recording_name"].apply(
+        utils.get_missing_dates
+    )
+    df["date_time"] = (df["date"] + " " + df["time"]).apply(utils.convert_datetime)
+    # decode_name raises on recordings without a rat name
+    to_decode = df.treatment.isnull() & df.rat.notnull()
+    name_dec = df.loc[to_decode, "rat"].apply(utils.decode_name)
+    df.loc[to_decode, "treatment"] = name_dec.apply(utils.update_maze)
+    return df[list(utils.DATA_SCHEME)].reset_index(drop=True)
+
+
+def make_names():
+    rats = ["CSubRet1", "LSR2", "CanCSR3", "CaR1", "Sub2", "Rat7"]
+    parts = [
+        "smallsq",
+        "bigsq",
+        "smallsqdownup_up",
+        "btm",
+        "spacue",
+        "t_maze",
+        "+_maze",
+        "hab1",
+        "sleep",
+        "saline",
+        "musc",
+        "sham",
+        "light",
+        "dark",
+        "rest",
+    ]
+    folders = [
+        "{}/small sq/02102018",
+        "{}/t-maze/t maze",
+        "{}/screening",
+        "{}/setup",
+        "other/two walls/{}",
+        "other/donut",
+        "other/smallsqdown down",
+    ]
+    names = []
+    for rat, part, folder in product(rats, parts, folders):
+        names.append((folder.format(rat), "02102018_{}_{}_1.set".format(rat, part)))
+    return names
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (folder, filename) in enumerate(make_names()):
+            os.makedirs(os.path.join(tmp, folder), exist_ok=True)
+            set_file = os.path.join(tmp, folder, filename)
+            write_set_file(set_file)
+            if i % 7 == 0:
+                # Config files without a duration
+                with open(set_file, "w") as f:
+                    f.write("trial_date\r\ntrial_time\r\nduration\r\n")
+
+        t0 = perf_counter()
+        raw = utils.create_dataframe(tmp, num_workers=4)
+        t_create = perf_counter() - t0
+
+        t0 = perf_counter()
+        output_path = os.path.join(tmp, "data_scheme_w.csv")
+        df = utils.clean_data(raw, output_path)
+        t_new = perf_counter() - t0
+
+        t0 = perf_counter()
+        old = legacy_clean_data(raw.drop(columns="date"))
+        t_old = perf_counter() - t0
+
+        assert len(df) == len(old) > 0
+        assert list(df.columns) == list(utils.DATA_SCHEME)
+        for column in ["rat", "maze", "treatment", "folder", "filename"]:
+            new_col = df[column].astype(object).where(df[column].notna(), None)
+            old_col = old[column].astype(object).where(old[column].notna(), None)
+            mismatch = new_col.values != old_col.values
+            assert not mismatch.any(), (column, df[mismatch], old[mismatch][column])
+        for column in ["n_channels", "sleep", "habituation", "light", "duration"]:
+            assert np.array_equal(df[column].values, old[column].astype(float).values)
+        assert (df["date_time"] == pd.to_datetime(old["date_time"])).all()
+
+        # Without the dates of create_dataframe they are read from the .set files
+        again = utils.clean_data(raw.drop(columns="date"), output_path)
+        pd.testing.assert_frame_equal(again, df)
+
+        written = pd.read_csv(output_path)
+        assert list(written.columns) == list(utils.DATA_SCHEME)
+        assert len(written) == len(df)
+        parquet_path = os.path.splitext(output_path)[0] + ".parquet"
+        if os.path.exists(parquet_path):
+            typed = pd.read_parquet(parquet_path)
+            assert isinstance(typed["maze"].dtype, pd.CategoricalDtype)
+            pd.testing.assert_frame_equal(typed, df, check_categorical=False)
+
+    print(
+        "{} files: create_dataframe {:.3f}s, clean_data {:.3f}s, "
+        "legacy clean_data {:.3f}s".format(len(raw), t_create, t_new, t_old)
+    )
+
+
+if __name__ == "__main__":
+    main()
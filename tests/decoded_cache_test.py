@@ -0,0 +1,78 @@
+import sys
+
+sys.path.insert(0, "..")
+import os
+import tempfile
+from timeit import timeit
+
+import numpy as np
+
+from lib.data_lfp import load_lfp_Axona
+from lfp_atn_simuran.Scripts.decoded_cache import DecodedCache
+from synthetic_axona import write_set_file, write_lfp_file, random_lfp
+from lfp_load_test import legacy_load_lfp_Axona
+
+
+def cached_load(cache, fname):
+    set_file = os.path.splitext(fname)[0] + ".set"
+    key = cache.make_key("signal", [fname, set_file])
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["samples"]
+    samples = load_lfp_Axona(fname)
+    cache.put(key, {"samples": samples}, {"sampling_rate": 250})
+    return samples
+
+
+def main(duration_hours=1.0, number=3):
+    with tempfile.TemporaryDirectory() as dirname:
+        write_set_file(os.path.join(dirname, "synthetic.set"), num_eeg=2)
+        num_samples = int(duration_hours * 3600 * 250)
+        fnames = []
+        for i, ext in enumerate((".eeg", ".eeg2")):
+            fname = os.path.join(dirname, "synthetic" + ext)
+            write_lfp_file(fname, random_lfp(num_samples, seed=i))
+            fnames.append(fname)
+
+        cache_dir = os.path.join(dirname, "cache")
+        cache = DecodedCache(cache_dir)
+        first = cached_load(cache, fnames[0])
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert np.array_equal(cached_load(cache, fnames[0]), first)
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # A new process finds the entries on disk
+        cache = DecodedCache(cache_dir)
+        assert np.array_equal(cached_load(cache, fnames[0]), first)
+        assert cache.hits == 1
+
+        # Changing the file contents is a miss
+        write_lfp_file(fnames[0], random_lfp(num_samples, seed=5))
+        changed = cached_load(cache, fnames[0])
+        assert cache.misses == 1 and not np.array_equal(changed, first)
+
+        # Only room for one entry, so the least recently used is evicted
+        one_entry = cache.entries()
+        one_entry = max(e["size"] for e in one_entry.values()) / (1024**3)
+        small = DecodedCache(os.path.join(dirname, "small"), 1.5 * one_entry)
+        cached_load(small, fnames[0])
+        cached_load(small, fnames[1])
+        cached_load(small, fnames[0])
+        assert (small.hits, small.misses) == (0, 3)
+        assert len(small.entries()) == 1
+
+        # NeuroChaT decodes Axona files byte by byte like the legacy loader
+        t_decode = timeit(lambda: legacy_load_lfp_Axona(fnames[0]), number=number)
+        # Cached arrays are memory mapped, so read every sample
+        t_cached = timeit(lambda: cached_load(cache, fnames[0]).sum(), number=number)
+        assert t_cached < t_decode
+        print(
+            "{} samples: decode {:.3f}s, cached {:.3f}s".format(
+                num_samples, t_decode / number, t_cached / number
+            )
+        )
+        print(cache.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import sys
+
+sys.path.insert(0, "..")
+from time import perf_counter
+
+import numpy as np
+from scipy.signal import welch, coherence
+from scipy.integrate import simpson
+
+from lfp_atn_simuran.Scripts.epoch_spectra import EpochSpectra
+
+
+def legacy_relative_power(samples, fs, band, window_sec, total_band=(1.5, 90)):
+    """NLfp.bandpower(band_total=True)["relative_power"] from NeuroChaT."""
+    freqs, psd = welch(samples, fs, nperseg=int(window_sec * fs))
+    freq_res = freqs[1] - freqs[0]
+    idx_band = np.logical_and(freqs >= band[0], freqs <= band[1])
+    bp = simpson(psd[idx_band], dx=freq_res)
+    idx_band = np.logical_and(freqs >= total_band[0], freqs <= total_band[1])
+    tp = simpson(psd[idx_band], dx=freq_res)
+    return bp / tp
+
+
+def legacy_epochs(sub, rsc, fs, epochs, bands, window_sec=0.5):
+    """The per part loop of t_maze_analyse, one epoch at a time."""
+    powers, cohs, psds = [], [], []
+    for start, end in epochs:
+        x, y = sub[start:end], rsc[start:end]
+        powers.append(
+            [
+                [legacy_relative_power(s, fs, band, window_sec) for band in bands]
+                for s in (x, y)
+            ]
+        )
+        cohs.append(coherence(x, y, fs, nperseg=window_sec * 250, nfft=256)[1])
+        psds.append(welch(x, fs=fs, nperseg=window_sec * 250)[1])
+    return np.array(powers), np.array(cohs), np.array(psds)
+
+
+def main(num_trials=40, fs=250):
+    rng = np.random.default_rng(0)
+    time = np.arange(int(num_trials * 40 * fs)) / fs
+    theta = np.sin(2 * np.pi * 8 * time)
+    sub = 0.1 * theta + rng.normal(0, 0.05, size=time.size)
+    rsc = 0.08 * np.roll(theta, 5) + rng.normal(0, 0.05, size=time.size)
+    bands = [(1.5, 4), (6, 10)]
+
+    # Start, choice and end parts of ragged length for each trial
+    epochs = []
+    for i in range(num_trials):
+        t = i * 40 * fs
+        choice = t + rng.integers(5, 25) * fs
+        end = choice + rng.integers(2, 12) * fs
+        epochs += [(t, choice), (choice - 875, choice + 125), (choice + 125, end)]
+
+    t0 = perf_counter()
+    old_powers, old_coh, old_psd = legacy_epochs(sub, rsc, fs, epochs, bands)
+    t_old = perf_counter() - t0
+
+    t0 = perf_counter()
+    starts, stops = np.array(epochs).T
+    spectra = EpochSpectra(np.stack([sub, rsc]), fs, starts, stops, ["SUB", "RSC"])
+    powers = spectra.relative_power(bands, 125)
+    f, coh = spectra.coherence("SUB", "RSC", 125, nfft=256)
+    _, psd = spectra.psd(125)
+    t_new = perf_counter() - t0
+
+    assert coh.dtype == np.float32 and psd.dtype == np.float32
+    assert coh.shape == (len(epochs), f.size)
+    assert np.allclose(powers.transpose(1, 0, 2), old_powers, rtol=1e-4)
+    assert np.allclose(coh, old_coh, rtol=1e-3, atol=1e-5)
+    assert np.allclose(psd[0], old_psd, rtol=1e-3, atol=1e-10)
+
+    # Epochs shorter than a segment cannot be analysed
+    try:
+        EpochSpectra(sub, fs, [0], [100]).psd(125)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Short epochs should raise a ValueError")
+
+    print(
+        "{} epochs: per epoch {:.3f}s, batched {:.3f}s ({:.0f}x)".format(
+            len(epochs), t_old, t_new, t_old / t_new
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import sys
+
+sys.path.insert(0, "..")
+from timeit import timeit
+
+import numpy as np
+import astropy.units as u
+import simuran
+from mne.filter import filter_data
+
+from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+
+
+def legacy_filter_sigs(signals, min_f, max_f, **filter_kwargs):
+    """Filter each signal on its own, as signal.filter did."""
+    filtered = []
+    for signal in signals:
+        samples = np.asarray(signal.samples.value, dtype=np.float64)
+        filtered.append(
+            filter_data(
+                samples, float(signal.sampling_rate), min_f, max_f, **filter_kwargs
+            )
+        )
+    return filtered
+
+
+def make_signals(num_chans, duration_mins, sampling_rates=(250,), seed=0):
+    rng = np.random.default_rng(seed)
+    signals = simuran.EegArray()
+    for i in range(num_chans):
+        sampling_rate = sampling_rates[i % len(sampling_rates)]
+        samples = rng.normal(0, 0.1, size=int(duration_mins * 60 * sampling_rate))
+        eeg = simuran.Eeg()
+        eeg.from_numpy(samples * u.mV, sampling_rate=sampling_rate)
+        eeg.set_region("SUB" if i % 2 else "RSC")
+        eeg.set_channel(i + 1)
+        signals.append(eeg)
+    return signals
+
+
+def main(num_chans=32, duration_mins=10, number=1):
+    lc = LFPClean()
+    kwargs = {"verbose": "WARNING"}
+
+    for sampling_rates in ((250,), (250, 500)):
+        signals = make_signals(num_chans, duration_mins, sampling_rates)
+        originals = [s.samples.copy() for s in signals]
+        old = legacy_filter_sigs(signals, 1.5, 100, **kwargs)
+
+        new = lc.filter_sigs(signals, 1.5, 100, **kwargs)
+        assert len(new) == len(signals)
+        for signal, filt, expected, original in zip(signals, new, old, originals):
+            assert filt.samples.unit == u.mV
+            assert np.allclose(filt.samples.value, expected, atol=1e-12)
+            assert filt.sampling_rate == signal.sampling_rate
+            assert (filt.region, filt.channel) == (signal.region, signal.channel)
+            # Not inplace, so the input is untouched
+            assert np.array_equal(signal.samples, original)
+
+        lc.filter_sigs(signals, 1.5, 100, inplace=True, **kwargs)
+        for signal, expected in zip(signals, old):
+            assert signal.samples.unit == u.mV
+            assert np.allclose(signal.samples.value, expected, atol=1e-12)
+
+    signals = make_signals(num_chans, duration_mins)
+    t_old = timeit(
+        lambda: legacy_filter_sigs(signals, 1.5, 100, **kwargs), number=number
+    )
+    t_new = timeit(lambda: lc.filter_sigs(signals, 1.5, 100, **kwargs), number=number)
+    print(
+        "filter {} x {} mins: per signal {:.3f}s, batched {:.3f}s".format(
+            num_chans, duration_mins, t_old / number, t_new / number
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
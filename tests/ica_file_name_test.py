@@ -0,0 +1,94 @@
+import sys
+
+sys.path.insert(0, "..")
+import os
+import tempfile
+
+import numpy as np
+import mne
+
+from lfp_atn_simuran.Scripts import decoded_cache, lfp_clean
+from lfp_atn_simuran.Scripts.decoded_cache import load_signals
+from lfp_atn_simuran.Scripts.lfp_clean import ica_file_name, ica_fit_kwargs
+from lfp_clean_cache_test import file_signals, write_recording
+
+
+def to_mne(signals, highpass=0.0):
+    """A RawArray of signals, as convert_signals_to_mne makes for ICA."""
+    info = mne.create_info(
+        ["{}-{}".format(s.region, s.channel) for s in signals], 250.0, "eeg"
+    )
+    data = np.array([s.samples.value for s in signals]) / 1000
+    mne_array = mne.io.RawArray(data, info, verbose=False)
+    # Newer mne only allows setting the highpass of an unlocked info
+    if hasattr(mne_array.info, "_unlock"):
+        with mne_array.info._unlock():
+            mne_array.info["highpass"] = highpass
+    else:
+        mne_array.info["highpass"] = highpass
+    return mne_array
+
+
+def main():
+    with tempfile.TemporaryDirectory() as dirname:
+        os.environ["LFP_ATN_CACHE_DIR"] = os.path.join(dirname, "cache")
+        os.environ["LFP_ATN_CACHE_SIZE_GB"] = "1"
+        set_file = write_recording(dirname)
+        signals = load_signals(file_signals(set_file))
+        mne_array = to_mne(signals)
+
+        def name(signals=signals, mne_array=mne_array, fit_kwargs=None, **kwargs):
+            return ica_file_name(
+                signals, mne_array, "synthetic", fit_kwargs=fit_kwargs, **kwargs
+            )
+
+        base = name()
+        assert os.path.basename(base).startswith("synthetic--")
+        assert base.endswith("-auto-ica.fif.gz")
+
+        # Stable for the same signals and setup
+        assert name(signals=load_signals(file_signals(set_file))) == base
+        assert name(mne_array=to_mne(signals)) == base
+        assert name(fit_kwargs={}) == base
+        assert ica_file_name(signals, mne_array, "synthetic.set") == base
+        # With or without the decoded cache the content hash is the same
+        os.environ["LFP_ATN_CACHE_SIZE_GB"] = "0"
+        assert name() == base
+        os.environ["LFP_ATN_CACHE_SIZE_GB"] = "1"
+
+        # Any change to how the ICA is fit changes the name
+        changed = [
+            name(mne_array=to_mne(signals, highpass=1.5)),
+            name(signals=signals[:6], mne_array=to_mne(signals[:6])),
+            name(manual=True),
+        ]
+        for key, value in (("decim", 4), ("start", 10.0), ("stop", 50.0)):
+            fit_kwargs = ica_fit_kwargs({"ica_" + key: value})
+            assert fit_kwargs == {key: value}
+            changed.append(name(fit_kwargs=fit_kwargs))
+
+        random_state = lfp_clean.ICA_PARAMS["random_state"]
+        try:
+            lfp_clean.ICA_PARAMS["random_state"] = random_state + 1
+            changed.append(name())
+        finally:
+            lfp_clean.ICA_PARAMS["random_state"] = random_state
+        assert name() == base
+
+        # So does a change to the source files
+        fname = signals[0].source_file
+        with open(fname, "r+b") as f:
+            f.seek(-20, os.SEEK_END)
+            f.write(b"\x01")
+        changed.append(name())
+
+        names = [base] + changed
+        assert len(set(names)) == len(names)
+        print("{} distinct ICA file names".format(len(names)))
+
+    # The shared cache was in dirname, so do not report on it at exit
+    decoded_cache._default_cache = None
+
+
+if __name__ == "__main__":
+    main()
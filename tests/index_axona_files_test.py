@@ -0,0 +1,179 @@
+import os
+import sys
+import tempfile
+from itertools import product
+from time import perf_counter
+
+sys.path.insert(0, "..")
+import numpy as np
+import pandas as pd
+
+import lfp_atn_simuran.index_axona_files as iaf
+from synthetic_axona import write_set_file
+
+
+def legacy_clean_data(df):
+    """clean_data as it was, with a .apply of each get_* function per row."""
+    df = df.copy()
+    df["recording_name"] = df.filename.apply(lambda x: x[:-4])
+    df["rat"] = df.recording_name.apply(iaf.get_rat_name)
+    df["rat"] = df["rat"].combine_first(df.directory.apply(iaf.get_rat_name_folder))
+    df["n_channels"] = df.filename.apply(iaf.n_channels)
+    df["sleep"] = df.filename.apply(iaf.get_sleep_awake)
+    df["maze"] = df.filename.apply(iaf.get_maze)
+    df["maze"] = df["maze"].combine_first(df.directory.apply(iaf.get_maze_from_folder))
+    df["habituation"] = df.filename.apply(iaf.get_habituation)
+    df["treatment"] = df.filename.apply(iaf.get_treatment)
+    df["treatment"] = df["treatment"].combine_first(
+        df.filename.apply(iaf.get_treatment_folder)
+    )
+    df["duration"] = df.duration.apply(iaf.clean_config_files)
+    df.dropna(subset=["duration"], inplace=True)
+    df["light"] = df.filename.apply(iaf.get_light_dark).fillna(11)
+    df["directory"] = df.directory.apply(iaf.clean_setup_files)
+    df.dropna(subset=["directory"], inplace=True)
+    df["date"] = df["date"].combine_first(
+        df.recording_name.apply(iaf.get_missing_dates)
+    )
+    df["date_time"] = (df["date"] + " " + df["time"]).apply(iaf.convert_datetime)
+    # decode_name raises on recordings without a rat name
+    to_decode = df.treatment.isnull() & df.rat.notnull()
+    name_dec = df.loc[to_decode, "rat"].apply(iaf.decode_name)
+    df.loc[to_decode, "treatment"] = name_dec.apply(iaf.update_maze)
+    df["mapping"] = df.rat.apply(iaf.animal_to_mapping)
+    return df.reset_index(drop=True)
+
+
+def make_names():
+    rats = ["CSubRet1", "LSR2", "CanCSR3", "CaR1", "CSR6", "LR4", "Sub2", "Rat7"]
+    parts = [
+        "smallsq",
+        "bigsq",
+        "big",
+        "smallsqdownup_up",
+        "smallsqdownup_down",
+        "btm",
+        "noborders",
+        "spacue",
+        "bigsq1wall",
+        "t_maze",
+        "+_maze",
+        "mazedown",
+        "screen",
+        "hab1",
+        "sleep",
+        "saline",
+        "musc",
+        "sham",
+        "light",
+        "dark",
+        "rest",
+    ]
+    folders = [
+        "{}/small sq/02102018",
+        "{}/big_sq/day1",
+        "{}/t-maze/t maze",
+        "{}/screening",
+        "{}/sleep/one wall",
+        "{}/setup",
+        "other/two walls/{}",
+        "other/donut",
+        "other/move walls",
+        "other/smallsqdown down",
+    ]
+    names = []
+    for rat, part, folder in product(rats, parts, folders):
+        filename = "02102018_{}_{}_1.set".format(rat, part)
+        names.append((folder.format(rat), filename))
+    return names
+
+
+def main():
+    names = make_names()
+    with tempfile.TemporaryDirectory() as tmp:
+        base = tmp.replace("\\", "/")
+        for i, (folder, filename) in enumerate(names):
+            os.makedirs(os.path.join(tmp, folder), exist_ok=True)
+            set_file = os.path.join(tmp, folder, filename)
+            write_set_file(set_file)
+            if i % 7 == 0:
+                # Config files without a duration
+                with open(set_file, "w") as f:
+                    f.write("trial_date\r\ntrial_time\r\nduration\r\n")
+
+        t0 = perf_counter()
+        df = iaf.index_axona_files(tmp, num_workers=4)
+        t_first = perf_counter() - t0
+
+        raw = iaf.scan_set_files(tmp)
+        headers = [
+            iaf.read_set_header(os.path.join(d, f))
+            for d, f in zip(raw.directory, raw.filename)
+        ]
+        raw[["duration", "date", "time"]] = pd.DataFrame(headers, dtype=object)
+        old = legacy_clean_data(raw)
+
+        assert len(df) == len(old) > 0
+        assert list(df.columns) == list(iaf.INDEX_SCHEMA)
+        assert not df["directory"].str.contains("setup").any()
+        for column in ["rat", "maze", "treatment", "mapping"]:
+            new_col = df[column].astype(object).where(df[column].notna(), None)
+            old_col = old[column].astype(object).where(old[column].notna(), None)
+            mismatch = new_col.values != old_col.values
+            assert not mismatch.any(), (column, df[mismatch], old[mismatch][column])
+        for column in ["n_channels", "sleep", "habituation", "light", "duration"]:
+            assert np.array_equal(df[column].values, old[column].astype(float).values)
+        assert (df["date_time"] == pd.to_datetime(old["date_time"])).all()
+        assert df["directory"].str.startswith(base).all()
+
+        # Only changed files are read again
+        index_path = os.path.join(tmp, "index.parquet")
+        iaf.write_index(df, index_path)
+        previous = iaf.read_index(index_path)
+        if previous is None:
+            previous = df
+        headers = iaf.read_headers(iaf.scan_set_files(tmp), previous, num_workers=4)
+        assert len(headers) == len(raw)
+        assert list(headers.columns) == list(iaf.HEADER_SCHEMA)
+        changed = os.path.join(tmp, names[1][0], names[1][1])
+        write_set_file(changed)
+        st = os.stat(changed)
+        os.utime(changed, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+        read = []
+        read_set_header = iaf.read_set_header
+
+        def counting_read(set_file):
+            read.append(set_file)
+            return read_set_header(set_file)
+
+        iaf.read_set_header = counting_read
+        try:
+            t0 = perf_counter()
+            again = iaf.index_axona_files(tmp, headers, num_workers=4)
+            t_again = perf_counter() - t0
+            # The changed file only, config files and setup folders are kept
+            assert len(read) == 1 and read[0].endswith(names[1][1])
+            # An index has no headers for the config files that were dropped
+            del read[:]
+            from_index = iaf.index_axona_files(tmp, previous, num_workers=4)
+        finally:
+            iaf.read_set_header = read_set_header
+        num_config = len(raw) - len(df)
+        assert len(read) == num_config + 1
+        assert any(r.endswith(names[1][1]) for r in read)
+        pd.testing.assert_frame_equal(from_index, again)
+        assert (again["mtime"] != df["mtime"]).sum() == 1
+        pd.testing.assert_frame_equal(
+            again.drop(columns="mtime"), df.drop(columns="mtime")
+        )
+
+    print(
+        "{} files: first index {:.3f}s, incremental {:.3f}s".format(
+            len(raw), t_first, t_again
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
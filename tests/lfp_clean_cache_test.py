@@ -0,0 +1,164 @@
+import sys
+
+sys.path.insert(0, "..")
+import os
+import tempfile
+
+import numpy as np
+import astropy.units as u
+import simuran
+
+from lib.data_lfp import load_lfp_Axona
+from lfp_atn_simuran.Scripts import decoded_cache, lfp_clean
+from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+from synthetic_axona import write_set_file, write_lfp_file, random_lfp
+
+NUM_CHANS = 8
+PICKED = [1, 2, 3, 4, 5, 6, 7]
+
+
+class FileEeg(simuran.Eeg):
+    """An Eeg loaded from its Axona file, recording which channels are loaded."""
+
+    loaded = []
+
+    def load(self, *args, **kwargs):
+        FileEeg.loaded.append(self.channel)
+        samples = load_lfp_Axona(self.source_file) / 1000
+        self.from_numpy(samples * u.mV, sampling_rate=250)
+
+
+class CountingClean(LFPClean):
+    """LFPClean counting how often the signals are really averaged."""
+
+    calls = 0
+
+    def avg_method(self, *args, **kwargs):
+        CountingClean.calls += 1
+        return super().avg_method(*args, **kwargs)
+
+    def z_score_method(self, *args, **kwargs):
+        CountingClean.calls += 1
+        return super().z_score_method(*args, **kwargs)
+
+
+def lfp_files(set_file):
+    stem = os.path.splitext(set_file)[0]
+    exts = [".eeg"] + [".eeg{}".format(i + 1) for i in range(1, NUM_CHANS)]
+    return [stem + ext for ext in exts]
+
+
+def write_recording(dirname, num_samples=250 * 60, seed=0):
+    """Axona files of 8 channels in two regions, the last of each region noisy."""
+    set_file = os.path.join(dirname, "synthetic.set")
+    write_set_file(set_file, num_eeg=NUM_CHANS)
+    rng = np.random.default_rng(seed)
+    shared = random_lfp(num_samples, seed=seed) // 2
+    for i, fname in enumerate(lfp_files(set_file)):
+        if i % 4 == 3:
+            samples = random_lfp(num_samples, seed=seed + i + 1)
+        else:
+            samples = shared + rng.integers(-8, 8, num_samples)
+        write_lfp_file(fname, samples)
+    return set_file
+
+
+def file_signals(set_file):
+    """Unloaded signals of the files written by write_recording."""
+    signals = simuran.EegArray()
+    for i, fname in enumerate(lfp_files(set_file)):
+        eeg = FileEeg()
+        eeg.source_file = fname
+        eeg.set_region("SUB" if i < 4 else "RSC")
+        eeg.set_channel(i + 1)
+        signals.append(eeg)
+    return signals
+
+
+def file_recording(set_file, param_file):
+    recording = simuran.Recording()
+    recording.signals = file_signals(set_file)
+    recording.source_file = set_file
+    recording.param_file = param_file
+    return recording
+
+
+def assert_same_result(a, b):
+    assert list(a["signals"].keys()) == list(b["signals"].keys())
+    for region, eeg in a["signals"].items():
+        other = b["signals"][region]
+        assert eeg.samples.unit == other.samples.unit
+        assert np.array_equal(eeg.samples.value, other.samples.value)
+        assert float(eeg.sampling_rate) == float(other.sampling_rate)
+    assert a["bad_channels"] == b["bad_channels"]
+    if a["zscored"] is None:
+        assert b["zscored"] is None
+    else:
+        for region, zscores in a["zscored"].items():
+            assert np.array_equal(zscores, b["zscored"][region])
+
+
+def main():
+    with tempfile.TemporaryDirectory() as dirname:
+        os.environ["LFP_ATN_CACHE_DIR"] = os.path.join(dirname, "cache")
+        os.environ["LFP_ATN_CACHE_SIZE_GB"] = "1"
+        set_file = write_recording(dirname)
+        param_file = os.path.join(dirname, "mapping.py")
+        with open(param_file, "w") as f:
+            f.write("mapping = {}\n")
+
+        for method in ("avg", "zscore", "pick"):
+            lfp_clean._clean_cache.clear()
+            CountingClean.calls = 0
+            lc = CountingClean(method)
+
+            def clean(min_f=1.5, max_f=100, z_threshold=1.1):
+                recording = file_recording(set_file, param_file)
+                kwargs = {"z_threshold": z_threshold, "channels": PICKED}
+                return lc.clean(recording, min_f, max_f, method_kwargs=kwargs)
+
+            first = clean()
+            assert CountingClean.calls == 1
+            if method == "pick":
+                assert 8 in first["bad_channels"]
+
+            # Cleaning the same recording again is a hit and a copy
+            FileEeg.loaded = []
+            second = clean()
+            assert CountingClean.calls == 1 and FileEeg.loaded == []
+            assert_same_result(first, second)
+            assert second["signals"]["SUB"] is not first["signals"]["SUB"]
+
+            # Changes to the arguments, mapping or source files are misses
+            clean(z_threshold=1.2)
+            assert CountingClean.calls == 2
+            clean(max_f=90)
+            assert CountingClean.calls == 3
+            clean(min_f=2)
+            assert CountingClean.calls == 4
+
+            mtime = os.path.getmtime(param_file) + 10
+            os.utime(param_file, (mtime, mtime))
+            clean()
+            assert CountingClean.calls == 5
+
+            fname = lfp_files(set_file)[2]
+            mtime = os.path.getmtime(fname) + 10
+            os.utime(fname, (mtime, mtime))
+            changed = clean()
+            assert CountingClean.calls == 6
+
+            # The disk tier rebuilds the same result once memory is cleared
+            lfp_clean._clean_cache.clear()
+            from_disk = clean()
+            assert CountingClean.calls == 6
+            assert_same_result(changed, from_disk)
+            print("{}: disk tier matches the cleaned signals".format(method))
+
+        # The shared cache is in dirname, so do not report on it at exit
+        print(decoded_cache.get_cache().report())
+        decoded_cache._default_cache = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import sys
+
+sys.path.insert(0, "..")
+from timeit import timeit
+
+import numpy as np
+
+from lfp_atn_simuran.Scripts.lfp_clean import (
+    detect_outlying_signals,
+    z_score_signals,
+)
+
+
+def legacy_detect_outlying_signals(signals, z_threshold=1.1):
+    """The row by row outlier detection used previously."""
+    avg_sig = np.mean(signals, axis=0)
+    std_sig = np.std(signals, axis=0)
+    std_sig = np.where(std_sig == 0, 1, std_sig)
+
+    z_scores = np.zeros(shape=(len(signals), len(signals[0])))
+
+    for i, s in enumerate(signals):
+        z_scores[i] = (s - avg_sig) / std_sig
+
+    z_score_abs = np.abs(z_scores)
+
+    z_score_means = np.nanmean(z_score_abs, axis=1)
+    z_threshold = z_threshold * np.median(z_score_means)
+
+    good, bad = [], []
+    for i, val in enumerate(z_score_means):
+        if val > z_threshold:
+            bad.append(i)
+        else:
+            good.append(i)
+
+    good_signals = np.array([signals[i] for i in good])
+    bad_signals = np.array([signals[i] for i in bad])
+
+    return good_signals, bad_signals, good, bad, z_scores
+
+
+def legacy_z_score_signals(signals, z_threshold=1.1):
+    """The per channel z-scoring used previously."""
+    signals_ = np.array(signals)
+    _, _, _, bad_idx, _ = legacy_detect_outlying_signals(signals_, z_threshold)
+    for i in range(len(signals_)):
+        if i not in bad_idx:
+            div = np.std(signals_[i])
+            div = np.where(div == 0, 1, div)
+            signals_[i] = (signals_[i] - np.mean(signals_[i])) / div
+    res = np.mean(signals_, axis=0)
+    return res, bad_idx, signals_
+
+
+def synthetic_signals(num_chans, num_samples, num_bad=4, seed=0):
+    """Shared theta plus noise on each channel, with a few flat or noisy channels."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(num_samples) / 250
+    shared = 0.2 * np.sin(2 * np.pi * 8 * t)
+    signals = shared + rng.normal(0, 0.05, size=(num_chans, num_samples))
+    signals[:num_bad // 2] = 0
+    signals[num_bad // 2 : num_bad] *= 20
+    return signals
+
+
+def main(num_chans=64, duration_mins=30, number=1):
+    num_samples = int(duration_mins * 60 * 250)
+    signals = synthetic_signals(num_chans, num_samples)
+    chunk_size = 250 * 60
+
+    old = legacy_detect_outlying_signals(signals)
+    for kwargs in ({}, {"chunk_size": chunk_size}):
+        new = detect_outlying_signals(signals, **kwargs)
+        assert old[2:4] == new[2:4]
+        assert np.array_equal(old[0], new[0])
+    assert np.allclose(old[4], detect_outlying_signals(signals)[4], atol=1e-4)
+
+    old_z = legacy_z_score_signals(signals)
+    for kwargs in ({}, {"chunk_size": chunk_size}):
+        new_z = z_score_signals(signals, **kwargs)
+        assert old_z[1] == new_z[1]
+        assert np.allclose(old_z[0], new_z[0], atol=1e-4)
+        assert np.allclose(old_z[2], new_z[2], atol=1e-3)
+
+    t_old = timeit(lambda: legacy_detect_outlying_signals(signals), number=number)
+    t_new = timeit(lambda: detect_outlying_signals(signals), number=number)
+    t_chunk = timeit(
+        lambda: detect_outlying_signals(signals, chunk_size=chunk_size),
+        number=number,
+    )
+    print(
+        "detect {}x{}: legacy {:.3f}s, new {:.3f}s, chunked {:.3f}s".format(
+            num_chans, num_samples, t_old / number, t_new / number, t_chunk / number
+        )
+    )
+
+    t_old = timeit(lambda: legacy_z_score_signals(signals), number=number)
+    t_new = timeit(lambda: z_score_signals(signals), number=number)
+    t_chunk = timeit(
+        lambda: z_score_signals(signals, chunk_size=chunk_size), number=number
+    )
+    print(
+        "z-score {}x{}: legacy {:.3f}s, new {:.3f}s, chunked {:.3f}s".format(
+            num_chans, num_samples, t_old / number, t_new / number, t_chunk / number
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
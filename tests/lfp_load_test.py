@@ -0,0 +1,152 @@
+import sys
+
+sys.path.insert(0, "..")
+import os
+import re
+import tempfile
+from timeit import timeit
+
+import numpy as np
+
+from lib.data_lfp import load_lfp_Axona, mne_lfp_Axona
+from synthetic_axona import write_set_file, write_lfp_file, random_lfp
+
+
+def legacy_load_lfp_Axona(file_name):
+    """The byte by byte decoder load_lfp_Axona used previously."""
+    file_directory, file_basename = os.path.split(file_name)
+    file_tag, file_extension = os.path.splitext(file_basename)
+    file_extension = file_extension[1:]
+    set_file = os.path.join(file_directory, file_tag + ".set")
+    with open(file_name, "rb") as f:
+        while True:
+            line = f.readline().decode("latin-1")
+            if line == "" or line.startswith("data_start"):
+                break
+            if line.startswith("bytes_per_sample"):
+                bytes_per_sample = int("".join(line.split()[1:]))
+            if line.startswith("num_" + file_extension[:3].upper() + "_samples"):
+                num_samples = int("".join(line.split()[1:]))
+
+        f.seek(0, 0)
+        while True:
+            buff = f.read(10).decode("latin-1")
+            if buff == "data_start":
+                header_offset = f.tell()
+                break
+            else:
+                f.seek(-9, 1)
+
+        eeg_ID = re.findall(r"\d+", file_extension)
+        file_tag = 1 if not eeg_ID else int(eeg_ID[0])
+        max_ADC_count = 2 ** (8 * bytes_per_sample - 1) - 1
+        max_byte_value = 2 ** (8 * bytes_per_sample)
+
+        with open(set_file, "r", encoding="latin-1") as f_set:
+            lines = f_set.readlines()
+            channel_lines = dict(
+                [
+                    tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
+                    for line in lines
+                    if line.startswith("EEG_ch_")
+                ]
+            )
+            gain_lines = dict(
+                [
+                    tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
+                    for line in lines
+                    if "gain_ch_" in line
+                ]
+            )
+            gain = gain_lines[channel_lines[file_tag] - 1]
+            for line in lines:
+                if line.startswith("ADC_fullscale_mv"):
+                    fullscale_mv = int(re.findall(r"\d+.\d+|d+", line)[0])
+                    break
+            AD_bit_uvolt = 2 * fullscale_mv / (gain * np.power(2, 8 * bytes_per_sample))
+
+        record_size = bytes_per_sample
+        sample_le = 256 ** (np.arange(0, bytes_per_sample, 1))
+        f.seek(header_offset, 0)
+        byte_buffer = np.fromfile(f, dtype="uint8")
+        len_bytebuffer = len(byte_buffer)
+        end_offset = len("\r\ndata_end\r")
+        lfp_wave = np.zeros([num_samples], dtype=np.float64)
+        for k in np.arange(0, bytes_per_sample, 1):
+            sample_value = (
+                sample_le[k]
+                * byte_buffer[
+                    k : k + len_bytebuffer - end_offset - record_size : record_size
+                ]
+            )
+            if sample_value.size < num_samples:
+                sample_value = np.append(
+                    sample_value, np.zeros([num_samples - sample_value.size])
+                )
+            sample_value = sample_value.astype(np.float64, casting="unsafe", copy=False)
+            np.add(lfp_wave, sample_value, out=lfp_wave)
+        np.putmask(lfp_wave, lfp_wave > max_ADC_count, lfp_wave - max_byte_value)
+
+        return lfp_wave * AD_bit_uvolt
+
+
+def main(duration_hours=1.0, number=3):
+    with tempfile.TemporaryDirectory() as dirname:
+        write_set_file(os.path.join(dirname, "synthetic.set"), num_eeg=2)
+        for ext, rate, bps in ((".eeg", 250, 1), (".egf", 4800, 2)):
+            fname = os.path.join(dirname, "synthetic" + ext)
+            num_samples = int(duration_hours * 3600 * rate)
+            write_lfp_file(fname, random_lfp(num_samples, bps), rate, bps)
+
+            old = legacy_load_lfp_Axona(fname)
+            new = load_lfp_Axona(fname)
+            new32 = load_lfp_Axona(fname, dtype=np.float32)
+            assert np.array_equal(old, new), "float64 output differs for " + ext
+            assert np.allclose(old, new32, rtol=1e-6), "float32 output differs"
+
+            t_old = timeit(lambda: legacy_load_lfp_Axona(fname), number=number)
+            t_new = timeit(lambda: load_lfp_Axona(fname), number=number)
+            t_new32 = timeit(
+                lambda: load_lfp_Axona(fname, dtype=np.float32), number=number
+            )
+            print(
+                "{} ({} samples): legacy {:.3f}s, new {:.3f}s, new float32 {:.3f}s".format(
+                    ext, num_samples, t_old / number, t_new / number, t_new32 / number
+                )
+            )
+
+
+def compare_mne(num_eeg=32, duration_hours=1.0, picks=(1, 2, 17, 18)):
+    """Compare lazily loading a few channels against loading all of them."""
+    with tempfile.TemporaryDirectory() as dirname:
+        set_file = os.path.join(dirname, "synthetic.set")
+        write_set_file(set_file, num_eeg=num_eeg)
+        num_samples = int(duration_hours * 3600 * 250)
+        for i in range(1, num_eeg + 1):
+            ext = ".eeg" if i == 1 else ".eeg{}".format(i)
+            fname = os.path.join(dirname, "synthetic" + ext)
+            write_lfp_file(fname, random_lfp(num_samples, seed=i), 250, 1)
+
+        full = mne_lfp_Axona(set_file)
+        part = mne_lfp_Axona(set_file, picks=picks, tmin=60, tmax=120)
+        for ch in picks:
+            expected = load_lfp_Axona(
+                os.path.join(dirname, "synthetic.eeg" + ("" if ch == 1 else str(ch)))
+            )
+            assert np.array_equal(full.get_data(picks=[f"ch_{ch}"])[0], expected / 1000)
+            assert np.array_equal(
+                part.get_data(picks=[f"ch_{ch}"])[0], expected[15000:30000] / 1000
+            )
+
+        t_full = timeit(lambda: mne_lfp_Axona(set_file), number=1)
+        t_part = timeit(lambda: mne_lfp_Axona(set_file, picks=picks), number=1)
+        print(
+            "mne {} channels: all {:.3f}s, {} picked {:.3f}s".format(
+                num_eeg, t_full, len(picks), t_part
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
+    compare_mne()
@@ -0,0 +1,82 @@
+import sys
+
+sys.path.insert(0, "..")
+import os
+import tempfile
+
+import numpy as np
+import simuran
+
+from lfp_atn_simuran.Scripts.lfp_clean import LFPClean
+from lfp_clean_cache_test import FileEeg, PICKED, file_signals, write_recording
+
+
+class FilterCountingClean(LFPClean):
+    """LFPClean recording which channels are filtered."""
+
+    filtered = []
+
+    def filter_sigs(self, signals, *args, **kwargs):
+        signals = list(signals)
+        FilterCountingClean.filtered += [s.channel for s in signals]
+        return super().filter_sigs(signals, *args, **kwargs)
+
+
+def legacy_pick_clean(lc, signals, min_f, max_f, channels, **filter_kwargs):
+    """Load and filter every signal, then average the picked ones."""
+    for signal in signals:
+        signal.load()
+    filtered = simuran.EegArray()
+    for signal in signals:
+        filt_s = signal.filter(min_f, max_f, inplace=False, **filter_kwargs)
+        filtered.append(simuran.Eeg(signal=filt_s))
+    container = simuran.GenericContainer(filtered[0].__class__)
+    container.container = [s for s in filtered if s.channel in channels]
+    if lc.method == "pick":
+        result, extra_bad = lc.avg_method(
+            container, min_f, max_f, clean=True, **filter_kwargs
+        )
+    else:
+        result, extra_bad, _ = lc.z_score_method(
+            container, min_f, max_f, clean=True, **filter_kwargs
+        )
+    bad_chans = [s.channel for s in signals if s.channel not in channels]
+    return result, bad_chans + extra_bad
+
+
+def main():
+    # Without the decoded cache every load goes through FileEeg.load
+    os.environ["LFP_ATN_CACHE_SIZE_GB"] = "0"
+    kwargs = {"verbose": "WARNING"}
+    with tempfile.TemporaryDirectory() as dirname:
+        set_file = write_recording(dirname)
+        for method in ("pick", "pick_zscore"):
+            lc = FilterCountingClean(method, cache=False)
+            FileEeg.loaded, FilterCountingClean.filtered = [], []
+            new = lc.clean(
+                file_signals(set_file),
+                1.5,
+                100,
+                method_kwargs={"channels": PICKED},
+                **kwargs,
+            )
+            assert sorted(FileEeg.loaded) == PICKED
+            assert sorted(FilterCountingClean.filtered) == PICKED
+
+            old, old_bad = legacy_pick_clean(
+                lc, file_signals(set_file), 1.5, 100, PICKED, **kwargs
+            )
+            assert new["bad_channels"] == old_bad == [8, 4]
+            assert list(new["signals"].keys()) == list(old.keys())
+            for region, eeg in old.items():
+                assert eeg.samples.unit == new["signals"][region].samples.unit
+                assert np.allclose(
+                    eeg.samples.value,
+                    new["signals"][region].samples.value,
+                    atol=1e-10,
+                )
+            print("{}: loaded and filtered channels {}".format(method, PICKED))
+
+
+if __name__ == "__main__":
+    main()
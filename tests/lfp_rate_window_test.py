@@ -0,0 +1,64 @@
+import sys
+
+sys.path.insert(0, "..")
+from math import floor, ceil
+from timeit import timeit
+
+import numpy as np
+
+from lfp_atn_simuran.Scripts.lfp_rate_map import lfp_window_amplitudes
+
+
+def legacy_amplitudes(lfp_samples, sampling_rate, time_to_use):
+    """The per position loop lfp_rate used previously."""
+    lfp_amplitudes = np.zeros_like(time_to_use)
+    for i, t in enumerate(time_to_use):
+        low_sample = floor((t - 0.05) * sampling_rate)
+        high_sample = ceil((t + 0.05) * sampling_rate)
+        if high_sample < len(lfp_samples):
+            lfp_amplitudes[i] = np.mean(
+                np.abs(lfp_samples[low_sample : high_sample + 1])
+            )
+    return lfp_amplitudes
+
+
+def legacy_binning(lfp_amplitudes, x_idx, y_idx, shape):
+    binned_lfp = np.zeros(shape)
+    for k, (i, j) in enumerate(zip(x_idx, y_idx)):
+        binned_lfp[j, i] += lfp_amplitudes[k]
+    return binned_lfp
+
+
+def main(duration_mins=20, fs=250, number=3):
+    rng = np.random.default_rng(0)
+    lfp = rng.normal(0, 100, size=int(duration_mins * 60 * fs))
+    # Position sampled at 10 Hz, running past the end of the LFP
+    times = np.arange(0.1, duration_mins * 60 + 1, 0.1)
+
+    old = legacy_amplitudes(lfp, fs, times)
+    new, valid = lfp_window_amplitudes(lfp, fs, times)
+    assert not np.all(valid)
+    assert np.array_equal(old, new)
+
+    shape = (30, 32)
+    x_idx = rng.integers(-1, shape[1], size=times.size)
+    y_idx = rng.integers(-1, shape[0], size=times.size)
+    old_binned = legacy_binning(old, x_idx, y_idx, shape)
+    x_idx[x_idx < 0] += shape[1]
+    y_idx[y_idx < 0] += shape[0]
+    new_binned = np.bincount(
+        y_idx * shape[1] + x_idx, weights=new, minlength=shape[0] * shape[1]
+    ).reshape(shape)
+    assert np.array_equal(old_binned, new_binned)
+
+    t_old = timeit(lambda: legacy_amplitudes(lfp, fs, times), number=number)
+    t_new = timeit(lambda: lfp_window_amplitudes(lfp, fs, times), number=number)
+    print(
+        "{} position samples: legacy {:.3f}s, new {:.4f}s ({:.0f}x)".format(
+            times.size, t_old / number, t_new / number, t_old / t_new
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import sys
+
+sys.path.insert(0, "..")
+import os
+import math
+import tempfile
+from timeit import timeit
+
+import numpy as np
+import pandas as pd
+
+from lib.data_pos import RecPos
+from synthetic_axona import write_pos_file, random_walk_pos
+
+
+class LegacyRecPos(RecPos):
+    """RecPos with the per sample loops used previously."""
+
+    def load_raw(self):
+        with open(self.pos_file, "rb") as f:
+            while True:
+                line = f.readline().decode("latin-1")
+                if line == "" or line.startswith("data_start"):
+                    break
+                if line.startswith("pixels_per_metre"):
+                    self.pixels_per_metre = int(line.split()[1])
+                    self.pixels_per_cm = self.pixels_per_metre / 100
+                if line.startswith("num_pos_samples"):
+                    self.total_samples = int(line.split()[1])
+
+            f.seek(0, 0)
+            while True:
+                buff = f.read(10).decode("latin-1")
+                if buff == "data_start":
+                    header_offset = f.tell()
+                    break
+                else:
+                    f.seek(-9, 1)
+
+            f.seek(header_offset, 0)
+            byte_buffer = np.fromfile(f, dtype="uint8")
+            big_spotx = np.zeros([self.total_samples, 1])
+            big_spoty = np.zeros([self.total_samples, 1])
+            little_spotx = np.zeros([self.total_samples, 1])
+            little_spoty = np.zeros([self.total_samples, 1])
+            for i, k in enumerate(np.arange(0, self.total_samples * 20, 20)):
+                word = [int(b) for b in byte_buffer[k + 4 : k + 12]]
+                big_spotx[i] = 256 * word[0] + word[1]
+                big_spoty[i] = 256 * word[2] + word[3]
+                little_spotx[i] = 256 * word[4] + word[5]
+                little_spoty[i] = 256 * word[6] + word[7]
+
+            self.raw_position = {
+                "big_spotx": big_spotx,
+                "big_spoty": big_spoty,
+                "little_spotx": little_spotx,
+                "little_spoty": little_spoty,
+            }
+
+    def filter_max_speed(self, x, y, max_speed=4):
+        tmp_x = x.copy()
+        tmp_y = y.copy()
+        threshold = max_speed * self.pixels_per_metre * 50
+        for i in range(1, len(tmp_x)):
+            distance = math.sqrt((x[i] - x[i - 1]) ** 2 + (y[i] - y[i - 1]) ** 2)
+            if distance > threshold:
+                tmp_x[i] = np.nan
+                tmp_y[i] = np.nan
+
+        return tmp_x, tmp_y
+
+    def calculate_position(self, raw=False):
+        bxx, sxx = [], []
+        byy, syy = [], []
+        bigx = [value[0] for value in self.raw_position["big_spotx"]]
+        bigy = [value[0] for value in self.raw_position["big_spoty"]]
+        smallx = [value[0] for value in self.raw_position["little_spotx"]]
+        smally = [value[0] for value in self.raw_position["little_spoty"]]
+        for bx, sx in zip(bigx, smallx):
+            if bx == 1023 and sx != 1023:
+                bx = sx
+            elif bx != 1023 and sx == 1023:
+                sx = bx
+            elif bx == 1023 and sx == 1023:
+                bx = np.nan
+                sx = np.nan
+            bxx.append(bx)
+            sxx.append(sx)
+
+        for by, sy in zip(bigy, smally):
+            if by == 1023 and sy != 1023:
+                by = sy
+            elif by != 1023 and sy == 1023:
+                sy = by
+            elif by == 1023 and sy == 1023:
+                by = np.nan
+                sy = np.nan
+            byy.append(by)
+            syy.append(sy)
+
+        bxx, byy = self.filter_max_speed(bxx, byy)
+        sxx, syy = self.filter_max_speed(sxx, syy)
+
+        bxx = (pd.Series(bxx).astype(float)).interpolate("linear")
+        sxx = (pd.Series(sxx).astype(float)).interpolate("linear")
+        byy = (pd.Series(byy).astype(float)).interpolate("linear")
+        syy = (pd.Series(syy).astype(float)).interpolate("linear")
+        if raw:
+            return [(bxx, byy), (sxx, syy)]
+
+        x = list((bxx + sxx) / 2)
+        y = list((byy + syy) / 2)
+
+        b = int(400 / 20)
+        kernel = np.ones(b) / b
+
+        def pad_and_convolve(xx, kernel):
+            npad = len(kernel)
+            xx = np.pad(xx, (npad, npad), "edge")
+            yy = np.convolve(xx, kernel, mode="same")
+            return yy[npad:-npad]
+
+        x = pad_and_convolve(x, kernel)
+        y = pad_and_convolve(y, kernel)
+
+        if np.count_nonzero(np.isnan(x)) != 0:
+            num_start_nan = 0
+            for val in x:
+                if np.isnan(val):
+                    num_start_nan += 1
+                else:
+                    break
+            if num_start_nan != 0:
+                np.put(x, np.arange(0, num_start_nan, 1), x[num_start_nan])
+                np.put(y, np.arange(0, num_start_nan, 1), y[num_start_nan])
+
+        if np.count_nonzero(np.isnan(x)) != 0:
+            num_end_nan = 0
+            for val in x[::-1]:
+                if np.isnan(val):
+                    num_end_nan += 1
+                else:
+                    break
+            from_end = len(x) - num_end_nan
+            back = num_end_nan + 1
+            if num_end_nan != 0:
+                np.put(x, np.arange(from_end, len(x), 1), x[-back])
+                np.put(y, np.arange(from_end, len(x), 1), y[-back])
+
+        self.x = x / self.pixels_per_cm
+        self.y = y / self.pixels_per_cm
+        return x, y
+
+    def calculate_speed(self, num_samples=5, smooth_size=5, smooth=True):
+        x, y = self.get_position()
+
+        def pad_and_convolve(xx, kernel):
+            npad = len(kernel)
+            xx = np.pad(xx, (npad, npad), "edge")
+            yy = np.convolve(xx, kernel, mode="same")
+            return yy[npad:-npad]
+
+        speed = [0]
+        s_rate = num_samples
+        t_rate = 0.02 * s_rate
+        duration = len(x) * 0.02
+        for i in range(s_rate * 3 // 2, len(x), s_rate):
+            cm_dist = math.sqrt(
+                (x[i] - x[i - s_rate]) ** 2 + (y[i] - y[i - s_rate]) ** 2
+            )
+            speed.append(cm_dist / t_rate)
+        xp = np.array(
+            [0.0] + [0.02 * i for i in range(s_rate, len(x) - (s_rate // 2), s_rate)]
+        )
+        xs = np.arange(0, duration, 0.02)
+        interp_speed = np.interp(xs, xp, speed)
+
+        if smooth:
+            kernel = np.ones(smooth_size) / smooth_size
+            interp_speed = pad_and_convolve(interp_speed, kernel)
+
+        self.speed = interp_speed
+        return interp_speed
+
+
+def compare_speed(pos_file, number=3):
+    """Compare speed and head direction against per sample loops."""
+    old = LegacyRecPos(pos_file)
+    new = RecPos(pos_file)
+    for smooth_size in (4, 5):
+        old_speed = old.calculate_speed(smooth_size=smooth_size)
+        new_speed = new.calculate_speed(smooth_size=smooth_size)
+        assert new_speed.dtype == np.float32
+        assert np.allclose(old_speed, new_speed, rtol=1e-5, atol=1e-4)
+
+    speed, hd = new.calculate_speed(head_direction=True)
+    (bxx, byy), (sxx, syy) = new.led_position
+    expected = [
+        math.degrees(math.atan2(sy - by, sx - bx)) % 360
+        for bx, by, sx, sy in zip(bxx, byy, sxx, syy)
+    ]
+    assert np.allclose(hd, expected, atol=1e-3, equal_nan=True)
+
+    t_old = timeit(lambda: old.calculate_speed(), number=number) / number
+    t_new = timeit(
+        lambda: new.calculate_speed(head_direction=True), number=number
+    ) / number
+    print(
+        "speed: legacy {:.3f}s, new speed and head direction {:.4f}s".format(
+            t_old, t_new
+        )
+    )
+
+
+def main(duration_hours=1.0, number=3):
+    num_samples = int(duration_hours * 3600 * 50)
+    with tempfile.TemporaryDirectory() as dirname:
+        pos_file = os.path.join(dirname, "synthetic.pos")
+        big, small = random_walk_pos(num_samples)
+        # Start and end with untracked points to check the edge filling
+        big[:, :5] = small[:, :5] = big[:, -5:] = small[:, -5:] = 1023
+        write_pos_file(pos_file, big, small)
+
+        old = LegacyRecPos(pos_file, load=False)
+        old.load_raw()
+        old_x, old_y = old.calculate_position()
+        new = RecPos(pos_file, load=False)
+        new.load_raw()
+        new_x, new_y = new.calculate_position()
+        assert np.array_equal(old_x, new_x) and np.array_equal(old_y, new_y)
+        assert np.array_equal(old.x, new.x) and np.array_equal(old.y, new.y)
+
+        # The default 4 m/s threshold is rarely crossed, so check a low one
+        bx, by = new.get_raw_pos()[:2]
+        old_f = old.filter_max_speed(list(bx), list(by), max_speed=0.0001)
+        new_f = new.filter_max_speed(bx, by, max_speed=0.0001)
+        assert np.array_equal(old_f, new_f, equal_nan=True)
+
+        def run(cls):
+            pos = cls(pos_file, load=False)
+            pos.load_raw()
+            pos.calculate_position()
+
+        t_old = timeit(lambda: run(LegacyRecPos), number=number) / number
+        t_new = timeit(lambda: run(RecPos), number=number) / number
+        print(
+            "{} position samples: legacy {:.3f}s, new {:.3f}s ({:.0f}x)".format(
+                num_samples, t_old, t_new, t_old / t_new
+            )
+        )
+        compare_speed(pos_file, number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import sys
+import tempfile
+from itertools import product
+from time import perf_counter
+
+sys.path.insert(0, "..")
+import numpy as np
+import pandas as pd
+
+import lfp_atn_simuran.index_axona_files as iaf
+from lfp_atn_simuran.session_catalogue import SessionCatalogue
+from synthetic_axona import write_set_file
+
+
+def make_tree(base):
+    rats = ["CSubRet1", "CSR6", "LSR2", "CanCSR3", "Rat7"]
+    parts = ["smallsq", "bigsq", "t_maze", "sleep", "saline", "musc", "hab1"]
+    folders = ["{}/small sq/02102018", "{}/t-maze/t maze", "{}/sleep", "{}/setup"]
+    for i, (rat, part, folder) in enumerate(product(rats, parts, folders)):
+        directory = os.path.join(base, folder.format(rat))
+        os.makedirs(directory, exist_ok=True)
+        filename = "0{}102018_{}_{}_1.set".format(1 + i % 3, rat, part)
+        write_set_file(os.path.join(directory, filename))
+
+
+def counting_reads(fn, *args):
+    """Call fn, counting the .set headers read by the indexer."""
+    read = []
+    read_set_header = iaf.read_set_header
+
+    def counting_read(set_file):
+        read.append(set_file)
+        return read_set_header(set_file)
+
+    iaf.read_set_header = counting_read
+    try:
+        return fn(*args), read
+    finally:
+        iaf.read_set_header = read_set_header
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "data")
+        make_tree(base)
+        catalogue = SessionCatalogue()
+        changed, read = counting_reads(catalogue.update, base, 4)
+        index = iaf.index_axona_files(base, num_workers=4)
+        df = catalogue.sessions
+
+        assert len(read) == len(iaf.scan_set_files(base))
+        assert len(df) == len(index) > 0
+        assert isinstance(df["maze"].dtype, pd.CategoricalDtype)
+        pd.testing.assert_frame_equal(df.astype(iaf.INDEX_SCHEMA), index)
+
+        # Group index queries match the chained boolean masks
+        queries = [
+            {"sleep": 1},
+            {"treatment": "muscimol"},
+            {"rat": ["CSR6", "LSR2"], "maze": "small_sq"},
+            {"treatment": "Control", "sleep": 0, "date": "1 Dec 2017"},
+            {"date": ["2 Oct 2018"]},
+            {"maze": "no_maze"},
+        ]
+        for filters in queries:
+            mask = np.ones(len(index), dtype=bool)
+            for column, values in filters.items():
+                values = [values] if isinstance(values, (str, int)) else values
+                if column == "date":
+                    date = index["date_time"].dt.normalize()
+                    mask &= date.isin(pd.to_datetime(values)).to_numpy()
+                else:
+                    mask &= index[column].isin(values).to_numpy()
+            expected = index.loc[mask]
+            assert catalogue.select(**filters).tolist() == np.flatnonzero(mask).tolist()
+            paths = (expected["directory"] + "/" + expected["filename"]).tolist()
+            assert catalogue.paths(**filters) == paths, filters
+        filenames = index["filename"].iloc[:5].tolist()
+        assert catalogue.query(filename=filenames)["filename"].isin(filenames).all()
+        mappings = catalogue.mappings(rat="CSR6")
+        assert len(mappings) > 0 and set(mappings.values()) == {"CL-SR_4-6.py"}
+        try:
+            catalogue.select(colour="red")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Unknown columns should raise a ValueError")
+
+        t0 = perf_counter()
+        for _ in range(200):
+            catalogue.paths(rat="CSR6", maze="small_sq")
+        t_catalogue = perf_counter() - t0
+        t0 = perf_counter()
+        for _ in range(200):
+            rows = index.loc[(index.rat == "CSR6") & (index.maze == "small_sq")]
+            (rows["directory"] + "/" + rows["filename"]).tolist()
+        t_masks = perf_counter() - t0
+
+        # Only new or changed folders are scanned again
+        num_small_sq = len(catalogue.select(rat="CSR6", maze="small_sq"))
+        new_folder = os.path.join(base, "CSR6", "small sq", "03102018")
+        os.makedirs(new_folder)
+        write_set_file(os.path.join(new_folder, "03102018_CSR6_smallsq_2.set"))
+        changed, read = counting_reads(catalogue.update, base, 4)
+        assert sorted(changed) == sorted(
+            [new_folder, os.path.dirname(new_folder)]
+        ), changed
+        assert len(read) == 1 and len(catalogue) == len(index) + 1
+        assert len(catalogue.select(rat="CSR6", maze="small_sq")) == num_small_sq + 1
+        changed, read = counting_reads(catalogue.update, base, 4)
+        assert changed == [] and read == []
+
+        # Config files are not in the sessions, but are not read again either
+        config = os.path.join(new_folder, "03102018_CSR6_smallsq_3.set")
+        with open(config, "w") as f:
+            f.write("trial_date\r\ntrial_time\r\nduration\r\n")
+        changed, read = counting_reads(catalogue.update, base, 4)
+        assert len(read) == 1 and len(catalogue) == len(index) + 1
+        write_set_file(os.path.join(new_folder, "03102018_CSR6_smallsq_4.set"))
+        changed, read = counting_reads(catalogue.update, base, 4)
+        assert len(read) == 1 and read[0].endswith("_4.set")
+        assert len(catalogue) == len(index) + 2
+        assert len(catalogue.headers) == len(iaf.scan_set_files(base))
+
+        catalogue_path = os.path.join(tmp, "catalogue")
+        catalogue.save(catalogue_path)
+        if os.path.exists(os.path.join(catalogue_path, "sessions.parquet")):
+            loaded = SessionCatalogue.load(catalogue_path)
+            pd.testing.assert_frame_equal(loaded.sessions, catalogue.sessions)
+            assert loaded.select(sleep=1).tolist() == catalogue.select(sleep=1).tolist()
+            pd.testing.assert_frame_equal(loaded.headers, catalogue.headers)
+            changed, read = counting_reads(loaded.update, base, 4)
+            assert changed == [] and read == []
+
+    print(
+        "{} recordings: 200 queries {:.3f}s, boolean masks {:.3f}s".format(
+            len(index), t_catalogue, t_masks
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import sys
+
+sys.path.insert(0, "..")
+import os
+import re
+import tempfile
+from time import perf_counter
+
+from lib.data_lfp import read_set_file, _parse_set_file
+from synthetic_axona import write_set_file
+
+
+def legacy_set_values(set_file):
+    """The regex parse of the .set file load_lfp_Axona did per channel."""
+    with open(set_file, "r", encoding="latin-1") as f_set:
+        lines = f_set.readlines()
+    channel_map = dict(
+        [
+            tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
+            for line in lines
+            if line.startswith("EEG_ch_")
+        ]
+    )
+    recorded = dict(
+        [
+            tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
+            for line in lines
+            if line.startswith("saveEEG_ch_")
+        ]
+    )
+    gains = dict(
+        [
+            tuple(map(int, re.findall(r"\d+.\d+|\d+", line)[0].split()))
+            for line in lines
+            if "gain_ch_" in line
+        ]
+    )
+    for line in lines:
+        if line.startswith("ADC_fullscale_mv"):
+            fullscale_mv = int(re.findall(r"\d+.\d+|d+", line)[0])
+    return channel_map, recorded, gains, fullscale_mv
+
+
+def main(num_files=500):
+    with tempfile.TemporaryDirectory() as tmp:
+        set_files = [os.path.join(tmp, f"rec{i}.set") for i in range(num_files)]
+        for i, set_file in enumerate(set_files):
+            write_set_file(set_file, num_eeg=1 + i % 4, gain=1000 + i)
+
+        t0 = perf_counter()
+        for set_file in set_files:
+            legacy_set_values(set_file)
+        t_old = perf_counter() - t0
+
+        _parse_set_file.cache_clear()
+        t0 = perf_counter()
+        for set_file in set_files:
+            set_header = read_set_file(set_file)
+        t_new = perf_counter() - t0
+
+        for set_file in set_files[:20]:
+            set_header = read_set_file(set_file)
+            channel_map, recorded, gains, fullscale_mv = legacy_set_values(set_file)
+            assert set_header["channel_map"] == channel_map
+            assert set_header["save_eeg"] == {k: bool(v) for k, v in recorded.items()}
+            assert set_header["gains"] == gains
+            assert set_header["fullscale_mv"] == fullscale_mv
+            assert set_header["date"] == "1 Dec 2017"
+            assert set_header["time"] == "10:58:00"
+            assert set_header["duration"] == 600
+
+        # Repeated reads of an unchanged file are parsed once
+        info = _parse_set_file.cache_info()
+        assert info.misses == num_files and info.hits == 20
+        assert read_set_file(set_files[0]) is read_set_file(set_files[0])
+
+        # Until it changes on disk
+        write_set_file(set_files[0], gain=5)
+        st = os.stat(set_files[0])
+        os.utime(set_files[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert read_set_file(set_files[0])["gains"][0] == 5
+
+        # Config files have no date, time or duration
+        with open(set_files[1], "w") as f:
+            f.write("trial_date\r\ntrial_time\r\nduration\r\n")
+        config = read_set_file(set_files[1])
+        assert config["date"] is None and config["time"] is None
+        assert config["duration"] is None and config["gains"] == {}
+
+        try:
+            read_set_file(os.path.join(tmp, "missing.set"))
+        except OSError:
+            pass
+        else:
+            raise AssertionError("Missing .set files should raise an OSError")
+
+    print(
+        "{} .set files: regex parse {:.3f}s, read_set_file {:.3f}s".format(
+            num_files, t_old, t_new
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import sys
+
+sys.path.insert(0, "..")
+from time import perf_counter
+
+import numpy as np
+from scipy.signal import welch, coherence
+from scipy.integrate import simpson
+
+from lfp_atn_simuran.Scripts.spectral_store import SpectralStore
+
+
+def legacy_bandpower(samples, fs, band, window_sec=2, total_band=(1.5, 90)):
+    """NLfp.bandpower(band_total=True) from NeuroChaT, for samples in mV."""
+    # The default unit="micro" scales the mV samples to uV
+    samples = samples * 1000
+    freqs, psd = welch(samples, fs, nperseg=int(window_sec * fs))
+    freq_res = freqs[1] - freqs[0]
+    idx_band = np.logical_and(freqs >= band[0], freqs <= band[1])
+    bp = simpson(psd[idx_band], dx=freq_res)
+    idx_band = np.logical_and(freqs >= total_band[0], freqs <= total_band[1])
+    tp = simpson(psd[idx_band], dx=freq_res)
+    return {"bandpower": bp, "total_power": tp, "relative_power": bp / tp}
+
+
+def legacy_run(sub, rsc, fs, bands):
+    """powers and plot_recording_coherence with a Welch estimate per call."""
+    out = []
+    for x in (sub, rsc):
+        # NLfp samples are in mV
+        out.append([legacy_bandpower(x / 1000, fs, band) for band in bands])
+        out.append(welch(x, fs=fs, nperseg=2 * fs)[1])
+    out.append(coherence(sub, rsc, fs, nperseg=2 * fs)[1])
+    return out
+
+
+def store_run(sub, rsc, fs, bands):
+    store = SpectralStore()
+    store.add("SUB", sub, fs)
+    store.add("RSC", rsc, fs)
+    out = []
+    for region in ("SUB", "RSC"):
+        out.append(
+            [
+                store.bandpower(region, band, 2 * fs, total_band=(1.5, 90))
+                for band in bands
+            ]
+        )
+        out.append(store.psd(region, 2 * fs)[1])
+    out.append(store.coherence("SUB", "RSC", 2 * fs)[1])
+    return out, store
+
+
+def main(duration_mins=20, fs=250):
+    rng = np.random.default_rng(0)
+    time = np.arange(int(duration_mins * 60 * fs)) / fs
+    theta = np.sin(2 * np.pi * 8 * time)
+    sub = 100 * theta + rng.normal(0, 50, size=time.size)
+    rsc = 80 * np.roll(theta, 5) + rng.normal(0, 50, size=time.size)
+    bands = [(1.5, 4), (6, 10), (30, 55), (65, 90)]
+
+    t0 = perf_counter()
+    old = legacy_run(sub, rsc, fs, bands)
+    t_old = perf_counter() - t0
+    t0 = perf_counter()
+    new, store = store_run(sub, rsc, fs, bands)
+    t_new = perf_counter() - t0
+
+    for old_powers, new_powers in zip(old[0:4:2], new[0:4:2]):
+        for a, b in zip(old_powers, new_powers):
+            for key in a:
+                assert np.isclose(a[key], b[key], rtol=1e-10)
+    for old_psd, new_psd in zip(old[1:4:2], new[1:4:2]):
+        assert np.allclose(old_psd, new_psd, rtol=1e-10)
+    assert np.allclose(old[4], new[4], rtol=1e-10)
+
+    # One FFT pass per region
+    assert len(store._spectra) == 2
+    f, csd = store.csd_matrix(2 * fs)
+    assert np.allclose(csd[0, 0].real, new[1], rtol=1e-10)
+    assert np.allclose(np.abs(csd[0, 1]) ** 2 / csd[0, 0].real / csd[1, 1].real, new[4])
+
+    # Changing a region's samples only recomputes that region
+    store.add("RSC", rsc[::-1], fs)
+    assert list(store._spectra.keys())[0][0] == "SUB"
+    assert len(store._spectra) == 1
+
+    print("Powers and coherence: legacy {:.3f}s, store {:.3f}s".format(t_old, t_new))
+
+
+if __name__ == "__main__":
+    main()
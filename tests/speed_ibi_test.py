@@ -0,0 +1,109 @@
+import sys
+
+sys.path.insert(0, "..")
+from math import floor, ceil
+from time import perf_counter
+
+import numpy as np
+
+from lfp_atn_simuran.Scripts.speed_ibi import calc_ibi, calc_ibi_cells, find_bursts
+
+
+def legacy_calc_ibi(spike_train, speed, speed_sr, burst_thresh=5):
+    """calc_ibi as it was, with nested while loops over the ISIs."""
+    unitStamp = spike_train
+    isi = 1000 * np.diff(unitStamp)
+
+    burst_start = []
+    burst_end = []
+    burst_duration = []
+    spikesInBurst = []
+    num_burst = 0
+    ibi = []
+    k = 0
+    ibi_speeds = []
+    while k < isi.size:
+        if isi[k] <= burst_thresh:
+            burst_start.append(k)
+            spikesInBurst.append(2)
+            burst_duration.append(isi[k])
+            m = k + 1
+            while m < isi.size and isi[m] <= burst_thresh:
+                spikesInBurst[num_burst] += 1
+                burst_duration[num_burst] += isi[m]
+                m += 1
+            burst_duration[num_burst] += 1
+            burst_end.append(m)
+            k = m + 1
+            num_burst += 1
+        else:
+            k += 1
+
+    if num_burst:
+        for j in range(0, num_burst - 1):
+            time_end = unitStamp[burst_start[j + 1]]
+            time_start = unitStamp[burst_end[j]]
+            ibi.append((time_end - time_start) * 1000)
+            speed_time_idx1 = int(floor(time_start * speed_sr))
+            speed_time_idx2 = int(ceil(time_end * speed_sr))
+            ibi_speeds.append(np.mean(speed[speed_time_idx1:speed_time_idx2]))
+    else:
+        return None, None, None
+
+    bursts = (burst_start, burst_end, burst_duration, spikesInBurst)
+    return np.array(ibi), np.array(ibi_speeds), bursts
+
+
+def bursty_train(rng, duration, rate):
+    """Poisson spikes, with a burst of 2 to 5 spikes after some of them."""
+    num_events = rng.poisson(rate * duration)
+    events = np.sort(rng.uniform(0, duration, num_events))
+    sizes = np.where(rng.random(num_events) < 0.3, rng.integers(2, 6, num_events), 1)
+    starts = np.repeat(events, sizes)
+    within = np.arange(starts.size) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    gaps = rng.uniform(0.001, 0.006, starts.size)
+    return np.sort(starts + within * gaps)
+
+
+def main(duration=600, speed_sr=50):
+    rng = np.random.default_rng(0)
+    speed = np.abs(rng.normal(10, 5, duration * speed_sr))
+    trains = [bursty_train(rng, duration, rate) for rate in (150, 200, 100, 5)]
+    trains.append(np.array([1.0, 2.0, 3.0]))
+    assert trains[0].size > 100000
+
+    t0 = perf_counter()
+    old = [legacy_calc_ibi(train, speed, speed_sr) for train in trains]
+    t_old = perf_counter() - t0
+
+    t0 = perf_counter()
+    new = calc_ibi_cells(trains, speed, speed_sr)
+    t_new = perf_counter() - t0
+
+    for train, (old_ibi, old_speeds, old_bursts), (ibi, ibi_speeds) in zip(
+        trains, old, new
+    ):
+        if old_ibi is None:
+            assert ibi is None and ibi_speeds is None
+            continue
+        assert np.array_equal(ibi, old_ibi)
+        assert np.allclose(ibi_speeds, old_speeds, rtol=1e-10, equal_nan=True)
+        bursts = find_bursts(1000 * np.diff(train))
+        for values, old_values in zip(bursts, old_bursts):
+            assert np.allclose(values, old_values, rtol=1e-12, atol=0)
+
+    single = calc_ibi(trains[1], speed, speed_sr)
+    assert np.array_equal(single[0], old[1][0])
+    # Intervals past the end of the speed are averaged over what is left
+    ibi, ibi_speeds = calc_ibi(trains[1], speed[: 100 * speed_sr], speed_sr)
+    assert np.isnan(ibi_speeds[-1]) and np.isfinite(ibi_speeds[0])
+
+    print(
+        "{} cells, {} spikes: loops {:.3f}s, run length encoded {:.3f}s".format(
+            len(trains), sum(t.size for t in trains), t_old, t_new
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
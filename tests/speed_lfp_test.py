@@ -0,0 +1,92 @@
+import sys
+
+sys.path.insert(0, "..")
+from math import floor, ceil
+from timeit import timeit
+
+import numpy as np
+import scipy.signal
+import scipy.integrate
+
+from lfp_atn_simuran.Scripts.speed_lfp import (
+    window_bounds,
+    window_means,
+    window_relative_power,
+)
+
+
+def legacy_speed_vs_amp(
+    speed, pos_rate, lfp_samples, lfp_rate, time_to_use, low_f, high_f, sps=5
+):
+    """The per window welch loop speed_vs_amp used previously."""
+    avg_speed = np.zeros_like(time_to_use)
+    lfp_amplitudes = np.zeros_like(time_to_use)
+    for i, t in enumerate(time_to_use):
+        diff = 1 / (2 * sps)
+
+        low_sample = floor((t - diff) * pos_rate)
+        high_sample = floor((t + diff) * pos_rate)
+        avg_speed[i] = np.mean(speed[low_sample:high_sample])
+
+        low_sample = floor((t - diff) * lfp_rate)
+        high_sample = ceil((t + diff) * lfp_rate)
+        if high_sample < len(lfp_samples):
+            lfp_sample_200ms = lfp_samples[low_sample : high_sample + 1]
+            slep_win = scipy.signal.windows.hann(lfp_sample_200ms.size, False)
+            f, psd = scipy.signal.welch(
+                lfp_sample_200ms,
+                fs=lfp_rate,
+                window=slep_win,
+                nperseg=len(lfp_sample_200ms),
+                nfft=256,
+                noverlap=0,
+            )
+            idx_band = np.logical_and(f >= low_f, f <= high_f)
+            abs_power = scipy.integrate.simpson(psd[idx_band], x=f[idx_band])
+            total_power = scipy.integrate.simpson(psd, x=f)
+            lfp_amplitudes[i] = abs_power / total_power
+    return avg_speed, lfp_amplitudes
+
+
+def batched_speed_vs_amp(
+    speed, pos_rate, lfp_samples, lfp_rate, time_to_use, low_f, high_f, sps=5
+):
+    diff = 1 / (2 * sps)
+    low, high = window_bounds(time_to_use, pos_rate, diff, len(speed))
+    avg_speed = window_means(speed, low, high)
+    low, high = window_bounds(time_to_use, lfp_rate, diff, len(lfp_samples), np.ceil)
+    valid = high < len(lfp_samples)
+    lfp_amplitudes = np.zeros_like(time_to_use)
+    lfp_amplitudes[valid] = window_relative_power(
+        lfp_samples, lfp_rate, low[valid], high[valid] + 1, low_f, high_f
+    )
+    return avg_speed, lfp_amplitudes
+
+
+def main(duration_mins=20, lfp_rate=250, pos_rate=50, sps=5, number=3):
+    rng = np.random.default_rng(0)
+    time = np.arange(int(duration_mins * 60 * lfp_rate)) / lfp_rate
+    lfp = np.sin(2 * np.pi * 8 * time) + rng.normal(0, 1, size=time.size)
+    speed = np.abs(rng.normal(10, 5, size=int(duration_mins * 60 * pos_rate)))
+    pos_time = np.arange(speed.size) / pos_rate
+    skip_rate = int(pos_rate / sps)
+    # Position data running past the end of the LFP
+    time_to_use = np.append(pos_time, pos_time[-1] + 1)[skip_rate:-skip_rate:skip_rate]
+    args = (speed, pos_rate, lfp, lfp_rate, time_to_use, 6, 12, sps)
+
+    old_speed, old_amp = legacy_speed_vs_amp(*args)
+    new_speed, new_amp = batched_speed_vs_amp(*args)
+    assert np.array_equal(old_speed, new_speed, equal_nan=True)
+    assert np.allclose(old_amp, new_amp, rtol=1e-10, atol=0)
+
+    t_old = timeit(lambda: legacy_speed_vs_amp(*args), number=number)
+    t_new = timeit(lambda: batched_speed_vs_amp(*args), number=number)
+    print(
+        "{} windows: legacy {:.3f}s, batched {:.4f}s ({:.0f}x)".format(
+            time_to_use.size, t_old / number, t_new / number, t_old / t_new
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import sys
+
+sys.path.insert(0, "..")
+from time import perf_counter
+
+import numpy as np
+import scipy.stats
+
+from lfp_atn_simuran.Scripts.speed_ibi import speed_rate_cells
+
+
+def legacy_histogram(x, bins):
+    """nc_utils.histogram, the counts and digitized indices."""
+    bins = np.append(bins, bins[-1] + np.mean(np.diff(bins)))
+    return np.histogram(x, bins)[0], np.digitize(x, bins) - 1
+
+
+def legacy_speed(speed, pos_times, pos_sr, ftimes, binsize=1, speed_range=(0, 40)):
+    """NSpatial.speed as NeuroChaT computes it for one cell."""
+    min_speed, max_speed = speed_range
+    max_speed = min(max_speed, np.ceil(speed.max() / binsize) * binsize)
+    min_speed = max(min_speed, np.floor(speed.min() / binsize) * binsize)
+    bins = np.arange(min_speed, max_speed, binsize)
+
+    vid_count = legacy_histogram(ftimes, pos_times)[0]
+    visit_time, speedInd = legacy_histogram(speed, bins)
+    visit_time = visit_time / pos_sr
+
+    rate = np.array(
+        [sum(vid_count[speedInd == i]) for i in range(len(bins))]
+    ) / np.where(visit_time == 0, np.nan, visit_time)
+    rate[np.isnan(rate)] = 0
+
+    rate = rate[visit_time > 1]
+    bins = bins[visit_time > 1]
+
+    A = np.vstack([bins, np.ones(bins.shape[0])]).T
+    B = np.linalg.lstsq(A, rate, rcond=-1)[0]
+    r, p = scipy.stats.pearsonr(rate, np.matmul(A, B))
+    return bins, rate, r, p
+
+
+def main(duration=600, pos_sr=50, num_cells=20):
+    rng = np.random.default_rng(1)
+    pos_times = np.arange(duration * pos_sr) / pos_sr
+    speed = np.abs(np.cumsum(rng.normal(0, 1, pos_times.size))) % 35
+    spike_trains = []
+    for i in range(num_cells):
+        # Firing rates rising with speed at different slopes
+        rate = 2 + (i % 5) * speed / 10
+        fires = rng.random(pos_times.size) < rate / pos_sr
+        spike_trains.append(
+            np.sort(pos_times[fires] + rng.uniform(0, 0.02, fires.sum()))
+        )
+    # Spikes on the last time edge and outside the recording
+    spike_trains[0] = np.append(spike_trains[0], [pos_times[-1] + 1 / pos_sr, 700.0])
+
+    for binsize in (1, 2):
+        t0 = perf_counter()
+        old = [
+            legacy_speed(speed, pos_times, pos_sr, train, binsize)
+            for train in spike_trains
+        ]
+        t_old = perf_counter() - t0
+
+        t0 = perf_counter()
+        new = speed_rate_cells(speed, pos_times, pos_sr, spike_trains, binsize)
+        t_new = perf_counter() - t0
+
+        for i, (bins, rate, r, p) in enumerate(old):
+            assert np.array_equal(new["bins"], bins)
+            assert np.allclose(new["rate"][i], rate, rtol=1e-12)
+            assert np.isclose(new["lin_fit_r"][i], r, rtol=1e-9)
+            assert np.isclose(new["lin_fit_p"][i], p, rtol=1e-6, atol=1e-300)
+
+        print(
+            "{} cells, binsize {}: per cell {:.3f}s, batch {:.3f}s".format(
+                num_cells, binsize, t_old, t_new
+            )
+        )
+
+    # A cell with the same rate at every speed has no linear trend
+    flat = speed_rate_cells(speed, pos_times, pos_sr, [np.array([])])
+    assert np.isnan(flat["lin_fit_r"][0]) and np.isnan(flat["lin_fit_p"][0])
+    assert np.all(flat["rate"] == 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import sys
+
+sys.path.insert(0, "..")
+from time import perf_counter
+
+import numpy as np
+import scipy.signal as sg
+from neurochat.nc_utils import butter_filter, fft_psd
+
+from lfp_atn_simuran.Scripts.spike_shuffle import SpikePhase
+
+
+def legacy_phase_dist(lfp, time, fs, event_stamp, fwin=(6, 10), binsize=5):
+    """NLfp.phase_dist from NeuroChaT, returning the phase statistics."""
+    bins = int(360 / binsize)
+    fmin, fmax = fwin
+    b_lfp = butter_filter(lfp, fs, 5, fmin, fmax, "bandpass")
+    lfp = butter_filter(lfp, fs, 10, 1.5, 40, "bandpass")
+
+    hilb = sg.hilbert(b_lfp)
+    phase = np.angle(hilb, deg=True)
+    phase[phase < 0] = phase[phase < 0] + 360
+    mag = np.abs(hilb)
+    ephase = np.interp(event_stamp, time, phase)
+
+    p2p = np.abs(np.max(lfp) - np.min(lfp))
+    xline = 0.5 * np.mean(mag)
+    mag1 = mag[0:-3]
+    mag2 = mag[1:-2]
+    mag3 = mag[2:-1]
+    xind = np.union1d(
+        np.nonzero(np.logical_and(mag1 < xline, mag2 > xline))[0],
+        np.nonzero(
+            np.logical_and(np.logical_and(mag1 < xline, mag2 == xline), mag3 > xline)
+        )[0],
+    )
+
+    i = 0
+    phBins = np.arange(0, 360, 360 / bins)
+    phCount = np.zeros(bins)
+    while i < len(xind) - 1:
+        k = i + 1
+        while time[xind[k]] - time[xind[i]] < 1 / fmin and k < len(xind) - 1:
+            k += 1
+        s_lfp = lfp[xind[i] : xind[k]]
+        s_p2p = np.abs(np.max(s_lfp) - np.min(s_lfp))
+
+        if s_p2p >= 0.15 * p2p:
+            s_psd, f = fft_psd(s_lfp, fs)
+            if np.sum(s_psd[np.logical_and(f >= fmin, f <= fmax)]) > 0.2 * np.sum(
+                s_psd
+            ):
+                s_phase = ephase[
+                    np.logical_and(
+                        event_stamp > time[xind[i]], event_stamp <= time[xind[k]]
+                    )
+                ]
+                phCount += np.histogram(s_phase, bins=bins, range=[0, 360])[0]
+        i = k
+
+    xm = np.sum(phCount * np.cos(phBins * np.pi / 180))
+    ym = np.sum(phCount * np.sin(phBins * np.pi / 180))
+    mean_theta = np.arctan2(ym, xm) * 180 / np.pi
+    if mean_theta < 0:
+        mean_theta += 360
+    mean_rho = np.sqrt(xm**2 + ym**2)
+    return mean_theta, mean_rho, mean_rho / np.sum(phCount)
+
+
+def main(number_of_shuffles=500, duration_mins=20, num_spikes=2000, fs=250):
+    rng = np.random.default_rng(0)
+    time = np.arange(int(duration_mins * 60 * fs)) / fs
+    envelope = 1 + np.sin(2 * np.pi * 0.05 * time)
+    lfp = envelope * np.sin(2 * np.pi * 8 * time) + rng.normal(0, 0.5, time.size)
+    # Spikes locked to the 8 Hz peaks, with jitter
+    peaks = (np.arange(int(time[-1] * 8)) + 0.25) / 8
+    spike_train = np.sort(rng.choice(peaks, num_spikes, replace=False))
+    spike_train += rng.normal(0, 0.01, num_spikes)
+    spike_train = np.sort(np.clip(spike_train, 0, time[-1]))
+    shifts = rng.uniform(20, time[-1] - 20, size=number_of_shuffles)
+    shuffled_times = np.array([np.sort((spike_train + s) % time[-1]) for s in shifts])
+
+    t0 = perf_counter()
+    phases = SpikePhase(lfp, time, fs, fwin=(6, 10))
+    _, results = phases.phase_dist(spike_train)
+    new_ci = phases.shuffle_ci(shuffled_times)
+    t_new = perf_counter() - t0
+
+    t0 = perf_counter()
+    observed = legacy_phase_dist(lfp, time, fs, spike_train)
+    old_resultants = [
+        legacy_phase_dist(lfp, time, fs, spike_times)[2]
+        for spike_times in shuffled_times
+    ]
+    old_ci = np.percentile(old_resultants, 95)
+    t_old = perf_counter() - t0
+
+    # The phase is stored as float32, so allow for spikes changing bins
+    assert np.isclose(results["LFP Spike Mean Phase"], observed[0], atol=0.1)
+    assert np.isclose(results["LFP Spike Mean Phase Count"], observed[1], rtol=1e-2)
+    assert np.isclose(results["LFP Spike Phase Res Vect"], observed[2], atol=1e-3)
+    new_resultants = phases.phase_stats(shuffled_times)["resultant"]
+    assert np.allclose(new_resultants, old_resultants, atol=1e-3)
+    assert np.isclose(new_ci, old_ci, atol=1e-3)
+
+    print(
+        "{} shuffles per cell: legacy {:.2f}s, cached {:.2f}s ({:.0f}x)".format(
+            number_of_shuffles, t_old, t_new, t_old / t_new
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import sys
+
+sys.path.insert(0, "..")
+from functools import reduce
+from time import perf_counter
+
+import numpy as np
+from scipy.fftpack import fft
+import scipy.signal as sg
+
+from lfp_atn_simuran.Scripts.spike_shuffle import SpikeLfpShuffle, bootstrap_picks
+
+
+def legacy_plv(lfp, time, fs, event_stamp, nfft=1024, fwin=(0, 20)):
+    """NLfp.plv(mode=None) from NeuroChaT, returning the SFC."""
+    window = np.array([-0.5, 0.5])
+    win = np.ceil(window * fs).astype(int)
+    win = np.arange(win[0], win[1])
+    slep_win = sg.windows.hann(win.size, False)
+    f = np.arange(0, fs, fs / nfft)[0 : int(nfft / 2) + 1]
+    ind = np.nonzero(np.logical_and(f >= fwin[0], f <= fwin[1]))[0]
+
+    center = time.searchsorted(event_stamp)
+    center = np.array(
+        [
+            center[i]
+            for i in range(0, len(event_stamp))
+            if center[i] + win[0] >= 0 and center[i] + win[-1] < time.size
+        ]
+    )
+    sta = reduce(lambda y, x: y + lfp[x + win], center) / center.size
+    f_sta = fft(np.multiply(sta, slep_win), nfft)
+    f_sta = np.absolute(f_sta[0 : int(nfft / 2) + 1]) ** 2 / nfft ** 2
+    f_sta[1:-1] = 2 * f_sta[1:-1]
+    f_lfp = np.array([fft(np.multiply(lfp[x + win], slep_win), nfft) for x in center])
+    stp = np.absolute(f_lfp[:, 0 : int(nfft / 2) + 1]) ** 2 / nfft ** 2
+    stp[:, 1:-1] = 2 * stp[:, 1:-1]
+    stp = stp.mean(0)
+    return (np.divide(f_sta, stp) * 100)[ind]
+
+
+def legacy_shuffle_sfc(lfp, time, fs, shuffled_times, picks):
+    """The per shuffle NLfp.plv(mode="bs", nrep=20) loop used previously."""
+    result = []
+    for spike_times, pick in zip(shuffled_times, picks):
+        sfc = [legacy_plv(lfp, time, fs, spike_times[p]) for p in pick]
+        result.append(np.mean(sfc, axis=0))
+    return np.array(result)
+
+
+def main(number_of_shuffles=500, duration_mins=20, num_spikes=2000, fs=250):
+    rng = np.random.default_rng(0)
+    time = np.arange(int(duration_mins * 60 * fs)) / fs
+    lfp = np.sin(2 * np.pi * 8 * time) + rng.normal(0, 0.5, size=time.size)
+    spike_train = np.sort(rng.uniform(0, time[-1], size=num_spikes))
+    shifts = rng.uniform(20, time[-1] - 20, size=number_of_shuffles)
+    shuffled_times = [np.sort((spike_train + s) % time[-1]) for s in shifts]
+    picks = [bootstrap_picks(num_spikes, rng=rng) for _ in shuffled_times]
+
+    engine = SpikeLfpShuffle(lfp, time, fs, fwin=(0, 20))
+    t0 = perf_counter()
+    new = engine.bootstrap_sfc(shuffled_times, picks=picks)
+    t_new = perf_counter() - t0
+
+    t0 = perf_counter()
+    old = legacy_shuffle_sfc(lfp, time, fs, shuffled_times, picks)
+    t_old = perf_counter() - t0
+    assert np.allclose(old, new, rtol=1e-8)
+
+    print(
+        "{} shuffles per cell: legacy {:.2f}s, batched {:.2f}s ({:.0f}x)".format(
+            number_of_shuffles, t_old, t_new, t_old / t_new
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Write small synthetic Axona recordings for benchmarks and comparisons."""
+import os
+
+import numpy as np
+
+
+def write_set_file(set_file, num_eeg=1, gain=2000, fullscale_mv=1500):
+    """Write a minimal .set file mapping eeg i to channel i."""
+    lines = [
+        "trial_date Tuesday, 1 Dec 2017",
+        "trial_time 10:58:00",
+        "experimenter synthetic",
+        "duration 600",
+        "ADC_fullscale_mv {}".format(fullscale_mv),
+    ]
+    for i in range(64):
+        lines.append("gain_ch_{} {}".format(i, gain))
+    for i in range(1, num_eeg + 1):
+        lines.append("EEG_ch_{} {}".format(i, i))
+        lines.append("saveEEG_ch_{} 1".format(i))
+    with open(set_file, "w") as f:
+        f.write("\r\n".join(lines) + "\r\n")
+
+
+def write_lfp_file(file_name, samples, sampling_rate=250, bytes_per_sample=1):
+    """Write signed integer samples as an Axona .eeg (1 byte) or .egf (2 bytes)."""
+    ext = os.path.splitext(file_name)[1][1:4].upper()
+    header = [
+        "trial_date Tuesday, 1 Dec 2017",
+        "trial_time 10:58:00",
+        "experimenter synthetic",
+        "duration {}".format(len(samples) // sampling_rate),
+        "num_chans 1",
+        "sw_version 1.2.2.16",
+        "sample_rate {}.0 hz".format(sampling_rate),
+        "bytes_per_sample {}".format(bytes_per_sample),
+        "num_{}_samples {}".format(ext, len(samples)),
+    ]
+    dtype = "i1" if bytes_per_sample == 1 else "<i2"
+    with open(file_name, "wb") as f:
+        f.write(("\r\n".join(header) + "\r\ndata_start").encode("latin-1"))
+        f.write(np.asarray(samples, dtype=dtype).tobytes())
+        f.write(b"\r\ndata_end\r\n")
+
+
+def random_lfp(num_samples, bytes_per_sample=1, seed=0):
+    """Random samples covering the full signed range."""
+    rng = np.random.default_rng(seed)
+    bits = 8 * bytes_per_sample
+    low, high = -(2 ** (bits - 1)), 2 ** (bits - 1)
+    return rng.integers(low, high, size=num_samples)
+
+
+def write_pos_file(file_name, big_xy, small_xy, pixels_per_metre=300):
+    """Write 2-spot position data as an Axona .pos file."""
+    num_samples = len(big_xy[0])
+    header = [
+        "trial_date Tuesday, 1 Dec 2017",
+        "trial_time 10:58:00",
+        "num_colours 4",
+        "min_x 0",
+        "max_x 500",
+        "min_y 0",
+        "max_y 500",
+        "window_min_x 0",
+        "window_max_x 500",
+        "window_min_y 0",
+        "window_max_y 500",
+        "timebase 50 hz",
+        "bytes_per_timestamp 4",
+        "sample_rate 50.0 hz",
+        "pos_format t,x1,y1,x2,y2,numpix1,numpix2",
+        "bytes_per_coord 2",
+        "pixels_per_metre {}".format(pixels_per_metre),
+        "num_pos_samples {}".format(num_samples),
+    ]
+    records = np.zeros((num_samples, 10), dtype=">u2")
+    records[:, 1] = np.arange(num_samples)
+    records[:, 2], records[:, 3] = big_xy
+    records[:, 4], records[:, 5] = small_xy
+    records[:, 6:8] = 10
+    with open(file_name, "wb") as f:
+        f.write(("\r\n".join(header) + "\r\ndata_start").encode("latin-1"))
+        f.write(records.tobytes())
+        f.write(b"\r\ndata_end\r\n")
+
+
+def random_walk_pos(num_samples, missing_fraction=0.05, seed=0):
+    """Random walk of two LEDs 12 pixels apart, with some untracked points."""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 1.5, size=(2, num_samples))
+    big = np.clip(np.cumsum(steps, axis=1) + 250, 20, 480)
+    angle = np.cumsum(rng.normal(0, 0.05, size=num_samples))
+    small = big + 12 * np.array([np.cos(angle), np.sin(angle)])
+    big, small = np.round(big).astype(int), np.round(small).astype(int)
+
+    for xy in (big, small):
+        missing = rng.random(num_samples) < missing_fraction
+        xy[:, missing] = 1023
+    # A few large jumps to be removed by the speed filter
+    jumps = rng.integers(0, num_samples, size=10)
+    big[:, jumps] = 1
+    return big, small
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, "..")
+import numpy as np
+import pandas as pd
+
+from lfp_atn_simuran.tmaze.t_maze_analyse import session_key, load_shard, save_shard
+
+
+def main():
+    params = {"theta": (6, 10), "clean_method": "avg", "clean_kwargs": {}}
+    df = pd.DataFrame(
+        {"location": ["a", "a", "b", "b"], "passed": ["Y", "Y", "N", "N"]}
+    )
+    rows = list(df.itertuples())
+    key_a = session_key(rows[0], rows[1], params)
+    key_b = session_key(rows[2], rows[3], params)
+    assert key_a != key_b
+
+    # A row added above a session does not change its key
+    df = pd.concat([pd.DataFrame({"location": ["c"], "passed": ["Y"]}), df])
+    moved = list(df.reset_index(drop=True).itertuples())
+    assert session_key(moved[1], moved[2], params) == key_a
+
+    # Any change to the rows or params does
+    assert session_key(rows[0], rows[3], params) != key_a
+    assert session_key(rows[0], rows[1], dict(params, theta=(6, 11))) != key_a
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shard_file = os.path.join(tmp, key_a + ".pkl")
+        assert load_shard(shard_file) is None
+        shard = {"results": df, "group": "Control", "choice_theta": [np.ones(3)]}
+        save_shard(shard, shard_file)
+        loaded = load_shard(shard_file)
+        assert loaded["results"].equals(df)
+        assert loaded["group"] == "Control"
+        assert os.listdir(tmp) == [key_a + ".pkl"]
+    print("T-maze session shards passed")
+
+
+if __name__ == "__main__":
+    main()